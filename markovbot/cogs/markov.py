@@ -1,5 +1,6 @@
 """Commands designed to spam the chat with various things."""
 
+import asyncio
 import datetime
 from collections import defaultdict
 
@@ -10,8 +11,13 @@ from markovbot.lib import markov
 from markovbot.lib.config import BotConfig
 from markovbot.lib.custom_cog import CustomCog
 from markovbot.lib.custom_command import slash_command_with_cooldown
-from markovbot.lib.markov import MARKOV_MODEL, generate_text_from_markov_chain, update_markov_chain_for_model
+from markovbot.lib.error import deferred_error_message
+from markovbot.lib.markov import MARKOV_MODEL, update_markov_chain_for_model
+from markovbot.lib.markov_bank import MarkovBank, bank_targets, build_markov_bank
+from markovbot.lib.markov_latency import generate_within_budget
+from markovbot.lib.markov_pool import MarkovWorkerPool
 from markovbot.lib.messages import send_message_to_channel
+from markovbot.lib.text_normalisation import normalise_for_learning
 
 
 class Markov(CustomCog):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
@@ -36,7 +42,9 @@ class Markov(CustomCog):  # pylint: disable=too-many-instance-attributes,too-man
 
         self.attempts = attempts
         self.messages = []
-        self.markov_training_sample = {}
+        self.markov_update = None
+        self.markov_update_lock = asyncio.Lock()
+        self.markov_bank_refresh = None
         self.cooldowns = defaultdict(
             lambda: {"count": 0, "last_interaction": datetime.datetime.now(tz=datetime.UTC)},
         )
@@ -44,13 +52,23 @@ class Markov(CustomCog):  # pylint: disable=too-many-instance-attributes,too-man
         # If no markov model, don't start the loop.
         if MARKOV_MODEL:
             self.markov_chain_update_loop.start()  # pylint: disable=no-member
+        if self.bot.markov_cache:
+            self.refill_markov_cache_loop.start()  # pylint: disable=no-member
+        if self.bot.markov_window:
+            self.expire_markov_window_loop.start()  # pylint: disable=no-member
 
-    @staticmethod
     async def send_markov_response(
-        message: disnake.Message, seed_word: str, *, dont_tag_user: bool = False
+        self, message: disnake.Message, seed_word: str, *, dont_tag_user: bool = False
     ) -> list[disnake.Message]:
         """Send a fallback response using the markov chain.
 
+        If the message's guild, channel or user has its own chain which knows
+        the seed word, the sentence is generated from it. Otherwise, a
+        pre-generated sentence is used if there is one cached for the seed
+        word, or a sentence is generated in the Markov worker pool. If
+        generation runs over the latency budget, a sentence from the Markov
+        bank is used instead, and no response is sent if there is none.
+
         Parameters
         ----------
         message : disnake.Message
@@ -61,12 +79,73 @@ class Markov(CustomCog):  # pylint: disable=too-many-instance-attributes,too-man
             Whether or not to tag the user or not, optional
 
         """
+        partition = await self.partition_for_message(message, seed_word)
+        sentence = self.bot.markov_cache.get(seed_word) if self.bot.markov_cache and not partition else None
+        if sentence is None:
+            sentence = await generate_within_budget(
+                lambda budget: self.bot.markov_pool.generate(seed_word, timeout=budget, partition=partition),
+                lambda: self.fallback_sentence(seed_word, use_cache=bool(partition)),
+                self.bot.markov_latency,
+                seed_word,
+            )
+        if sentence is None:
+            return []
+
         return await send_message_to_channel(
-            generate_text_from_markov_chain(MARKOV_MODEL, seed_word, 1),
+            sentence,
             message,
             dont_tag_user=dont_tag_user,  # In a DM, we won't @ the user
         )
 
+    def fallback_sentence(self, seed_word: str | None, *, use_cache: bool = True) -> str | None:
+        """Get a sentence for when generation runs over its latency budget.
+
+        Parameters
+        ----------
+        seed_word : str | None
+            The seed word, or None for a random sentence.
+        use_cache : bool
+            Whether to look for a cached sentence first. This is False when
+            the cache has already been checked.
+
+        Returns
+        -------
+        str | None
+            A cached sentence for the seed word, or a sentence from the
+            Markov bank for the seed word, or a random one from the bank.
+            None if there is no sentence.
+
+        """
+        sentence = self.bot.markov_cache.get(seed_word) if self.bot.markov_cache and use_cache else None
+        if sentence is None and markov.MARKOV_BANK:
+            sentence = markov.MARKOV_BANK.random_sentence(seed_word or markov.BANK_RANDOM_SEED)
+        if sentence is None and markov.MARKOV_BANK:
+            sentence = markov.MARKOV_BANK.random_sentence(markov.BANK_RANDOM_SEED)
+
+        return sentence
+
+    async def partition_for_message(self, message: disnake.Message, seed_word: str | None) -> tuple[str, int] | None:
+        """Get the partition chain to respond to a message with.
+
+        Parameters
+        ----------
+        message : disnake.Message
+            The message to respond to.
+        seed_word : str | None
+            The seed word for sentence generation.
+
+        Returns
+        -------
+        tuple[str, int] | None
+            The partition, or None to use the global chain.
+
+        """
+        partitions = self.bot.markov_partitions
+        if not partitions:
+            return None
+        key = partitions.key_for(message.guild.id if message.guild else None, message.channel.id, message.author.id)
+        return await partitions.resolve(key, seed_word)
+
     async def is_on_cooldown(self, user_id: int) -> bool:
         """Check if the user is on cooldown."""
         user_data = self.cooldowns[user_id]
@@ -115,8 +194,8 @@ class Markov(CustomCog):  # pylint: disable=too-many-instance-attributes,too-man
             ):
                 return
             await self.update_cooldown(message.author.id)
-            self.messages.append(
-                *await self.send_markov_response(message, message.content.split()[0][1:], dont_tag_user=True)
+            self.messages.extend(
+                await self.send_markov_response(message, message.content.split()[0][1:], dont_tag_user=True)
             )
             return
 
@@ -124,6 +203,9 @@ class Markov(CustomCog):  # pylint: disable=too-many-instance-attributes,too-man
     async def add_message_to_markov_training_sample(self, message: disnake.Message) -> None:
         """Record messages for the Markov chain to learn.
 
+        Messages are normalised for learning as they arrive, and messages
+        which repeat, or nearly repeat, a recent message are not recorded.
+
         Parameters
         ----------
         message: disnake.Message
@@ -134,12 +216,55 @@ class Markov(CustomCog):  # pylint: disable=too-many-instance-attributes,too-man
             return
         if message.author.bot:
             return
-        self.markov_training_sample[message.id] = message.clean_content
+        self.add_to_markov_training_sample(
+            message.id,
+            normalise_for_learning(message.content),
+            message.guild.id if message.guild else None,
+            message.channel.id,
+            message.author.id,
+        )
+
+    def add_to_markov_training_sample(
+        self, message_id: int, text: str | None, guild_id: int | None, channel_id: int, author_id: int
+    ) -> None:
+        """Add the text of a message to the training sample, unless it is a duplicate.
+
+        The normalised text is what is fingerprinted, sampled and recorded in
+        the journal, so the text which is forgotten later is exactly the text
+        which was learnt.
+
+        Parameters
+        ----------
+        message_id: int
+            The id of the message.
+        text: str | None
+            The text of the message normalised for learning, or None if it
+            should not be learnt.
+        guild_id: int | None
+            The guild the message was sent in, or None for a DM.
+        channel_id: int
+            The channel the message was sent in.
+        author_id: int
+            The author of the message.
+
+        """
+        if text is None or (self.bot.markov_dedup is not None and self.bot.markov_dedup.is_duplicate(text)):
+            # An edited message which now repeats another is not learnt with its old text either
+            self.bot.markov_training_sample.remove(message_id)
+            return
+        key = None
+        if self.bot.markov_partitions:
+            key = self.bot.markov_partitions.key_for(guild_id, channel_id, author_id)
+        self.bot.markov_training_sample.add(message_id, text, key)
+        self.start_markov_chain_update()
 
     @commands.Cog.listener("on_raw_message_delete")
     async def remove_message_from_markov_training_sample(self, payload: disnake.RawMessageDeleteEvent) -> None:
         """Remove a deleted message from the Markov training sentences.
 
+        If the chain has already learnt the message, it is marked in the
+        journal to be forgotten by the next update.
+
         Parameters
         ----------
         payload: disnake.RawMessageDeleteEvent
@@ -149,19 +274,48 @@ class Markov(CustomCog):  # pylint: disable=too-many-instance-attributes,too-man
         if not BotConfig.get_config("ENABLE_MARKOV_TRAINING"):
             return
 
-        message = payload.cached_message
+        self.bot.markov_training_sample.remove(payload.message_id)
+        if self.bot.markov_journal is not None:
+            self.bot.markov_journal.forget(payload.message_id)
 
-        # if the message isn't cached, for some reason, we can fetch the channel
-        # and the message from the channel
-        if message is None:
-            channel = await self.BotConfig.fetch_channel(int(payload.channel_id))
-            try:
-                message = await channel.fetch_message(int(payload.message_id))
-            except disnake.NotFound:
-                Markov.logger.exception("Unable to fetch message %d", payload.message_id)
-                return
+    @commands.Cog.listener("on_raw_message_edit")
+    async def relearn_edited_message(self, payload: disnake.RawMessageUpdateEvent) -> None:
+        """Replace the text of an edited message in the Markov training sentences.
+
+        The raw event is used, so edits to messages which are no longer
+        cached are seen too. The old text is taken from the training sample,
+        or from the journal if the chain has already learnt the message, in
+        which case the old text is forgotten and the new text is learnt by
+        the next update.
+
+        Parameters
+        ----------
+        payload: disnake.RawMessageUpdateEvent
+            The payload containing the edited message.
+
+        """
+        if not BotConfig.get_config("ENABLE_MARKOV_TRAINING"):
+            return
+        content = payload.data.get("content")
+        author = payload.data.get("author")
+        if content is None or author is None:  # e.g. an update which only adds an embed
+            return
 
-        self.markov_training_sample.pop(message.id, None)
+        journal = self.bot.markov_journal
+        text = normalise_for_learning(content)
+        old_text = self.bot.markov_training_sample.messages.get(payload.message_id)
+        if old_text is None and journal is not None:
+            old_text = journal.get(payload.message_id)
+        if old_text is None or old_text == text:
+            return
+
+        if payload.message_id not in self.bot.markov_training_sample:
+            journal.forget(payload.message_id)
+        if self.bot.markov_dedup is not None:
+            self.bot.markov_dedup.forget(old_text)
+        self.add_to_markov_training_sample(
+            payload.message_id, text, payload.guild_id, payload.channel_id, int(author["id"])
+        )
 
     # Slash commands -----------------------------------------------------------
 
@@ -195,6 +349,62 @@ class Markov(CustomCog):  # pylint: disable=too-many-instance-attributes,too-man
             f"{inter.user.display_name} made me delete my messages :frowning2:",
         )
 
+    @slash_command_with_cooldown(
+        name="sentence",
+        description="Generate a sentence using a Markov chain",
+    )
+    async def sentence(
+        self,
+        inter: disnake.ApplicationCommandInteraction,
+        seed_word: str = commands.Param(
+            default=None,
+            description="A word, or the start of a sentence, to generate the sentence from",
+        ),
+        state_size: int = commands.Param(
+            default=None,
+            description="The state size of the chain, larger sizes are less random",
+            min_value=1,
+            max_value=4,
+        ),
+    ) -> None:
+        """Generate a sentence with the chain of the requested state size.
+
+        Parameters
+        ----------
+        inter: disnake.ApplicationCommandInteraction
+            The interaction to respond to.
+        seed_word: str
+            The seed word, or None for a random sentence.
+        state_size: int
+            The state size of the chain to use, or None for the chain of the
+            guild, channel or user if there is one, and otherwise the default
+            chain.
+
+        """
+        registry = self.bot.markov_registry
+        if state_size is not None and (registry is None or state_size not in registry.state_sizes):
+            await inter.response.send_message(f"There is no Markov chain with state size {state_size}.", ephemeral=True)
+            return
+
+        await inter.response.defer()
+        partition = None
+        if state_size is None and self.bot.markov_partitions:
+            key = self.bot.markov_partitions.key_for(inter.guild_id, inter.channel_id, inter.author.id)
+            partition = await self.bot.markov_partitions.resolve(key, seed_word)
+        sentence = await generate_within_budget(
+            lambda budget: self.bot.markov_pool.generate(
+                seed_word, timeout=budget, state_size=state_size, partition=partition
+            ),
+            lambda: self.fallback_sentence(seed_word),
+            self.bot.markov_latency,
+            seed_word,
+        )
+        if sentence is None:
+            await deferred_error_message(inter, "The Markov chain took too long to think of a sentence.")
+            return
+
+        await inter.edit_original_message(content=sentence)
+
     @slash_command_with_cooldown(
         name="update_markov_chain",
         description="force update the markov chain for /sentence",
@@ -218,31 +428,305 @@ class Markov(CustomCog):  # pylint: disable=too-many-instance-attributes,too-man
         """
         if not BotConfig.get_config("ENABLE_MARKOV_TRAINING"):
             await inter.response.send_message("Updating the Markov Chain has been disabled.")
+            return
+        await inter.response.defer(ephemeral=True)
+
+        version = markov.MARKOV_MODEL_VERSION
+        if await self.update_and_publish_model(inter) and version != markov.MARKOV_MODEL_VERSION:
+            await inter.edit_original_message(
+                f"Markov chain has been updated to version {markov.MARKOV_MODEL_VERSION} "
+                f"(swap took {markov.MARKOV_SWAP_LATENCY * 1e6:.1f} us)."
+            )
+
+    async def update_and_publish_model(self, inter: disnake.ApplicationCommandInteraction | None) -> bool:
+        """Train the Markov chain on the training sample and publish it.
+
+        The sample is taken before training starts, so messages which arrive
+        while the chain is training are kept for the next update, and its log
+        is kept until the update has finished. If the update fails, the
+        sample is put back to be learnt by the next update. Only one update
+        runs at a time. If the bot has a sliding window chain, the sample is
+        added to the window instead of the full chain. Once the chain has
+        been updated, the partition chains are updated with the messages from
+        their guild, channel or user.
+
+        The global chain also forgets the messages which have been deleted or
+        edited since they were learnt, and the sample is recorded in the
+        journal so it can be forgotten later.
+
+        Parameters
+        ----------
+        inter: disnake.ApplicationCommandInteraction | None
+            The interaction to respond to, or None.
+
+        Returns
+        -------
+        bool
+            True if the chain was updated.
+
+        """
+        async with self.markov_update_lock:
+            sample, sample_partitions = self.bot.markov_training_sample.take()
+            dedup = self.bot.markov_dedup
+            if dedup is not None:
+                self.logger.info(
+                    "Rejected %d of %d messages as duplicates since starting (%d exact, %d near)",
+                    dedup.num_rejected,
+                    dedup.num_seen,
+                    dedup.num_exact,
+                    dedup.num_near,
+                )
+            try:
+                updated = await self.update_and_publish_sample(inter, sample, sample_partitions)
+            except Exception:
+                self.bot.markov_training_sample.restore(sample, sample_partitions)
+                raise
+            # The sample is only dropped if it was learnt, or there was nothing in it to learn
+            if updated or not sample:
+                self.bot.markov_training_sample.finish_training()
+            else:
+                self.logger.warning("The Markov chain update failed, keeping %d messages for the next one", len(sample))
+                self.bot.markov_training_sample.restore(sample, sample_partitions)
+
+            return updated
+
+    async def update_and_publish_sample(
+        self,
+        inter: disnake.ApplicationCommandInteraction | None,
+        sample: dict[int, str],
+        sample_partitions: dict[int, tuple[str, int]],
+    ) -> bool:
+        """Train the Markov chains on a sample, and publish the global chain.
+
+        Parameters
+        ----------
+        inter: disnake.ApplicationCommandInteraction | None
+            The interaction to respond to, or None.
+        sample: dict[int, str]
+            The text of each new message, keyed by message id.
+        sample_partitions: dict[int, tuple[str, int]]
+            The partition of each new message which belongs to one.
+
+        Returns
+        -------
+        bool
+            True if the chain was updated, or the messages learnt and
+            forgotten cancel out so the chain did not change.
+
+        """
+        new_messages = list(sample.values())
+        partition_messages = defaultdict(list)
+        for message_id, key in sample_partitions.items():
+            partition_messages[key].append(sample[message_id])
+        if self.bot.markov_window:
+            updated_model = await self.bot.markov_window.update(new_messages, normalised=True)
+            if updated_model is None and inter:
+                await deferred_error_message(inter, "No new messages to update chain with.")
+            chain_location = self.bot.markov_window.view_location
         else:
-            await inter.response.defer(ephemeral=True)
+            updated_model = await self.update_and_unlearn(inter, sample)
+            chain_location = BotConfig.get_config("CURRENT_MARKOV_CHAIN")
+        if updated_model is None:
+            return False
+        num_partitions_updated = await self.update_partitions(partition_messages)
+        if updated_model is markov.MARKOV_CHAIN_UNCHANGED:
+            # Nothing generated from the global chain has changed, so only the partitions need the new workers
+            if num_partitions_updated:
+                self.bot.markov_pool.restart()
+            return True
+
+        if self.bot.markov_window:
+            markov.publish_markov_model(updated_model)
+        if self.bot.markov_registry:
+            self.bot.markov_registry.put(updated_model, chain_location)
+        # After the partitions are updated, so the workers do not keep serving the old partition chains
+        self.bot.markov_pool.restart()
+        if self.bot.markov_cache:
+            self.bot.markov_cache.invalidate()
+        self.start_markov_bank_refresh()
+
+        return True
+
+    async def update_partitions(self, partition_messages: dict[tuple[str, int], list[str]]) -> int:
+        """Update the partition chains, after the global chain has been updated.
 
-        await update_markov_chain_for_model(
-            inter,
-            markov.MARKOV_MODEL,
-            list(self.markov_training_sample.values()),
-            BotConfig.get_config("CURRENT_MARKOV_CHAIN"),
+        Parameters
+        ----------
+        partition_messages: dict[tuple[str, int], list[str]]
+            The new messages for each partition.
+
+        Returns
+        -------
+        int
+            The number of partitions which were updated or created.
+
+        """
+        if not self.bot.markov_partitions or not partition_messages:
+            return 0
+        try:
+            return await self.bot.markov_partitions.update(partition_messages, normalised=True)
+        except Exception:
+            # The global chain has learnt the sample, so it is not put back to be learnt again
+            self.logger.exception("Failed to update the Markov partitions")
+            return 0
+
+    async def update_and_unlearn(
+        self, inter: disnake.ApplicationCommandInteraction | None, sample: dict[int, str]
+    ) -> markov.CompactText | object | None:
+        """Update the global chain with new messages, and forget deleted ones.
+
+        Parameters
+        ----------
+        inter: disnake.ApplicationCommandInteraction | None
+            The interaction to respond to, or None.
+        sample: dict[int, str]
+            The text of each new message, keyed by message id.
+
+        Returns
+        -------
+        markov.CompactText | object | None
+            The updated model, MARKOV_CHAIN_UNCHANGED if the chain did not
+            change, or None if the chain was not updated.
+
+        """
+        journal = self.bot.markov_journal
+        forgotten = {}
+        if journal is not None:
+            forgotten = journal.forgotten()
+            journal.record(sample)
+        updated_model = None
+        try:
+            updated_model = await update_markov_chain_for_model(
+                inter,
+                markov.MARKOV_MODEL,
+                list(sample.values()),
+                BotConfig.get_config("CURRENT_MARKOV_CHAIN"),
+                list(forgotten.values()),
+                normalised=True,
+            )
+        finally:
+            # If the chain was not updated, the sample was not learnt and nothing was forgotten
+            if journal is not None and updated_model is None:
+                journal.remove(sample)
+                journal.record(forgotten, forgotten=True)
+            elif journal is not None:
+                journal.remove_forgotten(forgotten)
+
+        return updated_model
+
+    def start_markov_bank_refresh(self) -> None:
+        """Regenerate the Markov sentence bank from the current model.
+
+        The bank is rebuilt in the background by a worker forked for the
+        refresh, so it does not hold up the worker pool which generates
+        sentences for commands, and replaces the old bank once it has been
+        written. Nothing is done unless MARKOV_BANK_REFRESH_AFTER_UPDATE is
+        set, or if the last refresh is still running.
+        """
+        if not BotConfig.get_config("MARKOV_BANK_REFRESH_AFTER_UPDATE"):
+            return
+        if self.markov_bank_refresh and not self.markov_bank_refresh.done():
+            self.logger.info("The Markov bank is still being refreshed, skipping refresh")
+            return
+
+        async def refresh() -> None:
+            # One worker, or a thread if the bot generates sentences in threads
+            pool = MarkovWorkerPool(
+                min(self.bot.markov_pool.num_workers, 1),
+                registry=self.bot.markov_registry,
+                partitions=self.bot.markov_partitions,
+            )
+            try:
+                targets = bank_targets(
+                    markov.MARKOV_MODEL,
+                    BotConfig.get_config("MARKOV_BANK_SEED_FILE"),
+                    BotConfig.get_config("MARKOV_BANK_TOP_SEEDS"),
+                    BotConfig.get_config("MARKOV_BANK_SENTENCES_PER_SEED"),
+                    BotConfig.get_config("MARKOV_BANK_RANDOM_SENTENCES"),
+                )
+                markov.MARKOV_BANK = await build_markov_bank(
+                    MarkovBank.load(BotConfig.get_config("MARKOV_BANK_FILE")),
+                    targets,
+                    pool.generate,
+                    max(pool.num_workers, 1),
+                    refresh=True,
+                )
+            except Exception:
+                self.logger.exception("Failed to refresh the Markov bank")
+            finally:
+                await pool.shutdown()
+
+        self.markov_bank_refresh = asyncio.create_task(refresh())
+
+    def markov_chain_update_is_due(self) -> bool:
+        """Check if the training sample is large or old enough to be learnt.
+
+        Returns
+        -------
+        bool
+            True if the sample has MARKOV_UPDATE_AFTER_MESSAGES messages or
+            MARKOV_UPDATE_AFTER_BYTES bytes of text, or its oldest message is
+            older than MARKOV_UPDATE_MAX_AGE seconds.
+
+        """
+        sample = self.bot.markov_training_sample
+        return len(sample) > 0 and (
+            len(sample) >= BotConfig.get_config("MARKOV_UPDATE_AFTER_MESSAGES")
+            or sample.num_bytes >= BotConfig.get_config("MARKOV_UPDATE_AFTER_BYTES")
+            or sample.age >= BotConfig.get_config("MARKOV_UPDATE_MAX_AGE")
         )
-        self.markov_training_sample.clear()
 
-        await inter.edit_original_message("Markov chain has been updated.")
+    def start_markov_chain_update(self) -> None:
+        """Update the chain in the background, if an update is due.
 
-    @tasks.loop(hours=6)
+        Nothing is done if there is no chain, or if the last update is still
+        running.
+        """
+        if not MARKOV_MODEL or not self.markov_chain_update_is_due():
+            return
+        if self.markov_update and not self.markov_update.done():
+            return
+
+        async def update() -> None:
+            try:
+                await self.update_and_publish_model(None)
+            except Exception:
+                self.logger.exception("Failed to update the Markov chain")
+
+        self.markov_update = asyncio.create_task(update())
+
+    @tasks.loop(minutes=1)
     async def markov_chain_update_loop(self) -> None:
-        """Get the bot to update the chain every 6 hours."""
+        """Update the chain when the training sample has been waiting too long."""
         if not BotConfig.get_config("ENABLE_MARKOV_TRAINING"):
             return
-        await update_markov_chain_for_model(
-            None,
-            markov.MARKOV_MODEL,
-            list(self.markov_training_sample.values()),
-            BotConfig.get_config("CURRENT_MARKOV_CHAIN"),
-        )
-        self.markov_training_sample.clear()
+        self.start_markov_chain_update()
+
+    @tasks.loop(hours=24)
+    async def expire_markov_window_loop(self) -> None:
+        """Drop the weeks which have fallen out of the sliding window chain."""
+        async with self.markov_update_lock:
+            updated_model = await self.bot.markov_window.drop_expired()
+            if updated_model is None:
+                return
+            chain_location = self.bot.markov_window.view_location
+            if updated_model.chain.num_states == 0:
+                self.logger.info("The Markov window is empty, using the full chain until it has been trained")
+                chain_location = BotConfig.get_config("CURRENT_MARKOV_CHAIN")
+                updated_model = await asyncio.to_thread(
+                    markov.load_markov_model, chain_location, BotConfig.get_config("MARKOV_DEFAULT_STATE_SIZE")
+                )
+            markov.publish_markov_model(updated_model)
+            if self.bot.markov_registry:
+                self.bot.markov_registry.put(updated_model, chain_location)
+            self.bot.markov_pool.restart()
+            if self.bot.markov_cache:
+                self.bot.markov_cache.invalidate()
+
+    @tasks.loop(seconds=1)
+    async def refill_markov_cache_loop(self) -> None:
+        """Top up the pre-generated sentences for recently used seed words."""
+        await self.bot.markov_cache.refill(BotConfig.get_config("MARKOV_CACHE_REFILL_BATCH"))
 
 
 def setup(bot: commands.InteractionBot) -> None:
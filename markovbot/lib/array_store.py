@@ -0,0 +1,380 @@
+"""Versioned on-disk container for named numpy arrays.
+
+This is the storage format used for compact Markov chains. A file consists
+of a fixed-size prefix, a JSON header and the raw array data:
+
+    magic (8 bytes) | format version (uint32) | header length (uint32)
+    header (JSON, UTF-8)
+    padding to 64 bytes, then each array aligned to 64 bytes
+
+The header records the dtype, shape and offset of every array, plus any
+metadata the writer wants to keep alongside them. Each array's data is split
+into chunks of CHUNK_BYTES, and the header records the CRC32 of every chunk.
+
+Uncompressed files are stored aligned, so `read_arrays` can memory-map the
+file and return arrays which are views onto the mapping. Nothing is read from
+disk until a page is touched, so opening a file is O(1) in its size and
+several processes mapping the same file share the same physical pages. The
+checksums are only verified when asked for, as that reads the whole file.
+
+Compressed files store each chunk compressed with zlib on its own. They are
+smaller on disk, but have to be read in full: the chunks are decompressed in
+parallel threads (zlib releases the GIL) and every chunk is verified against
+its checksum, so corruption is reported with the array and chunk it is in.
+Version 1 files, written before chunks and checksums were added, are still
+read.
+"""
+
+import json
+import mmap
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+ARRAY_FILE_MAGIC = b"MKVARRAY"
+ARRAY_FILE_VERSION = 2
+ALIGNMENT = 64
+CHUNK_BYTES = 4 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+
+_PREFIX = struct.Struct("<8sII")
+
+
+def _align(offset: int) -> int:
+    """Round an offset up to the next multiple of ALIGNMENT.
+
+    Parameters
+    ----------
+    offset : int
+        The offset to align.
+
+    Returns
+    -------
+    int
+        The aligned offset.
+
+    """
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_array_file(location: str | Path) -> bool:
+    """Check if a file is an array file, by checking its magic bytes.
+
+    Parameters
+    ----------
+    location : str | Path
+        The file to check.
+
+    Returns
+    -------
+    bool
+        True if the file starts with the array file magic bytes.
+
+    """
+    try:
+        with Path(location).open("rb") as file_in:
+            return file_in.read(len(ARRAY_FILE_MAGIC)) == ARRAY_FILE_MAGIC
+    except OSError:
+        return False
+
+
+def read_header(location: str | Path) -> dict[str, Any]:
+    """Read the header of an array file, without touching the array data.
+
+    Parameters
+    ----------
+    location : str | Path
+        The file to read.
+
+    Returns
+    -------
+    dict[str, Any]
+        The header, containing the "version", "metadata" and "arrays" keys.
+
+    """
+    with Path(location).open("rb") as file_in:
+        return _parse_header(file_in.read(_PREFIX.size), file_in.read, location)
+
+
+def _parse_header(prefix: bytes, read: callable, location: str | Path) -> dict[str, Any]:
+    """Parse and validate the prefix and header of an array file.
+
+    Parameters
+    ----------
+    prefix : bytes
+        The fixed-size prefix of the file.
+    read : callable
+        A function to read the given number of bytes following the prefix.
+    location : str | Path
+        The file being read, for error messages.
+
+    Returns
+    -------
+    dict[str, Any]
+        The header.
+
+    """
+    if len(prefix) != _PREFIX.size:
+        msg = f"{location} is too short to be an array file"
+        raise ValueError(msg)
+    magic, version, header_length = _PREFIX.unpack(prefix)
+    if magic != ARRAY_FILE_MAGIC:
+        msg = f"{location} is not an array file"
+        raise ValueError(msg)
+    if version > ARRAY_FILE_VERSION:
+        msg = f"{location} has format version {version}, but only up to {ARRAY_FILE_VERSION} is supported"
+        raise ValueError(msg)
+
+    header = json.loads(read(header_length).decode("utf-8"))
+    header["version"] = version
+    header["data_start"] = _align(_PREFIX.size + header_length)
+
+    return header
+
+
+def _byte_view(array: np.ndarray) -> np.ndarray:
+    """Get a flat uint8 view of a contiguous array.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The array, which must be C-contiguous.
+
+    Returns
+    -------
+    np.ndarray
+        The bytes of the array.
+
+    """
+    return array.reshape(-1).view(np.uint8)
+
+
+def _chunk_ranges(nbytes: int, chunk_bytes: int) -> list[tuple[int, int]]:
+    """Split a number of bytes into chunks.
+
+    Parameters
+    ----------
+    nbytes : int
+        The number of bytes to split.
+    chunk_bytes : int
+        The size of each chunk, except the last.
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        The start and end of each chunk.
+
+    """
+    return [(start, min(start + chunk_bytes, nbytes)) for start in range(0, nbytes, chunk_bytes)]
+
+
+def write_arrays(
+    location: str | Path,
+    arrays: dict[str, np.ndarray],
+    metadata: dict[str, Any] | None = None,
+    *,
+    compress: bool = False,
+    chunk_bytes: int = CHUNK_BYTES,
+) -> None:
+    """Write named arrays to an array file.
+
+    The file is written to a temporary file first and then moved into place,
+    so readers (including processes which have the old file mapped) never
+    see a partially written file.
+
+    Parameters
+    ----------
+    location : str | Path
+        The file to write.
+    arrays : dict[str, np.ndarray]
+        The arrays to write, by name.
+    metadata : dict[str, Any] | None
+        JSON serialisable metadata to store in the header.
+    compress : bool
+        If True, compress each chunk. The file can then no longer be
+        memory-mapped.
+    chunk_bytes : int
+        The size of the chunks the arrays are split into.
+
+    """
+    location = Path(location)
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    chunks = {
+        name: [_byte_view(array)[start:end] for start, end in _chunk_ranges(array.nbytes, chunk_bytes)]
+        for name, array in arrays.items()
+    }
+
+    with ThreadPoolExecutor() as executor:
+        checksums = {name: list(executor.map(zlib.crc32, array_chunks)) for name, array_chunks in chunks.items()}
+        if compress:
+            chunks = {
+                name: list(executor.map(lambda chunk: zlib.compress(chunk, COMPRESSION_LEVEL), array_chunks))
+                for name, array_chunks in chunks.items()
+            }
+
+    offset = 0
+    array_headers = {}
+    for name, array in arrays.items():
+        offset = _align(offset)
+        array_headers[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset, "chunks": []}
+        raw_offset = 0
+        for chunk, checksum in zip(chunks[name], checksums[name], strict=True):
+            raw_length = min(chunk_bytes, array.nbytes - raw_offset)
+            array_headers[name]["chunks"].append([offset, len(chunk), raw_length, checksum])
+            offset += len(chunk)
+            raw_offset += raw_length
+
+    header = json.dumps(
+        {"metadata": metadata or {}, "compression": "zlib" if compress else None, "arrays": array_headers}
+    ).encode("utf-8")
+    data_start = _align(_PREFIX.size + len(header))
+
+    temporary_location = location.with_name(location.name + ".tmp")
+    with temporary_location.open("wb") as file_out:
+        file_out.write(_PREFIX.pack(ARRAY_FILE_MAGIC, ARRAY_FILE_VERSION, len(header)))
+        file_out.write(header)
+        for name, array_chunks in chunks.items():
+            file_out.seek(data_start + array_headers[name]["offset"])
+            for chunk in array_chunks:
+                file_out.write(chunk)
+        file_out.truncate(data_start + _align(offset))
+        file_out.flush()
+        os.fsync(file_out.fileno())
+    temporary_location.replace(location)
+
+
+def _verify_chunk(location: str | Path, name: str, index: int, data: bytes, chunk: list[int]) -> None:
+    """Check the length and checksum of a decoded chunk.
+
+    Parameters
+    ----------
+    location : str | Path
+        The file being read, for error messages.
+    name : str
+        The name of the array the chunk belongs to.
+    index : int
+        The index of the chunk in the array.
+    data : bytes
+        The uncompressed chunk.
+    chunk : list[int]
+        The chunk's header: offset, stored length, uncompressed length and
+        checksum.
+
+    """
+    _, _, raw_length, checksum = chunk
+    if len(data) != raw_length or zlib.crc32(data) != checksum:
+        msg = f"{location} is corrupt: chunk {index} of array {name} does not match its checksum"
+        raise ValueError(msg)
+
+
+def _decode_chunk(
+    location: str | Path,
+    mapping: mmap.mmap,
+    data_start: int,
+    arrays: dict[str, np.ndarray] | None,
+    task: tuple[str, int, list[int], int],
+) -> None:
+    """Verify a chunk, and decompress it into its array if it is compressed.
+
+    Parameters
+    ----------
+    location : str | Path
+        The file being read, for error messages.
+    mapping : mmap.mmap
+        The mapped file.
+    data_start : int
+        The offset of the array data in the file.
+    arrays : dict[str, np.ndarray] | None
+        The arrays to decompress into, or None if the file is not compressed.
+    task : tuple[str, int, list[int], int]
+        The name of the array, the index of the chunk, the chunk's header and
+        the chunk's offset in the array.
+
+    """
+    name, index, chunk, raw_offset = task
+    offset, length, raw_length, _ = chunk
+    data = mapping[data_start + offset : data_start + offset + length]
+    if arrays is not None:
+        try:
+            data = zlib.decompress(data)
+        except zlib.error as exc:
+            msg = f"{location} is corrupt: chunk {index} of array {name} could not be decompressed"
+            raise ValueError(msg) from exc
+    _verify_chunk(location, name, index, data, chunk)
+    if arrays is not None:
+        _byte_view(arrays[name])[raw_offset : raw_offset + raw_length] = np.frombuffer(data, dtype=np.uint8)
+
+
+def read_arrays(
+    location: str | Path, *, verify: bool = False, max_workers: int | None = None
+) -> tuple[dict[str, np.ndarray], dict[str, Any]]:
+    """Read an array file.
+
+    Uncompressed files are memory-mapped, and the returned arrays are
+    read-only views onto the mapping which keep the mapping alive for as
+    long as they are referenced. Compressed files are decompressed into
+    memory, in parallel.
+
+    Parameters
+    ----------
+    location : str | Path
+        The file to read.
+    verify : bool
+        If True, verify the checksums of an uncompressed file. This reads the
+        whole file. Compressed files are always verified.
+    max_workers : int | None
+        The number of threads used to decompress and verify chunks, by
+        default one per CPU.
+
+    Returns
+    -------
+    tuple[dict[str, np.ndarray], dict[str, Any]]
+        The arrays by name, and the metadata stored with them.
+
+    Raises
+    ------
+    ValueError
+        Raised when the file is not an array file, or a chunk does not match
+        its checksum.
+
+    """
+    with Path(location).open("rb") as file_in:
+        header = _parse_header(file_in.read(_PREFIX.size), file_in.read, location)
+        mapping = mmap.mmap(file_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+    data_start = header["data_start"]
+    compressed = header.get("compression") == "zlib"
+    arrays = {}
+    tasks = []
+    for name, array_header in header["arrays"].items():
+        dtype = np.dtype(array_header["dtype"])
+        shape = tuple(array_header["shape"])
+        if compressed:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        else:
+            arrays[name] = np.frombuffer(
+                mapping,
+                dtype=dtype,
+                count=int(np.prod(shape, dtype=np.int64)),
+                offset=data_start + array_header["offset"],
+            ).reshape(shape)
+        raw_offset = 0
+        for index, chunk in enumerate(array_header.get("chunks", [])):
+            tasks.append((name, index, chunk, raw_offset))
+            raw_offset += chunk[2]
+
+    if compressed or verify:
+        with ThreadPoolExecutor(max_workers) as executor:
+            for _ in executor.map(
+                lambda task: _decode_chunk(location, mapping, data_start, arrays if compressed else None, task), tasks
+            ):
+                pass
+    if compressed:
+        mapping.close()
+
+    return arrays, header["metadata"]
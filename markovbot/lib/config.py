@@ -43,6 +43,51 @@ def setup_logging() -> None:
     logger.info("Loaded config file %s", BotConfig.get_config("CONFIG_FILE"))
 
 
+# The defaults for the MARKOV settings which older config files do not have
+MARKOV_DEFAULTS = {
+    "CACHE_SENTENCES_PER_SEED": 8,
+    "CACHE_MAX_BYTES": 2000000,
+    "CACHE_REFILL_BATCH": 16,
+    "WORKERS": 2,
+    "GENERATION_TIMEOUT": 2.0,
+    "LOG_COMPACT_BYTES": 16000000,
+    "COMPRESS_CHAINS": False,
+    "CHAIN_DIRECTORY": "data/markov",
+    "DEFAULT_STATE_SIZE": 2,
+    "MODEL_MEMORY_BUDGET": 500000000,
+    "PARTITION_SCOPE": "",  # no partitioned chains, unless a scope is configured
+    "PARTITION_DIRECTORY": "data/markov/partitions",
+    "PARTITION_MEMORY_BUDGET": 200000000,
+    "PARTITION_MIN_MESSAGES": 500,
+    "PRUNE_AFTER_UPDATE": False,
+    "PRUNE_MIN_TRANSITION_COUNT": 1,
+    "PRUNE_MIN_STATE_COUNT": 2,
+    "PRUNE_TOP_K": 0,
+    "MAX_CHAIN_BYTES": 400000000,
+    "WINDOW_WEEKS": 0,
+    "WINDOW_DIRECTORY": "data/markov/window",
+    "ALIAS_MIN_SUCCESSORS": 32,
+    "BANK_FILE": "data/markov/markov-sentences.bank",
+    "BANK_SEED_FILE": "data/markov/bank-seeds.txt",
+    "BANK_TOP_SEEDS": 100,
+    "BANK_SENTENCES_PER_SEED": 500,
+    "BANK_RANDOM_SENTENCES": 10000,
+    "BANK_REFRESH_AFTER_UPDATE": False,
+    "LATENCY_BUDGET": 1.5,
+    "LATENCY_LOG": "data/markov/latency.csv",
+    "JOURNAL_FILE": "data/markov/markov-journal.sqlite3",
+    "SAMPLE_FILE": "data/markov/training-sample.log",
+    "SAMPLE_MAX_BYTES": 16000000,
+    "UPDATE_AFTER_MESSAGES": 5000,
+    "UPDATE_AFTER_BYTES": 1000000,
+    "UPDATE_MAX_AGE": 21600,
+    "DEDUP_MESSAGES": 20000,
+    "DEDUP_THRESHOLD": 0.8,
+    "DEDUP_MIN_WORDS": 4,
+    "NORMALISATION_STEPS": ["mentions", "custom_emojis", "urls", "whitespace"],
+}
+
+
 class FileWatcher(FileSystemEventHandler):
     """Class for watching for changes to the config file."""
 
@@ -132,6 +177,7 @@ class BotConfig:
         # changed, which triggers the config being reloaded. I think this beats
         # having a global variable.
         current_chain = cls._config.get("CURRENT_MARKOV_CHAIN", None)
+        markov_config = MARKOV_DEFAULTS | config_json["MARKOV"]
 
         # populate _config dict, which is a key store for configuration of the
         # bot
@@ -153,7 +199,47 @@ class BotConfig:
             "LOGFILE_NAME": config_json["LOGFILE"]["LOG_LOCATION"],
             "DEVELOPMENT_SERVERS": config_json["DISCORD"]["DEVELOPMENT_SERVERS"],
             # Define users, roles and channels
-            "ENABLE_MARKOV_TRAINING": bool(config_json["MARKOV"]["ENABLE_MARKOV_TRAINING"]),
+            "ENABLE_MARKOV_TRAINING": bool(markov_config["ENABLE_MARKOV_TRAINING"]),
+            "MARKOV_CACHE_SENTENCES_PER_SEED": int(markov_config["CACHE_SENTENCES_PER_SEED"]),
+            "MARKOV_CACHE_MAX_BYTES": int(markov_config["CACHE_MAX_BYTES"]),
+            "MARKOV_CACHE_REFILL_BATCH": int(markov_config["CACHE_REFILL_BATCH"]),
+            "MARKOV_WORKERS": int(markov_config["WORKERS"]),
+            "MARKOV_GENERATION_TIMEOUT": float(markov_config["GENERATION_TIMEOUT"]),
+            "MARKOV_LOG_COMPACT_BYTES": int(markov_config["LOG_COMPACT_BYTES"]),
+            "MARKOV_COMPRESS_CHAINS": bool(markov_config["COMPRESS_CHAINS"]),
+            "MARKOV_CHAIN_DIRECTORY": markov_config["CHAIN_DIRECTORY"],
+            "MARKOV_DEFAULT_STATE_SIZE": int(markov_config["DEFAULT_STATE_SIZE"]),
+            "MARKOV_MODEL_MEMORY_BUDGET": int(markov_config["MODEL_MEMORY_BUDGET"]),
+            "MARKOV_PARTITION_SCOPE": markov_config["PARTITION_SCOPE"],
+            "MARKOV_PARTITION_DIRECTORY": markov_config["PARTITION_DIRECTORY"],
+            "MARKOV_PARTITION_MEMORY_BUDGET": int(markov_config["PARTITION_MEMORY_BUDGET"]),
+            "MARKOV_PARTITION_MIN_MESSAGES": int(markov_config["PARTITION_MIN_MESSAGES"]),
+            "MARKOV_PRUNE_AFTER_UPDATE": bool(markov_config["PRUNE_AFTER_UPDATE"]),
+            "MARKOV_PRUNE_MIN_TRANSITION_COUNT": int(markov_config["PRUNE_MIN_TRANSITION_COUNT"]),
+            "MARKOV_PRUNE_MIN_STATE_COUNT": int(markov_config["PRUNE_MIN_STATE_COUNT"]),
+            "MARKOV_PRUNE_TOP_K": int(markov_config["PRUNE_TOP_K"]),
+            "MARKOV_MAX_CHAIN_BYTES": int(markov_config["MAX_CHAIN_BYTES"]),
+            "MARKOV_WINDOW_WEEKS": int(markov_config["WINDOW_WEEKS"]),
+            "MARKOV_WINDOW_DIRECTORY": markov_config["WINDOW_DIRECTORY"],
+            "MARKOV_ALIAS_MIN_SUCCESSORS": int(markov_config["ALIAS_MIN_SUCCESSORS"]),
+            "MARKOV_BANK_FILE": markov_config["BANK_FILE"],
+            "MARKOV_BANK_SEED_FILE": markov_config["BANK_SEED_FILE"],
+            "MARKOV_BANK_TOP_SEEDS": int(markov_config["BANK_TOP_SEEDS"]),
+            "MARKOV_BANK_SENTENCES_PER_SEED": int(markov_config["BANK_SENTENCES_PER_SEED"]),
+            "MARKOV_BANK_RANDOM_SENTENCES": int(markov_config["BANK_RANDOM_SENTENCES"]),
+            "MARKOV_BANK_REFRESH_AFTER_UPDATE": bool(markov_config["BANK_REFRESH_AFTER_UPDATE"]),
+            "MARKOV_LATENCY_BUDGET": float(markov_config["LATENCY_BUDGET"]),
+            "MARKOV_LATENCY_LOG": markov_config["LATENCY_LOG"],
+            "MARKOV_JOURNAL_FILE": markov_config["JOURNAL_FILE"],
+            "MARKOV_SAMPLE_FILE": markov_config["SAMPLE_FILE"],
+            "MARKOV_SAMPLE_MAX_BYTES": int(markov_config["SAMPLE_MAX_BYTES"]),
+            "MARKOV_UPDATE_AFTER_MESSAGES": int(markov_config["UPDATE_AFTER_MESSAGES"]),
+            "MARKOV_UPDATE_AFTER_BYTES": int(markov_config["UPDATE_AFTER_BYTES"]),
+            "MARKOV_UPDATE_MAX_AGE": float(markov_config["UPDATE_MAX_AGE"]),
+            "MARKOV_DEDUP_MESSAGES": int(markov_config["DEDUP_MESSAGES"]),
+            "MARKOV_DEDUP_THRESHOLD": float(markov_config["DEDUP_THRESHOLD"]),
+            "MARKOV_DEDUP_MIN_WORDS": int(markov_config["DEDUP_MIN_WORDS"]),
+            "MARKOV_NORMALISATION_STEPS": list(markov_config["NORMALISATION_STEPS"]),
             "CURRENT_MARKOV_CHAIN": current_chain,
         }
         cls._config = _config
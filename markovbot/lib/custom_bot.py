@@ -6,8 +6,17 @@ from typing import Any
 
 from disnake.ext import commands
 
+from markovbot.lib import markov
 from markovbot.lib.config import BotConfig
-from markovbot.lib.markov import MARKOV_MODEL
+from markovbot.lib.markov_cache import MarkovSentenceCache
+from markovbot.lib.markov_dedup import MessageDeduplicator
+from markovbot.lib.markov_journal import MarkovJournal
+from markovbot.lib.markov_latency import MarkovLatencyRecorder
+from markovbot.lib.markov_partitions import MarkovPartitionStore
+from markovbot.lib.markov_pool import MarkovWorkerPool
+from markovbot.lib.markov_registry import MarkovModelRegistry
+from markovbot.lib.markov_sample import MarkovTrainingSample
+from markovbot.lib.markov_window import MarkovWindow
 
 logger = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
 
@@ -18,14 +27,32 @@ class CustomInteractionBot(commands.InteractionBot):
     This is a modified version of disnake.ext.commands.InteractionBot.
     """
 
-    def __init__(self, *, enable_markov_cache: bool = False, **kwargs: int) -> None:
+    def __init__(
+        self,
+        *,
+        enable_markov_cache: bool = False,
+        markov_registry: MarkovModelRegistry | None = None,
+        markov_partitions: MarkovPartitionStore | None = None,
+        markov_window: MarkovWindow | None = None,
+        **kwargs: int,
+    ) -> None:
         """Initialise the bot.
 
         Parameters
         ----------
         enable_markov_cache: bool
             Whether or not to enable automatic Markov sentence generation,
-            default is False.
+            default is False. The Markov model must be loaded before the
+            bot is created, as the Markov worker processes are forked here.
+        markov_registry: MarkovModelRegistry | None
+            The registry of available Markov models, used by commands which
+            choose a state size.
+        markov_partitions: MarkovPartitionStore | None
+            The per guild, channel or user Markov chains, or None to only use
+            the global chain.
+        markov_window: MarkovWindow | None
+            The sliding window the global chain is trained in, or None if the
+            global chain is trained on every message.
         **kwargs : int
             The keyword arguments to pass to the parent class.
 
@@ -33,7 +60,48 @@ class CustomInteractionBot(commands.InteractionBot):
         super().__init__(**kwargs)
         self.cleanup_functions = []
         self.times_connected = 0
-        self.markov_pregenerate_sentences = enable_markov_cache and MARKOV_MODEL
+        self.markov_registry = markov_registry
+        self.markov_partitions = markov_partitions
+        self.markov_window = markov_window
+        self.markov_pool = MarkovWorkerPool(
+            BotConfig.get_config("MARKOV_WORKERS"),
+            BotConfig.get_config("MARKOV_GENERATION_TIMEOUT"),
+            markov_registry,
+            markov_partitions,
+        )
+        self.add_function_to_cleanup("Stopping Markov workers", self.markov_pool.shutdown, None)
+        self.markov_latency = MarkovLatencyRecorder(
+            BotConfig.get_config("MARKOV_LATENCY_BUDGET"), BotConfig.get_config("MARKOV_LATENCY_LOG")
+        )
+        self.add_function_to_cleanup("Writing Markov latency records", self.markov_latency.shutdown, None)
+        # Messages are only unlearnt from the global chain, as the window forgets them when they expire
+        self.markov_journal = None
+        if BotConfig.get_config("ENABLE_MARKOV_TRAINING") and markov_window is None:
+            self.markov_journal = MarkovJournal(BotConfig.get_config("MARKOV_JOURNAL_FILE"))
+            self.add_function_to_cleanup("Closing the Markov journal", self.markov_journal.shutdown, None)
+        self.markov_training_sample = None
+        if BotConfig.get_config("ENABLE_MARKOV_TRAINING"):
+            self.markov_training_sample = MarkovTrainingSample(
+                BotConfig.get_config("MARKOV_SAMPLE_FILE"), BotConfig.get_config("MARKOV_SAMPLE_MAX_BYTES")
+            )
+            self.add_function_to_cleanup(
+                "Closing the Markov training sample", self.markov_training_sample.shutdown, None
+            )
+        self.markov_dedup = None
+        if BotConfig.get_config("ENABLE_MARKOV_TRAINING") and BotConfig.get_config("MARKOV_DEDUP_MESSAGES"):
+            self.markov_dedup = MessageDeduplicator(
+                BotConfig.get_config("MARKOV_DEDUP_MESSAGES"),
+                threshold=BotConfig.get_config("MARKOV_DEDUP_THRESHOLD"),
+                min_words=BotConfig.get_config("MARKOV_DEDUP_MIN_WORDS"),
+            )
+        self.markov_pregenerate_sentences = bool(enable_markov_cache and markov.MARKOV_MODEL)
+        self.markov_cache = None
+        if self.markov_pregenerate_sentences:
+            self.markov_cache = MarkovSentenceCache(
+                self.markov_pool.generate,
+                BotConfig.get_config("MARKOV_CACHE_SENTENCES_PER_SEED"),
+                BotConfig.get_config("MARKOV_CACHE_MAX_BYTES"),
+            )
         logger.info(
             "Automatic Markov sentence generation is %s",
             "enabled" if self.markov_pregenerate_sentences else "disabled",
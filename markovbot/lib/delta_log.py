@@ -0,0 +1,269 @@
+"""Append-only log of transition-count deltas for Markov chains.
+
+Each chain update is stored as one record, holding the counts of the new
+transitions in markovify's dict-of-dicts form:
+
+    magic (4 bytes) | payload length (uint32) | sequence (uint64) | crc32 (uint32)
+    payload: state size, word count and transition count (uint32 each),
+             word offsets (uint32), packed UTF-8 words,
+             transitions as (state word ids..., next word id) (uint32),
+             counts (int64)
+
+Words are stored in a table local to each record, so a record does not
+depend on the word ids of any particular chain. Counts are signed, so a
+record can also remove transitions.
+
+Records carry an increasing sequence number. A chain snapshot records the
+sequence of the last delta it contains, so a log which was not removed after
+the snapshot was written (e.g. after a crash) is not applied twice. A record
+which was only partially written is ignored when reading, and overwritten by
+the next append.
+"""
+
+import logging
+import os
+import struct
+import zlib
+from itertools import pairwise
+from pathlib import Path
+
+import numpy as np
+
+from markovbot.lib.config import BotConfig
+
+LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
+
+DELTA_RECORD_MAGIC = b"MKVD"
+
+_RECORD_HEADER = struct.Struct("<4sIQI")
+_PAYLOAD_HEADER = struct.Struct("<III")
+
+
+def log_location_for(chain_location: str | Path) -> Path:
+    """Get the location of the delta log for a chain.
+
+    Parameters
+    ----------
+    chain_location : str | Path
+        The location of the chain snapshot.
+
+    Returns
+    -------
+    Path
+        The location of the delta log, next to the snapshot.
+
+    """
+    chain_location = Path(chain_location)
+    return chain_location.with_name(chain_location.name + ".log")
+
+
+def _encode_delta(model: dict[tuple[str, ...], dict[str, int]]) -> bytes:
+    """Encode a dict-of-dicts model into a record payload.
+
+    Parameters
+    ----------
+    model : dict[tuple[str, ...], dict[str, int]]
+        The transition counts to encode. An empty model is encoded as a
+        record with no transitions.
+
+    Returns
+    -------
+    bytes
+        The payload.
+
+    """
+    state_size = len(next(iter(model))) if model else 0
+    words = {}
+    transitions = []
+    counts = []
+    for state, follows in model.items():
+        state_ids = [words.setdefault(word, len(words)) for word in state]
+        for word, count in follows.items():
+            transitions.extend(state_ids)
+            transitions.append(words.setdefault(word, len(words)))
+            counts.append(count)
+
+    encoded_words = [word.encode("utf-8", "surrogatepass") for word in words]
+    word_offsets = np.zeros(len(encoded_words) + 1, dtype=np.uint32)
+    word_offsets[1:] = np.cumsum([len(word) for word in encoded_words])
+
+    return b"".join(
+        [
+            _PAYLOAD_HEADER.pack(state_size, len(encoded_words), len(counts)),
+            word_offsets.tobytes(),
+            *encoded_words,
+            np.array(transitions, dtype=np.uint32).tobytes(),
+            np.array(counts, dtype=np.int64).tobytes(),
+        ]
+    )
+
+
+def _decode_delta(payload: bytes, model: dict[tuple[str, ...], dict[str, int]]) -> None:
+    """Decode a record payload, adding its counts to a dict-of-dicts model.
+
+    Parameters
+    ----------
+    payload : bytes
+        The payload to decode.
+    model : dict[tuple[str, ...], dict[str, int]]
+        The model to add the counts to.
+
+    """
+    state_size, num_words, num_transitions = _PAYLOAD_HEADER.unpack_from(payload)
+    position = _PAYLOAD_HEADER.size
+    word_offsets = np.frombuffer(payload, dtype=np.uint32, count=num_words + 1, offset=position).tolist()
+    position += 4 * (num_words + 1)
+    words = [
+        payload[position + start : position + end].decode("utf-8", "surrogatepass")
+        for start, end in pairwise(word_offsets)
+    ]
+    position += word_offsets[-1]
+    transitions = np.frombuffer(
+        payload, dtype=np.uint32, count=num_transitions * (state_size + 1), offset=position
+    ).reshape(num_transitions, state_size + 1)
+    position += transitions.nbytes
+    counts = np.frombuffer(payload, dtype=np.int64, count=num_transitions, offset=position).tolist()
+
+    for word_ids, count in zip(transitions.tolist(), counts, strict=True):
+        follows = model.setdefault(tuple(words[word_id] for word_id in word_ids[:-1]), {})
+        word = words[word_ids[-1]]
+        follows[word] = follows.get(word, 0) + count
+
+
+def _scan_records(file: object) -> tuple[int, int]:
+    """Find the end of the last complete record, by reading only the headers.
+
+    Parameters
+    ----------
+    file : object
+        The log file, opened for binary reading.
+
+    Returns
+    -------
+    tuple[int, int]
+        The offset just after the last complete record, and its sequence (or
+        0 if the log has no complete records).
+
+    """
+    file_size = os.fstat(file.fileno()).st_size
+    end = 0
+    sequence = 0
+    while True:
+        file.seek(end)
+        header = file.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size:
+            break
+        magic, length, record_sequence, _ = _RECORD_HEADER.unpack(header)
+        if magic != DELTA_RECORD_MAGIC or end + _RECORD_HEADER.size + length > file_size:
+            break
+        end += _RECORD_HEADER.size + length
+        sequence = record_sequence
+
+    return end, sequence
+
+
+def last_sequence(log_location: str | Path) -> int:
+    """Get the sequence of the last complete record in a log.
+
+    Parameters
+    ----------
+    log_location : str | Path
+        The delta log.
+
+    Returns
+    -------
+    int
+        The sequence, or 0 if the log is missing or empty.
+
+    """
+    try:
+        with Path(log_location).open("rb") as file_in:
+            return _scan_records(file_in)[1]
+    except FileNotFoundError:
+        return 0
+
+
+def append_delta(log_location: str | Path, model: dict[tuple[str, ...], dict[str, int]], min_sequence: int = 0) -> int:
+    """Append a delta to a log.
+
+    Only the record headers of the existing log are read, so the cost of an
+    append is proportional to the size of the delta. The record is flushed
+    to disk before returning.
+
+    Parameters
+    ----------
+    log_location : str | Path
+        The delta log, which is created if it does not exist.
+    model : dict[tuple[str, ...], dict[str, int]]
+        The transition counts to append.
+    min_sequence : int
+        The sequence of the chain snapshot the log belongs to. The record's
+        sequence is always larger than this.
+
+    Returns
+    -------
+    int
+        The sequence of the appended record.
+
+    """
+    payload = _encode_delta(model)
+    log_location = Path(log_location)
+    log_location.touch()
+    with log_location.open("r+b") as file_out:
+        end, sequence = _scan_records(file_out)
+        if end != os.fstat(file_out.fileno()).st_size:
+            LOGGER.warning("Discarding incomplete record at the end of %s", log_location)
+        sequence = max(sequence, min_sequence) + 1
+        file_out.seek(end)
+        file_out.write(_RECORD_HEADER.pack(DELTA_RECORD_MAGIC, len(payload), sequence, zlib.crc32(payload)))
+        file_out.write(payload)
+        file_out.truncate()
+        file_out.flush()
+        os.fsync(file_out.fileno())
+
+    return sequence
+
+
+def read_deltas(
+    log_location: str | Path, after_sequence: int = 0, until_sequence: int | None = None
+) -> tuple[dict[tuple[str, ...], dict[str, int]], int]:
+    """Read and sum the deltas in a log.
+
+    Reading stops at the first incomplete or corrupt record.
+
+    Parameters
+    ----------
+    log_location : str | Path
+        The delta log.
+    after_sequence : int
+        Only records with a larger sequence than this are read.
+    until_sequence : int | None
+        If given, only records with a sequence up to and including this are
+        read.
+
+    Returns
+    -------
+    tuple[dict[tuple[str, ...], dict[str, int]], int]
+        The summed transition counts, and the sequence of the last record
+        read (or `after_sequence` if none were read).
+
+    """
+    model = {}
+    sequence = after_sequence
+    with Path(log_location).open("rb") as file_in:
+        while True:
+            header = file_in.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                break
+            magic, length, record_sequence, checksum = _RECORD_HEADER.unpack(header)
+            payload = file_in.read(length) if magic == DELTA_RECORD_MAGIC else b""
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                LOGGER.warning("Stopped reading %s at a corrupt or incomplete record", log_location)
+                break
+            if until_sequence is not None and record_sequence > until_sequence:
+                break
+            if record_sequence > after_sequence:
+                _decode_delta(payload, model)
+                sequence = record_sequence
+
+    return model, sequence
@@ -3,35 +3,1988 @@
 This module contains functions for loading and updating Markov chains and
 generating sentences using the Markov chain. There is a synchronous and
 asynchronous version of sentence generation functions.
+
+Chains are held in a compact, array-backed representation (`CompactChain`)
+rather than markovify's dict-of-dicts. Every word is interned once in a
+`Vocabulary` table and referred to by a 32-bit id, and the transitions are
+stored in CSR layout: each state is a row of word ids, and the successors of
+state `i` live in `successors[offsets[i]:offsets[i + 1]]` alongside their
+cumulative counts. Cumulative counts are stored as 16-bit integers when every
+row total fits, and 32-bit integers otherwise. States with at least
+MARKOV_ALIAS_MIN_SUCCESSORS successors also get a Walker/Vose alias table, so
+their next word is chosen in constant time rather than by bisecting the
+counts. Alias tables are built when a model is created (on load and after
+each update) and are saved with the chain.
+
+Measured on the ~16k sentences in `data/markov/markov-sentences.json`, an
+unpickled markovify chain costs roughly 500 bytes per state for state size 1
+and 350 bytes per state for state sizes 2 to 4. The compact chain costs
+around 70 bytes per state for state size 1 and 42 to 45 bytes per state for
+state sizes 2 to 4, including the vocabulary.
+
+Many sentences can be generated at once with `CompactText.make_sentences`,
+which advances a batch of walks in lockstep, sampling the next word of every
+walk with one vectorised search of the cumulative counts per step. Walks
+which reach END are masked out of the following steps. From around a hundred
+sentences, this is several times faster than generating them one at a time.
+
+Models are never modified once created. An update builds a new model in a
+worker thread and `publish_markov_model` swaps it in as MARKOV_MODEL, so
+generation which already holds the old model finishes with it.
+
+Models are saved with `save_markov_model`. Files ending in `.markov` use the
+memory-mapped format from `markovbot.lib.array_store`, which loads in O(1)
+time regardless of the chain size, or optionally as compressed, checksummed
+chunks which are smaller on disk but are read in full. Legacy `.pickle` files
+are still read and written.
+
+Updates are not written back into the snapshot. Each update appends the
+counts of its new transitions to a delta log next to the chain (see
+`markovbot.lib.delta_log`), so saving costs the size of the update rather
+than the size of the chain. `load_markov_model` rebuilds the chain from the
+snapshot plus the deltas, and `compact_markov_chain` folds the log back into
+the snapshot once it grows past MARKOV_LOG_COMPACT_BYTES.
 """
 
-import json
+import asyncio
+import hashlib
+import itertools
 import logging
 import pickle
 import random
 import re
 import shutil
-import string
+import time
+from collections.abc import Iterable, Iterator
 from pathlib import Path
 
 import markovify
+import numpy as np
 
+from markovbot.lib.array_store import is_array_file, read_arrays, read_header, write_arrays
 from markovbot.lib.config import BotConfig
 from markovbot.lib.custom_types import ApplicationCommandInteraction
+from markovbot.lib.delta_log import append_delta, last_sequence, log_location_for, read_deltas
 from markovbot.lib.error import deferred_error_message
+from markovbot.lib.text_normalisation import clean_messages_for_learning, has_mention
 
 LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
 MARKOV_MODEL = None
+MARKOV_MODEL_VERSION = 0
+MARKOV_SWAP_LATENCY = 0.0
 MARKOV_BANK = None
+# Returned by `update_markov_chain_for_model` when there is nothing to learn or forget
+MARKOV_CHAIN_UNCHANGED = object()
+_UPDATE_LOCK = asyncio.Lock()
+# The size of each chain which pruning could not bring under MARKOV_MAX_CHAIN_BYTES, by location
+_PRUNED_NBYTES = {}
+
+CHAIN_FILE_SUFFIX = ".markov"
+BANK_RANDOM_SEED = "?random"
+BATCH_GENERATION_MIN_AMOUNT = 64
+PRUNE_GROWTH_MARGIN = 0.1
+BEGIN = markovify.chain.BEGIN
+END = markovify.chain.END
+BEGIN_ID = 0
+END_ID = 1
+
+_HASH_SEED = 0xCBF29CE484222325
+_HASH_PRIME = 0x100000001B3
+_HASH_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def _hash_word(encoded_word: bytes) -> int:
+    """Hash an encoded word into an unsigned 64-bit integer.
+
+    Python's built-in hash is salted per process, so a stable hash is used
+    to allow hash tables to be shared between processes.
+
+    Parameters
+    ----------
+    encoded_word : bytes
+        The UTF-8 encoded word.
+
+    Returns
+    -------
+    int
+        The 64-bit hash.
+
+    """
+    return int.from_bytes(hashlib.blake2b(encoded_word, digest_size=8).digest(), "little")
+
+
+def _hash_state(state_ids: Iterable[int]) -> int:
+    """Hash a single state of word ids, consistently with `_hash_state_rows`.
+
+    Parameters
+    ----------
+    state_ids : Iterable[int]
+        The word ids making up the state.
+
+    Returns
+    -------
+    int
+        The 64-bit hash.
+
+    """
+    state_hash = _HASH_SEED
+    for word_id in state_ids:
+        state_hash = ((state_hash ^ int(word_id)) * _HASH_PRIME) & _HASH_MASK
+    return state_hash
+
+
+def _hash_state_rows(states: np.ndarray) -> np.ndarray:
+    """Hash every row in an array of states.
+
+    Parameters
+    ----------
+    states : np.ndarray
+        A (num_states, state_size) array of word ids.
+
+    Returns
+    -------
+    np.ndarray
+        The 64-bit hash of each row.
+
+    """
+    hashes = np.full(states.shape[0], _HASH_SEED, dtype=np.uint64)
+    for column in range(states.shape[1]):
+        hashes ^= states[:, column].astype(np.uint64)
+        hashes *= np.uint64(_HASH_PRIME)
+    return hashes
+
+
+def _unique_id_rows(
+    rows: np.ndarray, *, return_inverse: bool = False, return_counts: bool = False
+) -> np.ndarray | tuple[np.ndarray, ...]:
+    """Find the unique rows in an array of word ids, in sorted order.
+
+    This is the equivalent of `np.unique(rows, axis=0, ...)`. When the word
+    ids of a row fit into 64 bits, each row is packed into an integer key and
+    the keys are sorted instead, which is many times faster than sorting the
+    rows.
+
+    Parameters
+    ----------
+    rows : np.ndarray
+        A (num_rows, width) array of word ids.
+    return_inverse : bool
+        Whether to return the index of each row in the unique rows.
+    return_counts : bool
+        Whether to return the number of times each unique row appears.
+
+    Returns
+    -------
+    np.ndarray | tuple[np.ndarray, ...]
+        The unique rows, followed by the inverse and counts when asked for.
+
+    """
+    bits = max(int(rows.max()).bit_length(), 1) if rows.size else 1
+    if bits * rows.shape[1] > 64:  # noqa: PLR2004
+        result = np.unique(rows, axis=0, return_inverse=return_inverse, return_counts=return_counts)
+        if not (return_inverse or return_counts):
+            return result
+        unique, *extra = result
+        if return_inverse:
+            extra[0] = extra[0].reshape(-1)
+        return unique, *extra
+
+    shifts = np.uint64(bits) * np.arange(rows.shape[1] - 1, -1, -1, dtype=np.uint64)
+    keys = np.bitwise_or.reduce(rows.astype(np.uint64) << shifts, axis=1)
+    result = np.unique(keys, return_inverse=return_inverse, return_counts=return_counts)
+    keys, extra = (result[0], result[1:]) if return_inverse or return_counts else (result, ())
+    unique = ((keys[:, None] >> shifts) & np.uint64((1 << bits) - 1)).astype(rows.dtype)
+    if not extra:
+        return unique
+
+    return unique, *extra
+
+
+def _count_dtype(max_count: int) -> np.dtype:
+    """Get the narrowest unsigned integer type for cumulative counts.
+
+    Parameters
+    ----------
+    max_count : int
+        The largest cumulative count to store.
+
+    Returns
+    -------
+    np.dtype
+        Either uint16, uint32 or (for absurdly large chains) uint64.
+
+    """
+    if max_count <= np.iinfo(np.uint16).max:
+        return np.dtype(np.uint16)
+    if max_count <= np.iinfo(np.uint32).max:
+        return np.dtype(np.uint32)
+    return np.dtype(np.uint64)
+
+
+class Vocabulary:
+    """An interned table of the words known to a chain.
+
+    Words are stored once as packed UTF-8 in `blob`, with word `i` spanning
+    `blob[offsets[i]:offsets[i + 1]]`. Word lookup uses a sorted array of
+    64-bit hashes, so no per-word Python objects are kept alive.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray, hashes: np.ndarray, order: np.ndarray) -> None:
+        """Initialise the vocabulary from its arrays.
+
+        Parameters
+        ----------
+        blob : np.ndarray
+            The packed UTF-8 bytes of every word.
+        offsets : np.ndarray
+            The start offset of each word in the blob, plus the final end.
+        hashes : np.ndarray
+            The word hashes, sorted in ascending order.
+        order : np.ndarray
+            The word id for each entry in `hashes`.
+
+        """
+        self.blob = blob
+        self.offsets = offsets
+        self.hashes = hashes
+        self.order = order
+
+    def __len__(self) -> int:
+        """Get the number of words in the vocabulary."""
+        return len(self.offsets) - 1
+
+    @classmethod
+    def from_words(cls, words: Iterable[str]) -> "Vocabulary":
+        """Create a vocabulary from a sequence of unique words.
+
+        Parameters
+        ----------
+        words : Iterable[str]
+            The unique words, in id order.
+
+        Returns
+        -------
+        Vocabulary
+            The new vocabulary.
+
+        """
+        encoded = [word.encode("utf-8", "surrogatepass") for word in words]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(word) for word in encoded], dtype=np.int64)
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        hashes = np.fromiter((_hash_word(word) for word in encoded), dtype=np.uint64, count=len(encoded))
+        order = np.argsort(hashes, kind="stable").astype(np.uint32)
+
+        return cls(blob, offsets, hashes[order], order)
+
+    @property
+    def nbytes(self) -> int:
+        """The number of bytes used by the vocabulary arrays."""
+        return self.blob.nbytes + self.offsets.nbytes + self.hashes.nbytes + self.order.nbytes
+
+    def word(self, word_id: int) -> str:
+        """Get the word for a word id.
+
+        Parameters
+        ----------
+        word_id : int
+            The id of the word.
+
+        Returns
+        -------
+        str
+            The word.
+
+        """
+        return bytes(self.blob[self.offsets[word_id] : self.offsets[word_id + 1]]).decode("utf-8", "surrogatepass")
+
+    def words(self, word_ids: Iterable[int]) -> list[str]:
+        """Get the words for a sequence of word ids.
+
+        Parameters
+        ----------
+        word_ids : Iterable[int]
+            The ids of the words.
+
+        Returns
+        -------
+        list[str]
+            The words.
+
+        """
+        return [self.word(word_id) for word_id in word_ids]
+
+    def join_batch(self, sentences: list[list[int]]) -> list[str]:
+        """Join the words of many sentences of word ids at once.
+
+        The bytes of every word are gathered from the blob in one go and
+        decoded together, which is much faster than decoding each word on
+        its own. Words never contain whitespace, so a newline can separate
+        the sentences.
+
+        Parameters
+        ----------
+        sentences : list[list[int]]
+            The word ids of each sentence.
+
+        Returns
+        -------
+        list[str]
+            Each sentence, with its words joined by spaces.
+
+        """
+        num_words = np.array([len(sentence) for sentence in sentences], dtype=np.int64)
+        word_ids = np.fromiter(itertools.chain.from_iterable(sentences), dtype=np.int64, count=int(num_words.sum()))
+        if len(word_ids) == 0:
+            return ["" for _ in sentences]
+
+        # Each word takes its own bytes plus one for the space or newline after it
+        starts = self.offsets[word_ids].astype(np.int64)
+        lengths = self.offsets[word_ids + 1].astype(np.int64) - starts
+        ends = np.cumsum(lengths + 1)
+        slot_starts = np.repeat(ends - lengths - 1, lengths + 1)
+        positions = np.arange(ends[-1]) - slot_starts
+        in_word = positions < np.repeat(lengths, lengths + 1)
+        joined = np.full(ends[-1], ord(" "), dtype=np.uint8)
+        joined[in_word] = self.blob[np.repeat(starts, lengths + 1)[in_word] + positions[in_word]]
+        joined[ends[np.cumsum(num_words)[num_words > 0] - 1] - 1] = ord("\n")
+
+        texts = iter(joined.tobytes().decode("utf-8", "surrogatepass").split("\n"))
+        return [next(texts) if count else "" for count in num_words.tolist()]
+
+    def id(self, word: str) -> int | None:
+        """Get the id of a word.
+
+        Parameters
+        ----------
+        word : str
+            The word to look up.
+
+        Returns
+        -------
+        int | None
+            The id of the word, or None if the word is unknown.
+
+        """
+        encoded = word.encode("utf-8", "surrogatepass")
+        word_hash = np.uint64(_hash_word(encoded))
+        position = int(np.searchsorted(self.hashes, word_hash, side="left"))
+        while position < len(self.hashes) and self.hashes[position] == word_hash:
+            word_id = int(self.order[position])
+            if bytes(self.blob[self.offsets[word_id] : self.offsets[word_id + 1]]) == encoded:
+                return word_id
+            position += 1
+        return None
+
+    def extend(self, words: Iterable[str]) -> tuple["Vocabulary", dict[str, int]]:
+        """Add words to the vocabulary, keeping existing ids stable.
+
+        Parameters
+        ----------
+        words : Iterable[str]
+            The words to add. Words already in the vocabulary are ignored.
+
+        Returns
+        -------
+        tuple[Vocabulary, dict[str, int]]
+            The extended vocabulary, which is self if nothing was added, and a
+            mapping of every given word to its id.
+
+        """
+        word_ids = {}
+        new_words = []
+        for word in dict.fromkeys(words):
+            word_id = self.id(word)
+            if word_id is None:
+                word_id = len(self) + len(new_words)
+                new_words.append(word)
+            word_ids[word] = word_id
+        if not new_words:
+            return self, word_ids
+
+        addition = Vocabulary.from_words(new_words)
+        blob = np.concatenate([self.blob, addition.blob])
+        offsets = np.concatenate([self.offsets, addition.offsets[1:] + self.offsets[-1]])
+        hashes = np.concatenate([self.hashes, addition.hashes])
+        order = np.concatenate([self.order, addition.order + np.uint32(len(self))])
+        resort = np.argsort(hashes, kind="stable")
+
+        return Vocabulary(blob, offsets, hashes[resort], order[resort]), word_ids
+
+
+def _random_generator() -> np.random.Generator:
+    """Create a NumPy random generator for batch generation.
+
+    The generator is seeded from the `random` module, so that seeding
+    `random` also seeds batch generation, and so that forked worker
+    processes (in which `random` is reseeded) do not generate the same
+    sentences as each other.
+
+    Returns
+    -------
+    np.random.Generator
+        The random generator.
+
+    """
+    return np.random.default_rng(random.getrandbits(64))
+
+
+def _transitions_from_counts(
+    model: dict[tuple[str, ...], dict[str, int]], vocabulary: Vocabulary
+) -> tuple[Vocabulary, np.ndarray, np.ndarray, np.ndarray]:
+    """Convert a markovify style dict-of-dicts model into transition arrays.
+
+    Parameters
+    ----------
+    model : dict[tuple[str, ...], dict[str, int]]
+        A mapping of states to a mapping of successors and their counts.
+        Compiled markovify models, with [words, cumdist] values, are also
+        accepted.
+    vocabulary : Vocabulary
+        The vocabulary to extend with the words of the model.
+
+    Returns
+    -------
+    tuple[Vocabulary, np.ndarray, np.ndarray, np.ndarray]
+        The extended vocabulary, and the state word ids, successor word ids
+        and count of each transition. The counts are kept as given, even if
+        they are not positive.
+
+    """
+    words = {}
+    transition_states = []
+    successors = []
+    counts = []
+
+    for state, next_words in model.items():
+        if isinstance(next_words, list):  # compiled chains store [words, cumdist]
+            follows = dict(zip(next_words[0], np.diff(next_words[1], prepend=0).tolist(), strict=True))
+        else:
+            follows = next_words
+        state_ids = [words.setdefault(word, len(words)) for word in state]
+        for word, count in follows.items():
+            transition_states.extend(state_ids)
+            successors.append(words.setdefault(word, len(words)))
+            counts.append(count)
+
+    vocabulary, word_ids = vocabulary.extend(words)
+    remap = np.array([word_ids[word] for word in words], dtype=np.uint32)
+
+    return (
+        vocabulary,
+        remap[np.array(transition_states, dtype=np.int64)],
+        remap[np.array(successors, dtype=np.int64)],
+        np.array(counts, dtype=np.int64),
+    )
+
 
+def _add_counts(
+    total: dict[tuple[str, ...], dict[str, int]], counts: dict[tuple[str, ...], dict[str, int]], sign: int = 1
+) -> None:
+    """Add a dict-of-dicts model of counts to a running total, in place.
 
-def _search_for_seed_in_markov_bank(seed_word: str) -> str:
+    Parameters
+    ----------
+    total : dict[tuple[str, ...], dict[str, int]]
+        The running total.
+    counts : dict[tuple[str, ...], dict[str, int]]
+        The counts to add.
+    sign : int
+        1 to add the counts, or -1 to subtract them.
+
+    """
+    for state, next_words in counts.items():
+        follows = total.setdefault(state, {})
+        for word, count in next_words.items():
+            follows[word] = follows.get(word, 0) + sign * count
+
+
+def _reverse_transitions(
+    state_size: int, states: np.ndarray, successors: np.ndarray, counts: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Get the transitions of the same sentences read from right to left.
+
+    Each transition is a (state_size + 1)-gram of a padded sentence, so
+    reading the grams backwards (and swapping BEGIN with END) gives the
+    transitions of the reversed sentences. The only grams which have no
+    forward counterpart are the extra BEGIN paddings of the reversed
+    sentence, and these are recovered from the grams which end a sentence.
+    The mapping is linear in the counts, so it works just as well for
+    negative counts which take sentences away.
+
+    Parameters
+    ----------
+    state_size : int
+        The number of words in each state.
+    states : np.ndarray
+        The (num_transitions, state_size) state word ids.
+    successors : np.ndarray
+        The successor word id of each transition.
+    counts : np.ndarray
+        The count of each transition.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        The state word ids, successor word ids and counts of the reverse
+        transitions.
+
+    """
+    states = np.asarray(states, dtype=np.uint32).reshape(-1, state_size)
+    reverse_states = []
+    reverse_successors = []
+    reverse_counts = []
+
+    def _swap_padding(word_ids: np.ndarray) -> np.ndarray:
+        return np.where(word_ids == BEGIN_ID, END_ID, word_ids).astype(np.uint32)
+
+    # (s0, ..., sk-1) -> w becomes (w, sk-1, ..., s1) -> s0
+    inner = successors != END_ID
+    if state_size > 1:
+        inner &= states[:, 1] != BEGIN_ID
+    reverse_states.append(np.column_stack([successors[inner], states[inner, :0:-1]]))
+    reverse_successors.append(_swap_padding(states[inner, 0]))
+    reverse_counts.append(counts[inner])
+
+    # (s0, ..., sk-1) -> END gives (BEGIN * j, sk-1, ..., sj) -> sj-1
+    for j in range(1, state_size + 1):
+        ending = successors == END_ID
+        if j < state_size:
+            ending &= states[:, j] != BEGIN_ID
+        padding = np.full((int(ending.sum()), j), BEGIN_ID, dtype=np.uint32)
+        reverse_states.append(np.column_stack([padding, states[ending, state_size - 1 : j - 1 : -1]]))
+        reverse_successors.append(_swap_padding(states[ending, j - 1]))
+        reverse_counts.append(counts[ending])
+
+    return np.concatenate(reverse_states), np.concatenate(reverse_successors), np.concatenate(reverse_counts)
+
+
+class AliasTables:
+    """Walker/Vose alias tables for the states of a chain with many successors.
+
+    Bisecting the cumulative counts of a state costs O(log n) in its number
+    of successors. An alias table lets the next word be chosen in O(1)
+    instead: successor slot `j` of a state with `n` successors and total
+    count `T` is picked uniformly, and kept if a uniform draw from [0, T) is
+    below `thresholds[j]`, otherwise its alias `aliases[j]` is used. The
+    thresholds are integers, so the distribution is exactly the counts of
+    the state, the same as markovify's.
+
+    Tables are only built for states with at least a minimum number of
+    successors, as bisecting a short row is just as fast. The table of
+    `rows[i]` is `thresholds[offsets[i]:offsets[i + 1]]` and
+    `aliases[offsets[i]:offsets[i + 1]]`, where the aliases are slots within
+    the state's successors.
+    """
+
+    def __init__(self, rows: np.ndarray, offsets: np.ndarray, thresholds: np.ndarray, aliases: np.ndarray) -> None:
+        """Initialise the tables from their arrays.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            The sorted rows of the states which have a table.
+        offsets : np.ndarray
+            The start of each table, plus the final end.
+        thresholds : np.ndarray
+            The threshold of each slot.
+        aliases : np.ndarray
+            The alias of each slot.
+
+        """
+        self.rows = rows
+        self.offsets = offsets
+        self.thresholds = thresholds
+        self.aliases = aliases
+        self.min_successors = int(np.diff(offsets).min()) if len(rows) else np.iinfo(np.int64).max
+
+    @classmethod
+    def build(cls, offsets: np.ndarray, cumulative_counts: np.ndarray, min_successors: int) -> "AliasTables":
+        """Build the tables for the states of a chain, with Vose's method.
+
+        Parameters
+        ----------
+        offsets : np.ndarray
+            The offsets of the chain.
+        cumulative_counts : np.ndarray
+            The cumulative counts of the chain.
+        min_successors : int
+            The number of successors a state needs to get a table.
+
+        Returns
+        -------
+        AliasTables
+            The tables.
+
+        """
+        row_lengths = np.diff(offsets)
+        rows = np.flatnonzero(row_lengths >= min_successors).astype(np.uint32)
+        table_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        table_offsets[1:] = np.cumsum(row_lengths[rows])
+        thresholds = np.empty(table_offsets[-1], dtype=np.int64)
+        aliases = np.empty(table_offsets[-1], dtype=np.uint32)
+
+        for table_start, row in zip(table_offsets[:-1].tolist(), rows.tolist(), strict=True):
+            start, end = int(offsets[row]), int(offsets[row + 1])
+            counts = np.diff(cumulative_counts[start:end].astype(np.int64), prepend=0)
+            num_slots, total = end - start, int(cumulative_counts[end - 1])
+            # Scale by the number of slots so each slot holds exactly `total`
+            scaled = (counts * num_slots).tolist()
+            row_thresholds = [total] * num_slots
+            row_aliases = list(range(num_slots))
+            small = [slot for slot, weight in enumerate(scaled) if weight < total]
+            large = [slot for slot, weight in enumerate(scaled) if weight >= total]
+            while small and large:
+                under, over = small.pop(), large[-1]
+                row_thresholds[under] = scaled[under]
+                row_aliases[under] = over
+                scaled[over] -= total - scaled[under]
+                if scaled[over] < total:
+                    small.append(large.pop())
+            thresholds[table_start : table_start + num_slots] = row_thresholds
+            aliases[table_start : table_start + num_slots] = row_aliases
+
+        return cls(rows, table_offsets, thresholds, aliases)
+
+    @property
+    def nbytes(self) -> int:
+        """The number of bytes used by the tables."""
+        return self.rows.nbytes + self.offsets.nbytes + self.thresholds.nbytes + self.aliases.nbytes
+
+    def tables_for(self, rows: np.ndarray) -> np.ndarray:
+        """Find the tables of some state rows.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            The state rows.
+
+        Returns
+        -------
+        np.ndarray
+            The index of each row's table, or -1 for rows without one.
+
+        """
+        if len(self.rows) == 0:
+            return np.full(len(rows), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.rows, rows), len(self.rows) - 1)
+        return np.where(self.rows[positions] == rows, positions, -1).astype(np.int64)
+
+    def sample(self, tables: np.ndarray, totals: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """Choose a successor slot from some tables.
+
+        Parameters
+        ----------
+        tables : np.ndarray
+            The index of each table to sample from.
+        totals : np.ndarray
+            The total count of each table's state.
+        rng : np.random.Generator
+            The random number generator to sample with.
+
+        Returns
+        -------
+        np.ndarray
+            The chosen slot within each state's successors.
+
+        """
+        starts = self.offsets[tables]
+        slots = rng.integers(0, self.offsets[tables + 1] - starts)
+        keep = rng.integers(0, totals) < self.thresholds[starts + slots]
+
+        return np.where(keep, slots, self.aliases[starts + slots]).astype(np.int64)
+
+
+class CompactChain:
+    """An integer-interned, array-backed Markov chain.
+
+    This is a drop-in replacement for `markovify.Chain`. States are rows of
+    word ids in `states`, sorted by their hash in `state_hashes` so a state
+    can be found with a binary search. The successors of state `i` are
+    `successors[offsets[i]:offsets[i + 1]]` and `cumulative_counts` holds the
+    running total of their counts within the row, which is what is bisected
+    when sampling the next word. States with many successors can also have
+    alias tables (see `AliasTables`), which are used instead of bisecting.
+    """
+
+    alias_tables: "AliasTables | None" = None  # chains pickled before alias tables existed have no attribute
+
+    def __init__(  # noqa: PLR0913
+        self,
+        state_size: int,
+        vocabulary: Vocabulary,
+        states: np.ndarray,
+        state_hashes: np.ndarray,
+        offsets: np.ndarray,
+        successors: np.ndarray,
+        cumulative_counts: np.ndarray,
+    ) -> None:
+        """Initialise the chain from its arrays.
+
+        Parameters
+        ----------
+        state_size : int
+            The number of words in each state.
+        vocabulary : Vocabulary
+            The words known to the chain.
+        states : np.ndarray
+            A (num_states, state_size) array of word ids.
+        state_hashes : np.ndarray
+            The sorted hash of each state.
+        offsets : np.ndarray
+            The start of each state's successors, plus the final end.
+        successors : np.ndarray
+            The word id of each transition.
+        cumulative_counts : np.ndarray
+            The cumulative count of each transition within its state.
+
+        """
+        self.state_size = state_size
+        self.vocabulary = vocabulary
+        self.states = states
+        self.state_hashes = state_hashes
+        self.offsets = offsets
+        self.successors = successors
+        self.cumulative_counts = cumulative_counts
+        self.alias_tables = None
+
+    @classmethod
+    def from_transitions(
+        cls,
+        state_size: int,
+        vocabulary: Vocabulary,
+        transition_states: np.ndarray,
+        successors: np.ndarray,
+        counts: np.ndarray,
+    ) -> "CompactChain":
+        """Create a chain from arrays of (state, successor, count) transitions.
+
+        Duplicate transitions are summed, and transitions (and states) whose
+        total count is not positive are dropped.
+
+        Parameters
+        ----------
+        state_size : int
+            The number of words in each state.
+        vocabulary : Vocabulary
+            The vocabulary the word ids refer to.
+        transition_states : np.ndarray
+            A (num_transitions, state_size) array of the state word ids.
+        successors : np.ndarray
+            The successor word id of each transition.
+        counts : np.ndarray
+            The count of each transition.
+
+        Returns
+        -------
+        CompactChain
+            The new chain.
+
+        """
+        transition_states = np.asarray(transition_states, dtype=np.uint32).reshape(-1, state_size)
+        successors = np.asarray(successors, dtype=np.uint32)
+        counts = np.asarray(counts, dtype=np.int64)
+        if len(counts) == 0:
+            return cls(
+                state_size,
+                vocabulary,
+                np.zeros((0, state_size), dtype=np.uint32),
+                np.zeros(0, dtype=np.uint64),
+                np.zeros(1, dtype=np.int64),
+                np.zeros(0, dtype=np.uint32),
+                np.zeros(0, dtype=np.uint16),
+            )
+
+        states, rows = _unique_id_rows(transition_states, return_inverse=True)
+        state_hashes = _hash_state_rows(states)
+        state_order = np.argsort(state_hashes, kind="stable")
+        state_rank = np.empty_like(state_order)
+        state_rank[state_order] = np.arange(len(state_order))
+        states = states[state_order]
+        state_hashes = state_hashes[state_order]
+
+        # Sum duplicate transitions by sorting on a packed (row, successor) key
+        keys = (state_rank[rows.reshape(-1)].astype(np.uint64) << np.uint64(32)) | successors.astype(np.uint64)
+        key_order = np.argsort(keys, kind="stable")
+        keys = keys[key_order]
+        counts = counts[key_order]
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        keys = keys[starts]
+        counts = np.add.reduceat(counts, starts)
+        keep = counts > 0
+        keys = keys[keep]
+        counts = counts[keep]
+
+        # States can be left without any transitions when counts cancel out
+        present, rows = np.unique((keys >> np.uint64(32)).astype(np.int64), return_inverse=True)
+        states = states[present]
+        state_hashes = state_hashes[present]
+
+        offsets = np.zeros(len(states) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(rows.reshape(-1), minlength=len(states)))
+        running_total = np.cumsum(counts)
+        row_base = np.concatenate(([0], running_total))[offsets[:-1]]
+        cumulative_counts = running_total - np.repeat(row_base, np.diff(offsets))
+        max_count = int(cumulative_counts.max()) if len(cumulative_counts) else 0
+
+        return cls(
+            state_size,
+            vocabulary,
+            states,
+            state_hashes,
+            offsets,
+            (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32),
+            cumulative_counts.astype(_count_dtype(max_count)),
+        )
+
+    @classmethod
+    def from_counts(
+        cls, model: dict[tuple[str, ...], dict[str, int]], state_size: int, vocabulary: Vocabulary | None = None
+    ) -> "CompactChain":
+        """Create a chain from a markovify style dict-of-dicts model.
+
+        Parameters
+        ----------
+        model : dict[tuple[str, ...], dict[str, int]]
+            A mapping of states to a mapping of successors and their counts.
+            Compiled markovify models, with [words, cumdist] values, are also
+            accepted.
+        state_size : int
+            The number of words in each state.
+        vocabulary : Vocabulary | None
+            An existing vocabulary to extend, so the word ids are compatible
+            with an existing chain.
+
+        Returns
+        -------
+        CompactChain
+            The new chain.
+
+        """
+        if vocabulary is None:
+            vocabulary = Vocabulary.from_words([BEGIN, END])
+        vocabulary, transition_states, successors, counts = _transitions_from_counts(model, vocabulary)
+
+        return cls.from_transitions(state_size, vocabulary, transition_states, successors, counts)
+
+    @classmethod
+    def from_markovify_chain(cls, chain: markovify.Chain) -> "CompactChain":
+        """Convert a markovify chain into a compact chain.
+
+        Parameters
+        ----------
+        chain : markovify.Chain
+            The chain to convert.
+
+        Returns
+        -------
+        CompactChain
+            The converted chain.
+
+        """
+        return cls.from_counts(chain.model, chain.state_size)
+
+    @property
+    def num_states(self) -> int:
+        """The number of states in the chain."""
+        return len(self.states)
+
+    @property
+    def num_transitions(self) -> int:
+        """The number of transitions in the chain."""
+        return len(self.successors)
+
+    @property
+    def nbytes(self) -> int:
+        """The number of bytes used by the chain and its vocabulary."""
+        return (
+            self.vocabulary.nbytes
+            + self.states.nbytes
+            + self.state_hashes.nbytes
+            + self.offsets.nbytes
+            + self.successors.nbytes
+            + self.cumulative_counts.nbytes
+            + (self.alias_tables.nbytes if self.alias_tables is not None else 0)
+        )
+
+    @property
+    def bytes_per_state(self) -> float:
+        """The average number of bytes used per state."""
+        return self.nbytes / max(self.num_states, 1)
+
+    def build_alias_tables(self, min_successors: int) -> None:
+        """Build alias tables for the states with many successors.
+
+        Parameters
+        ----------
+        min_successors : int
+            The number of successors a state needs to get a table. If this
+            is 0, no tables are built.
+
+        """
+        if min_successors > 0:
+            self.alias_tables = AliasTables.build(self.offsets, self.cumulative_counts, min_successors)
+
+    def state_index(self, state_ids: tuple[int, ...]) -> int:
+        """Get the row of a state.
+
+        Parameters
+        ----------
+        state_ids : tuple[int, ...]
+            The word ids making up the state.
+
+        Returns
+        -------
+        int
+            The row of the state, or -1 if the state is not in the chain.
+
+        """
+        state_hash = np.uint64(_hash_state(state_ids))
+        position = int(np.searchsorted(self.state_hashes, state_hash, side="left"))
+        while position < len(self.state_hashes) and self.state_hashes[position] == state_hash:
+            if tuple(self.states[position].tolist()) == tuple(state_ids):
+                return position
+            position += 1
+        return -1
+
+    def encode_state(self, state: tuple[str, ...]) -> tuple[int, ...]:
+        """Convert a state of words into a state of word ids.
+
+        Parameters
+        ----------
+        state : tuple[str, ...]
+            The words making up the state.
+
+        Returns
+        -------
+        tuple[int, ...]
+            The word ids of the state.
+
+        Raises
+        ------
+        KeyError
+            Raised when a word is not in the vocabulary.
+
+        """
+        state_ids = tuple(self.vocabulary.id(word) for word in state)
+        if None in state_ids:
+            raise KeyError(state)
+        return state_ids
+
+    def move_id(self, row: int) -> int:
+        """Choose the next word id at random for a state row.
+
+        Parameters
+        ----------
+        row : int
+            The row of the state.
+
+        Returns
+        -------
+        int
+            The id of the next word.
+
+        """
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        tables = self.alias_tables
+        if tables is not None and end - start >= tables.min_successors:
+            table = int(np.searchsorted(tables.rows, row))
+            if table < len(tables.rows) and tables.rows[table] == row:
+                table_start = int(tables.offsets[table])
+                slot = random.randrange(end - start)
+                if random.randrange(int(self.cumulative_counts[end - 1])) >= tables.thresholds[table_start + slot]:
+                    slot = int(tables.aliases[table_start + slot])
+                return int(self.successors[start + slot])
+
+        cumulative = self.cumulative_counts[start:end]
+        selection = int(np.searchsorted(cumulative, random.randrange(int(cumulative[-1])), side="right"))
+        return int(self.successors[start + selection])
+
+    def move(self, state: tuple[str, ...]) -> str:
+        """Given a state, choose the next word at random.
+
+        Parameters
+        ----------
+        state : tuple[str, ...]
+            The state to move from.
+
+        Returns
+        -------
+        str
+            The next word, which may be END.
+
+        Raises
+        ------
+        KeyError
+            Raised when the state is not in the chain.
+
+        """
+        row = self.state_index(self.encode_state(state))
+        if row < 0:
+            raise KeyError(state)
+        return self.vocabulary.word(self.move_id(row))
+
+    def gen_ids(self, init_state: tuple[int, ...] | None = None) -> Iterator[int]:
+        """Yield successive word ids until the chain reaches END.
+
+        Parameters
+        ----------
+        init_state : tuple[int, ...] | None
+            The word ids of the state to start from, by default the BEGIN
+            state.
+
+        Yields
+        ------
+        int
+            The id of the next word.
+
+        """
+        state = tuple(init_state) if init_state else (BEGIN_ID,) * self.state_size
+        while True:
+            row = self.state_index(state)
+            if row < 0:
+                raise KeyError(state)
+            next_id = self.move_id(row)
+            if next_id == END_ID:
+                break
+            yield next_id
+            state = (*state[1:], next_id)
+
+    def walk(self, init_state: tuple[str, ...] | None = None) -> list[str]:
+        """Return a list of words representing a single run of the chain.
+
+        Parameters
+        ----------
+        init_state : tuple[str, ...] | None
+            The words of the state to start from, by default the BEGIN state.
+
+        Returns
+        -------
+        list[str]
+            The generated words, not including the initial state.
+
+        """
+        state_ids = self.encode_state(init_state) if init_state else None
+        return self.vocabulary.words(self.gen_ids(state_ids))
+
+    def transitions(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Expand the chain into arrays of (state, successor, count).
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray, np.ndarray]
+            The (num_transitions, state_size) state word ids, the successor
+            word ids and the count of each transition.
+
+        """
+        row_lengths = np.diff(self.offsets)
+        counts = np.diff(self.cumulative_counts.astype(np.int64), prepend=0)
+        row_starts = self.offsets[:-1][row_lengths > 0]
+        counts[row_starts] = self.cumulative_counts[row_starts]
+
+        return np.repeat(self.states, row_lengths, axis=0), self.successors, counts
+
+    def combine(self, other: "CompactChain") -> "CompactChain":
+        """Combine the counts of two chains into a new chain.
+
+        This is the equivalent of `markovify.combine`. The vocabulary of
+        `other` must be this chain's vocabulary or an extension of it, e.g. a
+        chain created with `from_counts(..., vocabulary=self.vocabulary)`.
+
+        Parameters
+        ----------
+        other : CompactChain
+            The chain to combine with this one.
+
+        Returns
+        -------
+        CompactChain
+            The combined chain, which uses the vocabulary of `other`.
+
+        """
+        if other.state_size != self.state_size:
+            msg = f"Cannot combine chains with state sizes {self.state_size} and {other.state_size}"
+            raise ValueError(msg)
+        return self.add_transitions(other.vocabulary, *other.transitions())
+
+    def add_transitions(
+        self, vocabulary: Vocabulary, states: np.ndarray, successors: np.ndarray, counts: np.ndarray
+    ) -> "CompactChain":
+        """Add the counts of some transitions to the chain's counts.
+
+        Counts may be negative, to take transitions away. Transitions (and
+        states) whose count drops to zero or below are removed.
+
+        Parameters
+        ----------
+        vocabulary : Vocabulary
+            The vocabulary the word ids refer to, which must be this chain's
+            vocabulary or an extension of it.
+        states : np.ndarray
+            The (num_transitions, state_size) state word ids.
+        successors : np.ndarray
+            The successor word id of each transition.
+        counts : np.ndarray
+            The count to add for each transition.
+
+        Returns
+        -------
+        CompactChain
+            The new chain, which uses `vocabulary`.
+
+        """
+        own_states, own_successors, own_counts = self.transitions()
+
+        return CompactChain.from_transitions(
+            self.state_size,
+            vocabulary,
+            np.concatenate([own_states, np.asarray(states, dtype=np.uint32).reshape(-1, self.state_size)]),
+            np.concatenate([own_successors, np.asarray(successors, dtype=np.uint32)]),
+            np.concatenate([own_counts, np.asarray(counts, dtype=np.int64)]),
+        )
+
+    def _next_rows(self, states: np.ndarray, successors: np.ndarray) -> np.ndarray:
+        """Get the row of the state each transition leads to.
+
+        Parameters
+        ----------
+        states : np.ndarray
+            The (num_transitions, state_size) state word ids.
+        successors : np.ndarray
+            The successor word id of each transition.
+
+        Returns
+        -------
+        np.ndarray
+            The row of the next state, or -1 if it is not in the chain or the
+            successor is END.
+
+        """
+        rows = self.state_rows(np.column_stack([states[:, 1:], successors]))
+
+        return np.where(successors != END_ID, rows, -1)
+
+    def state_rows(self, states: np.ndarray) -> np.ndarray:
+        """Get the rows of many states at once.
+
+        This is the vectorised version of `state_index`.
+
+        Parameters
+        ----------
+        states : np.ndarray
+            The (num_states, state_size) state word ids.
+
+        Returns
+        -------
+        np.ndarray
+            The row of each state, or -1 if it is not in the chain.
+
+        """
+        states = np.asarray(states, dtype=np.uint32).reshape(-1, self.state_size)
+        if self.num_states == 0:
+            return np.full(len(states), -1, dtype=np.int64)
+        hashes = _hash_state_rows(states)
+        positions = np.minimum(np.searchsorted(self.state_hashes, hashes), self.num_states - 1)
+        found = (self.state_hashes[positions] == hashes) & np.all(self.states[positions] == states, axis=1)
+
+        return np.where(found, positions, -1).astype(np.int64)
+
+    def move_ids(self, rows: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """Choose the next word at random for many states at once.
+
+        This is the vectorised version of `move_id`. States with an alias
+        table are sampled from it, and the successor of every other state is
+        found with a binary search of its cumulative counts, with every
+        search advancing in lockstep.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            The rows of the states.
+        rng : np.random.Generator
+            The random number generator to sample with.
+
+        Returns
+        -------
+        np.ndarray
+            The id of the next word for each state.
+
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        next_ids = np.empty(len(rows), dtype=self.successors.dtype)
+        if self.alias_tables is not None:
+            tables = self.alias_tables.tables_for(rows)
+            aliased = tables >= 0
+            starts = self.offsets[rows[aliased]].astype(np.int64)
+            totals = self.cumulative_counts[self.offsets[rows[aliased] + 1] - 1].astype(np.int64)
+            next_ids[aliased] = self.successors[starts + self.alias_tables.sample(tables[aliased], totals, rng)]
+            if aliased.all():
+                return next_ids
+            bisected = ~aliased
+        else:
+            bisected = np.ones(len(rows), dtype=bool)
+
+        low = self.offsets[rows[bisected]].astype(np.int64)
+        high = self.offsets[rows[bisected] + 1].astype(np.int64) - 1
+        targets = rng.integers(0, self.cumulative_counts[high].astype(np.int64))
+
+        # Find the first successor whose cumulative count is above the target
+        searching = low < high
+        while searching.any():
+            middle = (low + high) // 2
+            above = self.cumulative_counts[middle] > targets
+            high = np.where(searching & above, middle, high)
+            low = np.where(searching & ~above, middle + 1, low)
+            searching = low < high
+        next_ids[bisected] = self.successors[low]
+
+        return next_ids
+
+    def walk_ids_batch(
+        self, init_states: np.ndarray, rng: np.random.Generator, max_steps: int = 1000
+    ) -> list[list[int] | None]:
+        """Run many walks of the chain in lockstep.
+
+        Every walk takes one step per iteration, with the next words of all
+        the walks sampled together. Walks which reach END are masked out of
+        the following steps.
+
+        Parameters
+        ----------
+        init_states : np.ndarray
+            The (num_walks, state_size) word ids of the state each walk
+            starts from.
+        rng : np.random.Generator
+            The random number generator to sample with.
+        max_steps : int
+            The most words a walk can generate before it is abandoned.
+
+        Returns
+        -------
+        list[list[int] | None]
+            The word ids generated by each walk, not including the initial
+            state or END, or None for walks which reached a state which is
+            not in the chain or did not finish within `max_steps`.
+
+        """
+        states = np.array(init_states, dtype=np.uint32).reshape(-1, self.state_size)
+        num_walks = len(states)
+        rows = self.state_rows(states)
+        active = rows >= 0
+        failed = ~active
+        lengths = np.zeros(num_walks, dtype=np.int64)
+        steps = []
+
+        for _ in range(max_steps):
+            walking = np.flatnonzero(active)
+            if len(walking) == 0:
+                break
+            next_ids = self.move_ids(rows[walking], rng)
+            step = np.full(num_walks, END_ID, dtype=np.uint32)
+            step[walking] = next_ids
+            steps.append(step)
+
+            continuing = next_ids != END_ID
+            active[walking[~continuing]] = False
+            walking = walking[continuing]
+            lengths[walking] += 1
+            states[walking] = np.column_stack([states[walking, 1:], next_ids[continuing]])
+            rows[walking] = self.state_rows(states[walking])
+            stuck = walking[rows[walking] < 0]
+            active[stuck] = False
+            failed[stuck] = True
+
+        failed |= active
+        word_ids = np.stack(steps, axis=1) if steps else np.zeros((num_walks, 0), dtype=np.uint32)
+
+        return [
+            None if is_failed else walk[:length].tolist()
+            for walk, length, is_failed in zip(word_ids, lengths.tolist(), failed.tolist(), strict=True)
+        ]
+
+    def pruned(
+        self,
+        min_transition_count: int = 1,
+        min_state_count: int = 1,
+        top_k: int = 0,
+        *,
+        compact_vocabulary: bool = True,
+    ) -> "CompactChain":
+        """Create a smaller chain by dropping rare states and transitions.
+
+        Transitions seen fewer than `min_transition_count` times are dropped,
+        as are states seen fewer than `min_state_count` times (except the
+        states at the start of a sentence), and only the `top_k` most common
+        successors of each state are kept. Transitions which would then lead
+        to a state with no way out are dropped too, until every walk can
+        reach END. With the default arguments, only the dead ends are
+        removed.
+
+        Parameters
+        ----------
+        min_transition_count : int
+            The smallest count of a transition to keep.
+        min_state_count : int
+            The smallest total count of a state to keep.
+        top_k : int
+            The number of successors to keep for each state, or 0 to keep
+            them all.
+        compact_vocabulary : bool
+            If True, remove the words which are no longer used from the
+            vocabulary, otherwise keep this chain's vocabulary so the pruned
+            chain can be paired with chains which share it.
+
+        Returns
+        -------
+        CompactChain
+            The pruned chain.
+
+        """
+        states, successors, counts = self.transitions()
+        rows = np.repeat(np.arange(self.num_states), np.diff(self.offsets))
+        keep = counts >= min_transition_count
+        if min_state_count > 1:
+            state_totals = self.cumulative_counts[self.offsets[1:] - 1].astype(np.int64)
+            keep &= (state_totals >= min_state_count)[rows] | (states[:, 0] == BEGIN_ID)
+        if top_k > 0:
+            order = np.lexsort((-counts, rows))
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order)) - self.offsets[rows[order]]
+            keep &= rank < top_k
+
+        # Dropping a state strands the transitions which lead to it, which
+        # can in turn empty other states, so repeat until nothing changes
+        next_rows = self._next_rows(states, successors)
+        ends = successors == END_ID
+        while True:
+            present = np.bincount(rows[keep], minlength=self.num_states) > 0
+            live = keep & (ends | ((next_rows >= 0) & present[np.maximum(next_rows, 0)]))
+            if np.array_equal(live, keep):
+                break
+            keep = live
+
+        states = states[keep]
+        successors = successors[keep]
+        if not compact_vocabulary:
+            return CompactChain.from_transitions(self.state_size, self.vocabulary, states, successors, counts[keep])
+        used = np.unique(np.concatenate([[BEGIN_ID, END_ID], states.reshape(-1), successors]).astype(np.int64))
+        remap = np.zeros(len(self.vocabulary), dtype=np.uint32)
+        remap[used] = np.arange(len(used), dtype=np.uint32)
+
+        return CompactChain.from_transitions(
+            self.state_size,
+            Vocabulary.from_words(self.vocabulary.words(used.tolist())),
+            remap[states],
+            remap[successors],
+            counts[keep],
+        )
+
+    def reversed(self) -> "CompactChain":
+        """Create the chain of the same corpus read from right to left.
+
+        The result has exactly the counts of a chain trained on the reversed
+        sentences, and shares this chain's vocabulary.
+
+        Returns
+        -------
+        CompactChain
+            The reverse chain.
+
+        """
+        return CompactChain.from_transitions(
+            self.state_size, self.vocabulary, *_reverse_transitions(self.state_size, *self.transitions())
+        )
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """Get the arrays which make up the chain, for saving to disk.
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            The chain and vocabulary arrays, by name, and the alias tables
+            if they have been built.
+
+        """
+        arrays = {
+            "vocabulary_blob": self.vocabulary.blob,
+            "vocabulary_offsets": self.vocabulary.offsets,
+            "vocabulary_hashes": self.vocabulary.hashes,
+            "vocabulary_order": self.vocabulary.order,
+            "states": self.states,
+            "state_hashes": self.state_hashes,
+            "offsets": self.offsets,
+            "successors": self.successors,
+            "cumulative_counts": self.cumulative_counts,
+        }
+        if self.alias_tables is not None:
+            arrays["alias_rows"] = self.alias_tables.rows
+            arrays["alias_offsets"] = self.alias_tables.offsets
+            arrays["alias_thresholds"] = self.alias_tables.thresholds
+            arrays["alias_aliases"] = self.alias_tables.aliases
+
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray], state_size: int) -> "CompactChain":
+        """Create a chain from the arrays returned by `to_arrays`.
+
+        The arrays are used as-is, so memory-mapped arrays stay mapped.
+
+        Parameters
+        ----------
+        arrays : dict[str, np.ndarray]
+            The chain and vocabulary arrays, by name.
+        state_size : int
+            The number of words in each state.
+
+        Returns
+        -------
+        CompactChain
+            The chain.
+
+        """
+        vocabulary = Vocabulary(
+            arrays["vocabulary_blob"],
+            arrays["vocabulary_offsets"],
+            arrays["vocabulary_hashes"],
+            arrays["vocabulary_order"],
+        )
+        chain = cls(
+            state_size,
+            vocabulary,
+            arrays["states"],
+            arrays["state_hashes"],
+            arrays["offsets"],
+            arrays["successors"],
+            arrays["cumulative_counts"],
+        )
+        if "alias_rows" in arrays:
+            chain.alias_tables = AliasTables(
+                arrays["alias_rows"], arrays["alias_offsets"], arrays["alias_thresholds"], arrays["alias_aliases"]
+            )
+
+        return chain
+
+
+class WordIndex:
+    """An inverted index from each word to the chain states containing it.
+
+    The rows of the states containing word `i` are
+    `rows[offsets[i]:offsets[i + 1]]`. BEGIN and END are not indexed.
+    """
+
+    def __init__(self, offsets: np.ndarray, rows: np.ndarray) -> None:
+        """Initialise the index from its arrays.
+
+        Parameters
+        ----------
+        offsets : np.ndarray
+            The start of each word's rows, plus the final end.
+        rows : np.ndarray
+            The state rows, grouped by word.
+
+        """
+        self.offsets = offsets
+        self.rows = rows
+
+    @classmethod
+    def from_chain(cls, chain: CompactChain) -> "WordIndex":
+        """Build the index for a chain.
+
+        Parameters
+        ----------
+        chain : CompactChain
+            The chain to index.
+
+        Returns
+        -------
+        WordIndex
+            The index.
+
+        """
+        word_ids = chain.states.ravel().astype(np.uint64)
+        rows = np.repeat(np.arange(chain.num_states, dtype=np.uint64), chain.state_size)
+        indexed = word_ids > END_ID
+        keys = np.unique((word_ids[indexed] << np.uint64(32)) | rows[indexed])
+        offsets = np.zeros(len(chain.vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount((keys >> np.uint64(32)).astype(np.int64), minlength=len(chain.vocabulary)))
+
+        return cls(offsets, (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32))
+
+    @property
+    def nbytes(self) -> int:
+        """The number of bytes used by the index arrays."""
+        return self.offsets.nbytes + self.rows.nbytes
+
+    def states_containing(self, word_id: int) -> np.ndarray:
+        """Get the rows of the states which contain a word.
+
+        Parameters
+        ----------
+        word_id : int
+            The id of the word.
+
+        Returns
+        -------
+        np.ndarray
+            The state rows, which is empty for words outside the index.
+
+        """
+        if word_id >= len(self.offsets) - 1:
+            return self.rows[:0]
+        return self.rows[self.offsets[word_id] : self.offsets[word_id + 1]]
+
+
+class CompactText:
+    """Sentence generation on top of a `CompactChain`.
+
+    This mirrors the parts of the `markovify.Text` API the bot uses. Sentences
+    are not tested for overlap with the original corpus, as the corpus is not
+    kept around after training.
+
+    Alongside the forward chain, the model keeps the reverse chain (the same
+    corpus read right to left) and an index of which states contain each
+    word. Together these let a sentence be grown in both directions from any
+    state containing a seed word, rather than generating random sentences
+    until one happens to contain it. Alias tables are built for the states of
+    both chains with at least MARKOV_ALIAS_MIN_SUCCESSORS successors, unless
+    they were loaded with the chains.
+    """
+
+    def __init__(
+        self, chain: CompactChain, reverse_chain: CompactChain | None = None, index: WordIndex | None = None
+    ) -> None:
+        """Initialise the model.
+
+        Parameters
+        ----------
+        chain : CompactChain
+            The chain to generate sentences from.
+        reverse_chain : CompactChain | None
+            The reverse of `chain`. It is derived from `chain` if not given.
+        index : WordIndex | None
+            The word index of `chain`. It is built from `chain` if not given.
+
+        """
+        self.chain = chain
+        self.reverse_chain = reverse_chain if reverse_chain is not None else chain.reversed()
+        self.index = index if index is not None else WordIndex.from_chain(chain)
+        for model_chain in (self.chain, self.reverse_chain):
+            if model_chain.alias_tables is None:
+                model_chain.build_alias_tables(BotConfig.get_config("MARKOV_ALIAS_MIN_SUCCESSORS"))
+
+    @property
+    def state_size(self) -> int:
+        """The number of words in each state of the chain."""
+        return self.chain.state_size
+
+    @property
+    def nbytes(self) -> int:
+        """The number of bytes used by both chains, the vocabulary and the index."""
+        return self.chain.nbytes + self.reverse_chain.nbytes - self.reverse_chain.vocabulary.nbytes + self.index.nbytes
+
+    def merge(self, model: dict[tuple[str, ...], dict[str, int]]) -> "CompactText":
+        """Create a new model with the counts of a markovify style model added.
+
+        This model is left untouched, so it can keep generating sentences
+        while the merge runs in another thread.
+
+        Counts may be negative, which takes transitions away from the model,
+        e.g. to forget old or deleted messages. Transitions whose count drops
+        to zero or below are removed.
+
+        Parameters
+        ----------
+        model : dict[tuple[str, ...], dict[str, int]]
+            The dict-of-dicts model to add, e.g. `markovify.Chain.model`.
+
+        Returns
+        -------
+        CompactText
+            The merged model, with a consistent forward chain, reverse chain
+            and word index.
+
+        """
+        return self.add_transitions(*_transitions_from_counts(model, self.chain.vocabulary))
+
+    def add_transitions(
+        self, vocabulary: Vocabulary, states: np.ndarray, successors: np.ndarray, counts: np.ndarray
+    ) -> "CompactText":
+        """Create a new model with the counts of some transitions added.
+
+        Parameters
+        ----------
+        vocabulary : Vocabulary
+            The vocabulary the word ids refer to, which must be this model's
+            vocabulary or an extension of it.
+        states : np.ndarray
+            The (num_transitions, state_size) state word ids.
+        successors : np.ndarray
+            The successor word id of each transition.
+        counts : np.ndarray
+            The count to add for each transition, which may be negative.
+
+        Returns
+        -------
+        CompactText
+            The merged model, with a consistent forward chain, reverse chain
+            and word index.
+
+        """
+        chain = self.chain.add_transitions(vocabulary, states, successors, counts)
+        reverse_chain = self.reverse_chain.add_transitions(
+            vocabulary, *_reverse_transitions(self.state_size, states, successors, counts)
+        )
+
+        return CompactText(chain, reverse_chain, WordIndex.from_chain(chain))
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """Get the arrays which make up the model, for saving to disk.
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            The arrays of the forward chain (and vocabulary), the reverse
+            chain prefixed with "reverse_" and the index prefixed with
+            "index_".
+
+        """
+        arrays = self.chain.to_arrays()
+        arrays.update(
+            {
+                f"reverse_{name}": array
+                for name, array in self.reverse_chain.to_arrays().items()
+                if not name.startswith("vocabulary_")
+            }
+        )
+        arrays["index_offsets"] = self.index.offsets
+        arrays["index_rows"] = self.index.rows
+
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray], state_size: int) -> "CompactText":
+        """Create a model from the arrays returned by `to_arrays`.
+
+        Files written before the reverse chain and index were added only have
+        the forward chain, in which case the rest is derived on load.
+
+        Parameters
+        ----------
+        arrays : dict[str, np.ndarray]
+            The model arrays, by name.
+        state_size : int
+            The number of words in each state.
+
+        Returns
+        -------
+        CompactText
+            The model.
+
+        """
+        chain = CompactChain.from_arrays(arrays, state_size)
+        if "reverse_states" not in arrays:
+            LOGGER.warning("Chain has no reverse chain or index, re-save it to avoid building them on load")
+            return cls(chain)
+
+        reverse_arrays = {name: array for name, array in arrays.items() if name.startswith("vocabulary_")}
+        reverse_arrays.update(
+            {name.removeprefix("reverse_"): array for name, array in arrays.items() if name.startswith("reverse_")}
+        )
+        reverse_chain = CompactChain.from_arrays(reverse_arrays, state_size)
+        reverse_chain.vocabulary = chain.vocabulary
+
+        return cls(chain, reverse_chain, WordIndex(arrays["index_offsets"], arrays["index_rows"]))
+
+    def word_split(self, sentence: str) -> list[str]:
+        """Split a sentence into words, the same way markovify does."""
+        return re.split(markovify.Text.word_split_pattern, sentence)
+
+    def word_join(self, words: list[str]) -> str:
+        """Join a list of words into a sentence."""
+        return " ".join(words)
+
+    def make_sentence(
+        self,
+        init_state: tuple[str, ...] | None = None,
+        *,
+        tries: int = 10,
+        max_words: int | None = None,
+        min_words: int | None = None,
+    ) -> str | None:
+        """Try to generate a sentence, optionally from an initial state.
+
+        Parameters
+        ----------
+        init_state : tuple[str, ...] | None
+            A state of `state_size` words to start from, by default a
+            sentence start is chosen at random.
+        tries : int
+            The number of attempts to satisfy the word limits.
+        max_words : int | None
+            The maximum number of words in the sentence.
+        min_words : int | None
+            The minimum number of words in the sentence.
+
+        Returns
+        -------
+        str | None
+            The sentence, or None if no sentence satisfied the word limits.
+
+        """
+        prefix = [] if init_state is None else [word for word in init_state if word != BEGIN]
+        for _ in range(tries):
+            words = prefix + self.chain.walk(init_state)
+            if (max_words is not None and len(words) > max_words) or (min_words is not None and len(words) < min_words):
+                continue
+            return self.word_join(words)
+        return None
+
+    def make_sentences(
+        self,
+        amount: int,
+        *,
+        tries: int = 10,
+        max_words: int | None = None,
+        min_words: int | None = None,
+    ) -> list[str]:
+        """Generate many random sentences at once.
+
+        All the sentences are generated together by `walk_ids_batch`, which
+        is much faster than calling `make_sentence` in a loop. Sentences
+        which do not satisfy the word limits are generated again, up to
+        `tries` times.
+
+        Parameters
+        ----------
+        amount : int
+            The number of sentences to generate.
+        tries : int
+            The number of attempts to satisfy the word limits.
+        max_words : int | None
+            The maximum number of words in each sentence.
+        min_words : int | None
+            The minimum number of words in each sentence.
+
+        Returns
+        -------
+        list[str]
+            The sentences, of which there are fewer than `amount` if not
+            enough satisfied the word limits.
+
+        """
+        rng = _random_generator()
+        sentences = []
+        for _ in range(tries):
+            remaining = amount - len(sentences)
+            if remaining <= 0:
+                break
+            init_states = np.full((remaining, self.state_size), BEGIN_ID, dtype=np.uint32)
+            walks = []
+            for word_ids in self.chain.walk_ids_batch(init_states, rng):
+                if word_ids is None:
+                    continue
+                if (max_words is not None and len(word_ids) > max_words) or (
+                    min_words is not None and len(word_ids) < min_words
+                ):
+                    continue
+                walks.append(word_ids)
+            sentences.extend(self.chain.vocabulary.join_batch(walks))
+
+        return sentences
+
+    def make_sentences_that_contain(self, word: str, amount: int, *, tries: int = 10) -> list[str]:
+        """Generate many sentences which contain `word` at once.
+
+        This is the batch version of `make_sentence_that_contains`: the
+        states containing the word are sampled together, and the sentences
+        are grown forwards and backwards from them with `walk_ids_batch`.
+
+        Parameters
+        ----------
+        word : str
+            The word the sentences should contain.
+        amount : int
+            The number of sentences to generate.
+        tries : int
+            The number of attempts to replace sentences which could not be
+            made.
+
+        Returns
+        -------
+        list[str]
+            The sentences, of which there are fewer than `amount` if not
+            enough could be made.
+
+        Raises
+        ------
+        markovify.text.ParamError
+            Raised when the word is not in the chain.
+
+        """
+        word_id = self.chain.vocabulary.id(word)
+        rows = self.index.states_containing(word_id) if word_id is not None else []
+        if len(rows) == 0:
+            msg = f"`make_sentences_that_contain` can't find {word} in the chain"
+            raise markovify.text.ParamError(msg)
+
+        state_counts = np.cumsum(self.chain.cumulative_counts[self.chain.offsets[rows.astype(np.int64) + 1] - 1])
+        rng = _random_generator()
+        sentences = []
+        for _ in range(tries):
+            remaining = amount - len(sentences)
+            if remaining <= 0:
+                break
+            targets = rng.integers(0, int(state_counts[-1]), size=remaining)
+            choices = np.searchsorted(state_counts, targets, side="right")
+            states = self.chain.states[rows[choices]]
+            afters = self.chain.walk_ids_batch(states, rng)
+            befores = [[] for _ in range(remaining)]
+            backwards = np.flatnonzero(states[:, 0] != BEGIN_ID)
+            reverse_walks = self.reverse_chain.walk_ids_batch(states[backwards, ::-1], rng)
+            for walk, before in zip(backwards, reverse_walks, strict=True):
+                befores[walk] = before
+            walks = [
+                before[::-1] + [word_id for word_id in state if word_id != BEGIN_ID] + after
+                for state, before, after in zip(states.tolist(), befores, afters, strict=True)
+                if before is not None and after is not None
+            ]
+            sentences.extend(self.chain.vocabulary.join_batch(walks))
+
+        return sentences
+
+    def make_sentence_with_start(self, beginning: str, *, strict: bool = True, **kwargs: int) -> str:
+        """Try to generate a sentence which begins with `beginning`.
+
+        Parameters
+        ----------
+        beginning : str
+            One to `state_size` words to start the sentence with.
+        strict : bool
+            If True, only sentence starts are used. Otherwise any state
+            beginning with the words is used.
+        **kwargs : int
+            Passed to `make_sentence`.
+
+        Returns
+        -------
+        str
+            The sentence.
+
+        Raises
+        ------
+        markovify.text.ParamError
+            Raised when the beginning has the wrong number of words, or no
+            sentence could be made.
+
+        """
+        split = tuple(self.word_split(beginning))
+        word_count = len(split)
+
+        if word_count == self.state_size:
+            init_states = [split]
+        elif 0 < word_count < self.state_size:
+            if strict:
+                init_states = [(BEGIN,) * (self.state_size - word_count) + split]
+            else:
+                init_states = self._find_init_states(split)
+                random.shuffle(init_states)
+        else:
+            msg = f"`make_sentence_with_start` for this model requires 1 to {self.state_size} words, got {word_count}"
+            raise markovify.text.ParamError(msg)
+
+        for init_state in init_states:
+            output = self.make_sentence(init_state, **kwargs)
+            if output is not None:
+                return output
+
+        msg = f"`make_sentence_with_start` can't find sentence beginning with {beginning}"
+        raise markovify.text.ParamError(msg)
+
+    def make_sentence_that_contains(self, word: str, *, tries: int = 10) -> str | None:
+        """Try to generate a sentence which contains `word`.
+
+        A state containing the word is looked up in the index, chosen with
+        probability proportional to how often the state was seen. The
+        sentence is then grown forwards to an END with the forward chain and
+        backwards to a sentence start with the reverse chain. The cost does
+        not depend on how rare the word is.
+
+        Parameters
+        ----------
+        word : str
+            The word the sentence should contain.
+        tries : int
+            The number of attempts to generate a sentence.
+
+        Returns
+        -------
+        str | None
+            The sentence, or None if no sentence could be made.
+
+        Raises
+        ------
+        markovify.text.ParamError
+            Raised when the word is not in the chain.
+
+        """
+        word_id = self.chain.vocabulary.id(word)
+        rows = self.index.states_containing(word_id) if word_id is not None else []
+        if len(rows) == 0:
+            msg = f"`make_sentence_that_contains` can't find {word} in the chain"
+            raise markovify.text.ParamError(msg)
+
+        # Weight each state by the number of times it was seen, which is the
+        # last cumulative count in its row
+        state_counts = np.cumsum(self.chain.cumulative_counts[self.chain.offsets[rows.astype(np.int64) + 1] - 1])
+
+        for _ in range(tries):
+            choice = int(np.searchsorted(state_counts, random.randrange(int(state_counts[-1])), side="right"))
+            state = tuple(self.chain.states[rows[choice]].tolist())
+            try:
+                after = list(self.chain.gen_ids(state))
+                before = [] if state[0] == BEGIN_ID else list(self.reverse_chain.gen_ids(state[::-1]))
+            except KeyError:
+                continue
+            word_ids = before[::-1] + [word_id for word_id in state if word_id != BEGIN_ID] + after
+            return self.word_join(self.chain.vocabulary.words(word_ids))
+
+        return None
+
+    def _find_init_states(self, split: tuple[str, ...]) -> list[tuple[str, ...]]:
+        """Find all states which begin with `split`, ignoring BEGIN.
+
+        Parameters
+        ----------
+        split : tuple[str, ...]
+            The words the state should begin with.
+
+        Returns
+        -------
+        list[tuple[str, ...]]
+            The matching states.
+
+        """
+        try:
+            split_ids = self.chain.encode_state(split)
+        except KeyError:
+            return []
+
+        matches = []
+        for state_ids in self.chain.states[(self.chain.states == split_ids[0]).any(axis=1)].tolist():
+            words = [word_id for word_id in state_ids if word_id != BEGIN_ID]
+            if tuple(words[: len(split_ids)]) == split_ids:
+                matches.append(tuple(self.chain.vocabulary.words(state_ids)))
+        return matches
+
+
+def _search_for_seed_in_markov_bank(seed_word: str | None) -> str:
     """Search for a sentence in the markov bank for a given seed word.
 
     Parameters
     ----------
-    seed_word : str
-        The seed word to search for.
+    seed_word : str | None
+        The seed word to search for, or None for a random sentence.
 
     Returns
     -------
@@ -39,39 +1992,68 @@ def _search_for_seed_in_markov_bank(seed_word: str) -> str:
         The markov sentence.
 
     """
-    if seed_word not in MARKOV_BANK:
+    sentence = MARKOV_BANK.random_sentence(seed_word or BANK_RANDOM_SEED)
+    if sentence is None:
         LOGGER.error("Seed word '%s' not found in markov bank", seed_word)
-        sentences = MARKOV_BANK.get(
-            "error", ["An error occured with the markov sentence generation [a seed word is probably missing]"]
-        )
-        return random.choice(sentences)
+        sentence = MARKOV_BANK.random_sentence("error")
+    if sentence is None:
+        sentence = "An error occured with the markov sentence generation [a seed word is probably missing]"
+
+    return sentence
+
 
-    return random.choice(MARKOV_BANK[seed_word])
+def _check_deadline(deadline: float | None) -> None:
+    """Stop generating sentences if the deadline has passed.
 
+    Parameters
+    ----------
+    deadline : float | None
+        The `time.monotonic` time to stop at, or None for no deadline.
 
-def _generate_markov_sentence(model: markovify.Text = None, seed_word: str | None = None, attempts: int = 5) -> str:
+    Raises
+    ------
+    TimeoutError
+        Raised when the deadline has passed.
+
+    """
+    if deadline is not None and time.monotonic() >= deadline:
+        msg = "Ran out of time to generate a Markov sentence"
+        raise TimeoutError(msg)
+
+
+def _generate_markov_sentence(
+    model: CompactText = None, seed_word: str | None = None, attempts: int = 5, deadline: float | None = None
+) -> str:
     """Generate a sentence using a markov chain.
 
     Parameters
     ----------
-    model : markovify.Text
+    model : CompactText
         The model to generate the sentence from, by default None
     seed_word : str, optional
         A seed word to include in the sentence, by default None
     attempts : int, optional
         The number of attempts to generate a sentence with a seed word, by
         default 5
+    deadline : float | None, optional
+        The `time.monotonic` time to give up at, by default None. The
+        deadline is checked after each attempt which fails.
 
     Returns
     -------
     str
         The generated sentence
 
+    Raises
+    ------
+    TimeoutError
+        Raised when the deadline passes before a sentence is generated.
+
     """
     sentence = "My Markov Chain sentence generator isn't working!"
     if not model:
         model = MARKOV_MODEL
-    if not model or not isinstance(model, markovify.Text):
+    if not model or not isinstance(model, CompactText):
         LOGGER.error("An invalid Markov model was passed to sentence generation")
         return sentence
 
@@ -94,8 +2076,9 @@ def _generate_markov_sentence(model: markovify.Text = None, seed_word: str | Non
         # No matter what, don't allow @here and @everyone mentions, but
         # allow user mentions, if mentions == True
 
-        if "@" not in sentence:
+        if not has_mention(sentence):
             break
+        _check_deadline(deadline)
 
     if not sentence:
         sentence = model.make_sentence()
@@ -103,6 +2086,103 @@ def _generate_markov_sentence(model: markovify.Text = None, seed_word: str | Non
     return sentence.strip()[:1024]
 
 
+def _generate_markov_sentences_one_at_a_time(
+    model: CompactText, seed_word: str | None, amount: int, deadline: float | None = None
+) -> list[str]:
+    """Generate sentences using a markov chain, one at a time.
+
+    Parameters
+    ----------
+    model : CompactText
+        The model to generate the sentences from.
+    seed_word : str | None
+        A seed word to include in the sentences.
+    amount : int
+        The number of sentences to generate.
+    deadline : float | None, optional
+        The `time.monotonic` time to give up at, by default None.
+
+    Returns
+    -------
+    list[str]
+        The generated sentences.
+
+    Raises
+    ------
+    TimeoutError
+        Raised when the deadline passes before every sentence is generated.
+
+    """
+    sentences = []
+    for _ in range(amount):
+        _check_deadline(deadline)
+        sentences.append(_generate_markov_sentence(model, seed_word, deadline=deadline))
+
+    return sentences
+
+
+def _generate_markov_sentences(
+    model: CompactText, seed_word: str | None, amount: int, attempts: int = 5, deadline: float | None = None
+) -> list[str]:
+    """Generate many sentences using a markov chain, in batches.
+
+    This follows the same rules as `_generate_markov_sentence`, but all the
+    sentences are generated at once with `CompactText.make_sentences` or
+    `CompactText.make_sentences_that_contain`. Sentences with an @ in them
+    are thrown away and generated again, and any which still cannot be made
+    are generated one at a time. Multi-word seeds are always generated one
+    at a time.
+
+    Parameters
+    ----------
+    model : CompactText
+        The model to generate the sentences from.
+    seed_word : str | None
+        A seed word to include in the sentences.
+    amount : int
+        The number of sentences to generate.
+    attempts : int, optional
+        The number of batches to generate to replace rejected sentences, by
+        default 5
+    deadline : float | None, optional
+        The `time.monotonic` time to give up at, by default None. The
+        deadline is checked before each batch after the first.
+
+    Returns
+    -------
+    list[str]
+        The generated sentences.
+
+    Raises
+    ------
+    TimeoutError
+        Raised when the deadline passes before every sentence is generated.
+
+    """
+    if seed_word and len(seed_word.split()) > 1:
+        return _generate_markov_sentences_one_at_a_time(model, seed_word, amount, deadline)
+
+    sentences = []
+    for attempt in range(attempts):
+        remaining = amount - len(sentences)
+        if remaining <= 0:
+            break
+        if attempt > 0:
+            _check_deadline(deadline)
+        try:
+            batch = model.make_sentences_that_contain(seed_word, remaining) if seed_word else []
+        except markovify.text.ParamError:
+            batch = []
+        if not batch:
+            batch = model.make_sentences(remaining)
+        sentences.extend(sentence.strip()[:1024] for sentence in batch if not has_mention(sentence))
+
+    sentences = sentences[:amount]
+    sentences.extend(_generate_markov_sentences_one_at_a_time(model, seed_word, amount - len(sentences), deadline))
+
+    return sentences
+
+
 def _get_sentence_from_bank(seed_word: str, amount: int = 1) -> str | list[str]:
     """Get a sentence from the markov bank.
 
@@ -124,247 +2204,687 @@ def _get_sentence_from_bank(seed_word: str, amount: int = 1) -> str | list[str]:
     return [_search_for_seed_in_markov_bank(seed_word) for _ in range(amount)]
 
 
-def _get_sentence_from_model(model: markovify.Text, seed_word: str, amount: int = 1) -> str | list[str]:
+def _get_sentence_from_model(
+    model: CompactText, seed_word: str, amount: int = 1, deadline: float | None = None
+) -> str | list[str]:
     """Get a sentence from the markov model.
 
     Parameters
     ----------
-    model : markovify.Text
+    model : CompactText
         The model to generate the sentence from.
     seed_word : str
         The seed word for the sentence.
     amount : int, optional
         The number of sentences to generate, by default 1
+    deadline : float | None, optional
+        The `time.monotonic` time to give up at, by default None
 
     Returns
     -------
     str | list[str]
         The generated sentence(s).
 
+    Raises
+    ------
+    TimeoutError
+        Raised when the deadline passes before the sentences are generated.
+
     """
-    if not model or not isinstance(model, markovify.Text):
+    if not model or not isinstance(model, CompactText):
         msg = "The provided markov model is not valid"
         raise ValueError(msg)
     if amount == 1:
-        return _generate_markov_sentence(model, seed_word)
-    return [_generate_markov_sentence(model, seed_word) for _ in range(amount)]
+        return _generate_markov_sentence(model, seed_word, deadline=deadline)
+    if amount < BATCH_GENERATION_MIN_AMOUNT:  # too few for batching to pay for its overhead
+        return _generate_markov_sentences_one_at_a_time(model, seed_word, amount, deadline)
+    return _generate_markov_sentences(model, seed_word, amount, deadline=deadline)
 
 
-def _clean_sentence_for_learning(sentences: list[str]) -> list[str]:
-    """Clean up a list of sentences for learning.
+def _load_pickled_model(chain_location: Path) -> CompactText:
+    """Load a legacy pickled chain.
 
-    This will remove empty strings, messages which start with punctuation
-    and any sentences with @ oi them.
+    Pickles containing a markovify chain are converted into a compact chain,
+    and the reverse chain and word index are built from it. If the pickle is
+    truncated, the backup is restored and loaded instead.
 
     Parameters
     ----------
-    sentences : List[str]
-        A list of sentences to clean up for learning.
+    chain_location : Path
+        The location of the pickle.
 
     Returns
     -------
-    List[str]
-        The cleaned up list of sentences.
+    CompactText
+        The model.
 
     """
-    clean_sentences = []
+    with Path.open(chain_location, "rb") as file_in:
+        try:
+            chain = pickle.load(file_in)  # noqa: S301
+        except EOFError:
+            shutil.copy2(str(chain_location) + ".bak", chain_location)
+            return _load_pickled_model(chain_location)  # the recursion might be a bit spicy here
+    if isinstance(chain, CompactText):
+        return CompactText(chain.chain, chain.reverse_chain, chain.index)
+    if isinstance(chain, markovify.Chain):
+        chain = CompactChain.from_markovify_chain(chain)
+
+    return CompactText(chain)
+
+
+def save_markov_model(
+    model: CompactText,
+    save_location: str | Path,
+    log_sequence: int = 0,
+    *,
+    compress: bool | None = None,
+    metadata: dict | None = None,
+) -> None:
+    """Save a model to disk.
 
-    for sentence in sentences:
-        # ignore empty strings
-        if not sentence:
-            continue
-        # ignore commands, which usually start with punctuation
-        if sentence[0] in string.punctuation:
-            continue
-        # don't want to learn how to mention :)
-        if "@" in sentence:
-            continue
+    Models are written in the memory-mapped chain format, unless the file
+    name ends in `.pickle` in which case the model is pickled.
+
+    Parameters
+    ----------
+    model : CompactText
+        The model to save.
+    save_location : str | Path
+        The location to save the model.
+    log_sequence : int
+        The sequence of the last record in the chain's delta log which the
+        model contains. Not stored for pickles.
+    compress : bool | None
+        If True, write compressed chunks instead of a file which can be
+        memory-mapped. By default, this is set by MARKOV_COMPRESS_CHAINS.
+    metadata : dict | None
+        Extra JSON-serialisable metadata to store in the header. Not stored
+        for pickles.
+
+    """
+    save_location = Path(save_location)
+    if compress is None:
+        compress = BotConfig.get_config("MARKOV_COMPRESS_CHAINS")
+    if save_location.suffix == ".pickle":
+        with Path.open(save_location, "wb") as file_out:
+            pickle.dump(model, file_out)
+        return
+
+    write_arrays(
+        save_location,
+        model.to_arrays(),
+        {
+            "kind": "compact_chain",
+            "state_size": model.state_size,
+            "num_states": model.chain.num_states,
+            "num_words": len(model.chain.vocabulary),
+            "log_sequence": log_sequence,
+            **(metadata or {}),
+        },
+        compress=compress,
+    )
 
-        clean_sentences.append(sentence)
 
-    return clean_sentences
+def read_chain_metadata(chain_location: str | Path) -> dict:
+    """Read the metadata in the header of a chain snapshot.
+
+    Parameters
+    ----------
+    chain_location : str | Path
+        The location of the snapshot.
+
+    Returns
+    -------
+    dict
+        The metadata, or an empty dict for pickles and missing files.
+
+    """
+    if not is_array_file(chain_location):
+        return {}
+    return read_header(chain_location)["metadata"]
+
+
+def _snapshot_sequence(chain_location: Path) -> int:
+    """Get the sequence of the last delta contained in a chain snapshot.
+
+    Parameters
+    ----------
+    chain_location : Path
+        The location of the snapshot.
+
+    Returns
+    -------
+    int
+        The sequence, or 0 for pickles and snapshots written without a log.
+
+    """
+    return read_chain_metadata(chain_location).get("log_sequence", 0)
 
 
-def load_markov_model(chain_location: str | Path, state_size: int = 2) -> markovify.Text:
-    """Load a Markovify markov chain.
+def chain_log_sequence(chain_location: str | Path) -> int:
+    """Get the sequence of the last delta in a chain's snapshot and log.
 
-    If a chain exists at chain_location, this is read in and applied. Otherwise
-    a new model is created which is practically empty.
+    This is the sequence to pass to `compact_markov_chain` for a model
+    loaded with `load_markov_model`.
 
     Parameters
     ----------
     chain_location : str | Path
-        The location of the markov chain to load. Must be a pickle.
+        The location of the snapshot.
+
+    Returns
+    -------
+    int
+        The sequence, or 0 if the chain has never been updated.
+
+    """
+    chain_location = Path(chain_location)
+    return max(_snapshot_sequence(chain_location), last_sequence(log_location_for(chain_location)))
+
+
+def load_markov_model(chain_location: str | Path, state_size: int = 2, *, apply_log: bool = True) -> CompactText:
+    """Load a Markov chain.
+
+    Chains in the memory-mapped chain format are mapped rather than read, so
+    this returns almost immediately and the pages are loaded on demand.
+    Compressed chains are decompressed in parallel and checked against their
+    checksums, raising ValueError if they are corrupt. Legacy pickles are
+    read in full, and pickled markovify chains are converted into a
+    `CompactText` on load.
+
+    Updates in the chain's delta log which are newer than the snapshot are
+    merged into the loaded model, in which case the model is held in memory
+    rather than mapped until the log is next compacted.
+
+    Parameters
+    ----------
+    chain_location : str | Path
+        The location of the markov chain to load.
     state_size : int
-        The state size of the model, defaults to 2.
+        The state size of the model, defaults to 2. Only used as a sanity
+        check against the state size of the loaded chain.
+    apply_log : bool
+        Whether to merge the updates in the chain's delta log. If False,
+        only the snapshot is loaded.
 
     Returns
     -------
-    markovify.Text
+    CompactText
         The Markov Chain model loaded.
 
     """
-    if not isinstance(str, Path):
+    if not isinstance(chain_location, Path):
         chain_location = Path(chain_location)
 
-    model = markovify.Text(
-        "This is an empty markov model. I think you may need two sentences.",
-        state_size=state_size if state_size != 0 else 2,
-    )
-
-    if chain_location.exists():
-        with Path.open(chain_location, "rb") as file_in:
-            try:
-                model.chain = pickle.load(file_in)  # noqa: S301
-                LOGGER.info("Model %s has been loaded", str(chain_location))
-            except EOFError:
-                shutil.copy2(str(chain_location) + ".bak", chain_location)
-                model = load_markov_model(chain_location, state_size)  # the recursion might be a bit spicy here
-    else:
+    if not chain_location.exists():
         msg = f"No chain at {chain_location}"
         raise OSError(msg)
 
-    BotConfig.set_config("CURRENT_MARKOV_CHAIN", chain_location)
+    if is_array_file(chain_location):
+        arrays, metadata = read_arrays(chain_location)
+        model = CompactText.from_arrays(arrays, metadata["state_size"])
+    else:
+        model = _load_pickled_model(chain_location)
+
+    log_location = log_location_for(chain_location)
+    if apply_log and log_location.exists():
+        start = time.perf_counter()
+        base_sequence = _snapshot_sequence(chain_location)
+        delta, sequence = read_deltas(log_location, base_sequence)
+        if delta:
+            model = model.merge(delta)
+            LOGGER.info(
+                "Applied %d updates from %s in %.2f s",
+                sequence - base_sequence,
+                str(log_location),
+                time.perf_counter() - start,
+            )
+
+    LOGGER.info(
+        "Model %s has been loaded: %d states, %d words, %.1f bytes per state",
+        str(chain_location),
+        model.chain.num_states,
+        len(model.chain.vocabulary),
+        model.nbytes / max(model.chain.num_states, 1),
+    )
+    if state_size and state_size != model.state_size:
+        LOGGER.warning("Expected state size %d but %s has %d", state_size, chain_location, model.state_size)
 
     return model
 
 
-def load_markov_bank(bank_location: str | Path) -> dict:
-    """Load a pre-generated bank of Markov sentences.
+def publish_markov_model(model: CompactText) -> int:
+    """Make a model the one used for sentence generation.
 
-    This file should be a JSON file with the following format:
+    The swap is a single reference assignment, so there is no pause for
+    generation: anything which already has a reference to the old model
+    finishes with it, and everything after the swap uses the new one.
 
-        {
-            "seed_word": [sentence1, sentence2, ...]
-        }
+    Parameters
+    ----------
+    model : CompactText
+        The model to publish.
+
+    Returns
+    -------
+    int
+        The version of the published model, which increases by one with
+        each publish.
+
+    """
+    global MARKOV_MODEL, MARKOV_MODEL_VERSION, MARKOV_SWAP_LATENCY  # noqa: PLW0603
+
+    start = time.perf_counter()
+    MARKOV_MODEL = model
+    MARKOV_MODEL_VERSION += 1
+    MARKOV_SWAP_LATENCY = time.perf_counter() - start
+
+    return MARKOV_MODEL_VERSION
+
+
+def prune_markov_model(
+    model: CompactText,
+    *,
+    min_transition_count: int = 1,
+    min_state_count: int = 1,
+    top_k: int = 0,
+    max_bytes: int = 0,
+) -> tuple[CompactText, dict[str, int]]:
+    """Prune rare states and transitions from a model.
+
+    See `CompactChain.pruned` for what is dropped. If the pruned model is
+    still larger than `max_bytes`, the state count threshold is doubled
+    until it fits, as long as some states are left.
 
     Parameters
     ----------
-    bank_location : str | Path
-        The file path to the bank file.
+    model : CompactText
+        The model to prune. It is not modified.
+    min_transition_count : int
+        The smallest count of a transition to keep.
+    min_state_count : int
+        The smallest total count of a state to keep.
+    top_k : int
+        The number of successors to keep for each state, or 0 for all.
+    max_bytes : int
+        The size target for the pruned model, or 0 for no target.
 
     Returns
     -------
-    dict
-        The bank of Markov sentences, as a dict.
+    tuple[CompactText, dict[str, int]]
+        The pruned model, and the sizes before and after pruning: bytes,
+        states, transitions and words, plus the state count threshold which
+        was used.
 
     """
-    path = Path(bank_location)
-    if not path.exists():
-        msg = f"No bank at {bank_location}"
-        raise OSError(msg)
+    pruned_chain = model.chain.pruned(min_transition_count, min_state_count, top_k)
+    while max_bytes and CompactText(pruned_chain).nbytes > max_bytes:
+        min_state_count = max(2 * min_state_count, 2)
+        smaller_chain = model.chain.pruned(min_transition_count, min_state_count, top_k)
+        if smaller_chain.num_states in (0, pruned_chain.num_states):
+            break
+        pruned_chain = smaller_chain
+
+    pruned_model = CompactText(pruned_chain, pruned_chain.reversed().pruned(compact_vocabulary=False))
+    report = {
+        "bytes_before": model.nbytes,
+        "bytes_after": pruned_model.nbytes,
+        "states_before": model.chain.num_states,
+        "states_after": pruned_chain.num_states,
+        "transitions_before": model.chain.num_transitions,
+        "transitions_after": pruned_chain.num_transitions,
+        "words_before": len(model.chain.vocabulary),
+        "words_after": len(pruned_chain.vocabulary),
+        "min_state_count": min_state_count,
+    }
+    LOGGER.info(
+        "Pruned Markov model from %d to %d bytes (%d saved): %d -> %d states, %d -> %d words",
+        report["bytes_before"],
+        report["bytes_after"],
+        report["bytes_before"] - report["bytes_after"],
+        report["states_before"],
+        report["states_after"],
+        report["words_before"],
+        report["words_after"],
+    )
+
+    return pruned_model, report
+
+
+def _needs_pruning(model: CompactText, chain_location: Path) -> bool:
+    """Check if a model should be pruned after an update.
+
+    If the last prune could not bring the chain under MARKOV_MAX_CHAIN_BYTES,
+    it is not pruned for its size again until it has grown by
+    PRUNE_GROWTH_MARGIN, as every prune rewrites the whole snapshot.
 
-    with path.open("r") as file_in:
-        bank = json.load(file_in)
+    Parameters
+    ----------
+    model : CompactText
+        The updated model.
+    chain_location : Path
+        The location of the snapshot.
 
-    LOGGER.info("Markov bank %s has been loaded", bank_location)
+    Returns
+    -------
+    bool
+        True if MARKOV_PRUNE_AFTER_UPDATE is set, or the model is larger than
+        MARKOV_MAX_CHAIN_BYTES.
 
-    return bank
+    """
+    if BotConfig.get_config("MARKOV_PRUNE_AFTER_UPDATE"):
+        return True
+    max_bytes = BotConfig.get_config("MARKOV_MAX_CHAIN_BYTES")
+    if not max_bytes or model.nbytes <= max_bytes:
+        return False
+    pruned_nbytes = _PRUNED_NBYTES.get(str(chain_location))
+    return pruned_nbytes is None or model.nbytes > pruned_nbytes * (1 + PRUNE_GROWTH_MARGIN)
+
+
+def _record_pruned_size(model: CompactText, chain_location: Path) -> None:
+    """Remember the size of a pruned chain, if it is still too large.
+
+    Parameters
+    ----------
+    model : CompactText
+        The pruned model.
+    chain_location : Path
+        The location of the snapshot.
+
+    """
+    max_bytes = BotConfig.get_config("MARKOV_MAX_CHAIN_BYTES")
+    if max_bytes and model.nbytes > max_bytes:
+        LOGGER.warning(
+            "Unable to prune %s below MARKOV_MAX_CHAIN_BYTES (%d > %d bytes), not pruning it for its size again "
+            "until it grows by %d%%",
+            str(chain_location),
+            model.nbytes,
+            max_bytes,
+            PRUNE_GROWTH_MARGIN * 100,
+        )
+        _PRUNED_NBYTES[str(chain_location)] = model.nbytes
+    else:
+        _PRUNED_NBYTES.pop(str(chain_location), None)
 
 
-async def update_markov_chain_for_model(  # noqa: PLR0911
+def prune_markov_chain(model: CompactText, chain_location: str | Path, log_sequence: int) -> CompactText:
+    """Prune a model with the configured thresholds and save it as the snapshot.
+
+    The pruned model no longer matches the snapshot plus the delta log, so
+    the log is compacted into the new snapshot.
+
+    Parameters
+    ----------
+    model : CompactText
+        The model containing every delta in the log.
+    chain_location : str | Path
+        The location of the snapshot.
+    log_sequence : int
+        The sequence of the last delta in the log.
+
+    Returns
+    -------
+    CompactText
+        The pruned model.
+
+    """
+    pruned_model, _ = prune_markov_model(
+        model,
+        min_transition_count=BotConfig.get_config("MARKOV_PRUNE_MIN_TRANSITION_COUNT"),
+        min_state_count=BotConfig.get_config("MARKOV_PRUNE_MIN_STATE_COUNT"),
+        top_k=BotConfig.get_config("MARKOV_PRUNE_TOP_K"),
+        max_bytes=BotConfig.get_config("MARKOV_MAX_CHAIN_BYTES"),
+    )
+    compact_markov_chain(pruned_model, chain_location, log_sequence)
+
+    return pruned_model
+
+
+def compact_markov_chain(model: CompactText, chain_location: str | Path, log_sequence: int) -> None:
+    """Fold a chain's delta log into its snapshot.
+
+    The snapshot is replaced atomically before the log is removed. If the
+    process dies in between, the deltas already in the snapshot are skipped
+    on the next load because their sequence is not newer than the
+    snapshot's.
+
+    Parameters
+    ----------
+    model : CompactText
+        The model containing every delta in the log.
+    chain_location : str | Path
+        The location of the snapshot.
+    log_sequence : int
+        The sequence of the last delta in the log.
+
+    """
+    chain_location = Path(chain_location)
+    start = time.perf_counter()
+    save_markov_model(model, chain_location, log_sequence)
+    log_location_for(chain_location).unlink(missing_ok=True)
+    LOGGER.info("Compacted %s in %.2f s", str(chain_location), time.perf_counter() - start)
+
+
+def _train_updated_model(
+    model: CompactText,
+    messages: list[str],
+    state_size: int,
+    save_location: Path,
+    forget_messages: list[str] | None = None,
+) -> tuple[CompactText, int | None]:
+    """Train and merge an updated model, and append the update to the log.
+
+    This is run in a worker thread, and only reads from `model`. The update
+    is on disk once this returns, so it survives a crash even though the
+    snapshot is not rewritten. If there is nothing to learn or forget, e.g.
+    when every forgotten message was rejected by markovify, nothing is
+    merged or appended.
+
+    Parameters
+    ----------
+    model : CompactText
+        The model to update.
+    messages : list[str]
+        The cleaned messages to train with.
+    state_size : int
+        The state size of the model.
+    save_location : Path
+        The location of the chain snapshot. If there is no snapshot in the
+        memory-mapped chain format, `model` is saved there first.
+    forget_messages : list[str] | None
+        The cleaned messages to forget, whose counts are subtracted in the
+        same update.
+
+    Returns
+    -------
+    tuple[CompactText, int | None]
+        The updated model, and the sequence of its record in the log, or
+        `model` and None if there was nothing to update.
+
+    """
+    delta = markovify.NewlineText("\n".join(messages), state_size=state_size).chain.model if messages else {}
+    if forget_messages:
+        try:
+            forgotten = markovify.NewlineText("\n".join(forget_messages), state_size=state_size).chain.model
+        except KeyError:  # every sentence was rejected, so the messages were never learnt
+            forgotten = {}
+        _add_counts(delta, forgotten, -1)
+    if not delta:
+        return model, None
+    updated_model = model.merge(delta)
+    if not is_array_file(save_location):
+        save_markov_model(model, save_location)
+    sequence = append_delta(log_location_for(save_location), delta, _snapshot_sequence(save_location))
+
+    return updated_model, sequence
+
+
+async def update_markov_chain_for_model(  # noqa: C901, PLR0911, PLR0912, PLR0913
     inter: ApplicationCommandInteraction | None,
-    model: markovify.Text,
+    model: CompactText,
     new_messages: list[str],
     save_location: str | Path,
-) -> markovify.Text | None:
+    forget_messages: list[str] | None = None,
+    *,
+    normalised: bool = False,
+) -> CompactText | object | None:
     """Update a Markov chain model.
 
-    Can be used either with a command interaction, or by itself.
+    Can be used either with a command interaction, or by itself. Training,
+    merging and saving run in a worker thread, so the bot keeps responding
+    while the chain is updated. If `model` is the current MARKOV_MODEL, the
+    updated model is published in its place. Only one update runs at a
+    time.
+
+    The update is appended to the chain's delta log. Once the log is larger
+    than MARKOV_LOG_COMPACT_BYTES, it is compacted into the snapshot after
+    the updated model has been published. If MARKOV_PRUNE_AFTER_UPDATE is
+    set, or the model has grown past MARKOV_MAX_CHAIN_BYTES, the model is
+    pruned and written as the new snapshot before it is published. A legacy
+    pickled chain is first converted into a `.markov` snapshot next to it,
+    which is used from then on.
+
+    Messages in `forget_messages` are unlearnt in the same update, by
+    subtracting their counts, e.g. for messages which have been deleted.
 
     Parameters
     ----------
     inter : ApplicationCommandInteraction
         A Discord interaction with a deferred response.
-    model : markovify.Text
-        The model to update with new messages.
+    model : CompactText
+        The model to update with new messages. It is not modified.
     new_messages : List[str]
         A list of strings to update the chain with.
     save_location : str | Path
         The location the save the chain.
+    forget_messages : list[str] | None
+        A list of strings the chain has learnt and should forget.
+    normalised : bool
+        Whether the messages have already been cleaned for learning, e.g.
+        with `normalise_for_learning` when they arrived.
 
     Returns
     -------
-    markovify.Text | None
-        Either the updated model, a co-routine for a interaction, or None
-        when no interaction is passed and a model could not be updated.
+    CompactText | object | None
+        Either the updated model, MARKOV_CHAIN_UNCHANGED if the messages
+        learnt and forgotten cancel out so the chain is the same, or None if
+        there were no messages or the model could not be updated.
 
     """
-    if not model or not isinstance(model, markovify.Text):
+    if not model or not isinstance(model, CompactText):
         msg = "The provided markov model is not valid"
         raise ValueError(msg)
 
     if not isinstance(save_location, Path):
         save_location = Path(save_location)
 
-    state_size = int(re.findall(r"\d+", save_location.name)[0])
+    save_location = save_location.with_suffix(CHAIN_FILE_SUFFIX)
 
-    if len(new_messages) == 0:
+    if len(new_messages) == 0 and not forget_messages:
         if inter:
             await deferred_error_message(inter, "No new messages to update chain with.")
             return None
         LOGGER.info("No sentences to update chain with")
         return None
 
-    messages = _clean_sentence_for_learning(new_messages)
+    if normalised:
+        messages = list(new_messages)
+        forget_messages = list(forget_messages or [])
+    else:
+        messages = clean_messages_for_learning(new_messages)
+        forget_messages = clean_messages_for_learning(forget_messages or [])
     num_messages = len(messages)
 
-    if num_messages == 0:
+    if num_messages == 0 and not forget_messages:
         if inter:
             await deferred_error_message(inter, "No new messages to update chain with.")
             return None
         LOGGER.info("No sentences to update chain with")
         return None
 
-    shutil.copy2(save_location, str(save_location) + ".bak")
-    try:
-        new_model = markovify.NewlineText("\n".join(messages), state_size=state_size if state_size != 0 else 2)
-    except KeyError:  # I can't remember what causes this... but it can happen when indexing new words
-        if inter:
-            await deferred_error_message(inter, "The interim model failed to train.")
+    is_published = model is MARKOV_MODEL
+    async with _UPDATE_LOCK:
+        if is_published:
+            model = MARKOV_MODEL  # another update may have been published while waiting for the lock
+        start = time.perf_counter()
+        try:
+            updated_model, sequence = await asyncio.to_thread(
+                _train_updated_model, model, messages, model.state_size, save_location, forget_messages
+            )
+        except KeyError:  # I can't remember what causes this... but it can happen when indexing new words
+            if inter:
+                await deferred_error_message(inter, "The interim model failed to train.")
+                return None
+            LOGGER.exception("The interim model failed to train.")
             return None
-        LOGGER.exception("The interim model failed to train.")
-        return None
-
-    combined_chain = markovify.combine([model.chain, new_model.chain])
-    with Path.open(save_location, "wb") as file_out:
-        pickle.dump(combined_chain, file_out)
-    model.chain = combined_chain
+        if sequence is None:
+            # Not None, so the forgotten messages are still cleared from the journal
+            LOGGER.info("Nothing to learn or forget in %s, the chain is unchanged", str(save_location))
+            if inter:
+                await inter.edit_original_message(content="Nothing to learn or forget, the chain is unchanged.")
+            return MARKOV_CHAIN_UNCHANGED
+        if _needs_pruning(updated_model, save_location):
+            updated_model = await asyncio.to_thread(prune_markov_chain, updated_model, save_location, sequence)
+            _record_pruned_size(updated_model, save_location)
+        train_time = time.perf_counter() - start
+        if is_published:
+            publish_markov_model(updated_model)
+            BotConfig.set_config("CURRENT_MARKOV_CHAIN", save_location)
+        log_location = log_location_for(save_location)
+        if log_location.exists() and log_location.stat().st_size > BotConfig.get_config("MARKOV_LOG_COMPACT_BYTES"):
+            await asyncio.to_thread(compact_markov_chain, updated_model, save_location, sequence)
 
     if inter:
         await inter.edit_original_message(content=f"Markov chain updated with {num_messages} new messages.")
 
     # num_messages should already but an int, but sometimes it isn't...
     LOGGER.info(
-        "Markov chain (%s) updated with %d new messages",
+        "Markov chain (%s) updated with %d new messages and %d forgotten messages in %.2f s, now version %d "
+        "(swap took %.1f us)",
         str(save_location),
         int(num_messages),
+        len(forget_messages),
+        train_time,
+        MARKOV_MODEL_VERSION,
+        MARKOV_SWAP_LATENCY * 1e6,
     )
 
-    return model
+    return updated_model
 
 
-def generate_text_from_markov_chain(model: markovify.Text, seed_word: str, amount: int) -> str | list[str]:
+def generate_text_from_markov_chain(
+    model: CompactText, seed_word: str, amount: int, deadline: float | None = None
+) -> str | list[str]:
     """Generate a list of markov generated sentences for a specific key word.
 
     Parameters
     ----------
-    model : markovify.Text
+    model : CompactText
         The markov model to use to generate sentences.
     seed_word : str
         The seed word to use.
     amount : int, optional
         The number of sentences to generate.
+    deadline : float | None, optional
+        The `time.monotonic` time to stop generating at, by default None.
+        Since the monotonic clock is shared by every process, the deadline
+        can be set by the bot for generation in a worker.
 
     Returns
     -------
     str | list[str]
         The generated sentence(s), as a str or a list of str.
 
+    Raises
+    ------
+    TimeoutError
+        Raised when the deadline passes before the sentences are generated.
+
     """
     if model:
-        return _get_sentence_from_model(model, seed_word, amount)
+        return _get_sentence_from_model(model, seed_word, amount, deadline)
     if MARKOV_BANK and not MARKOV_MODEL:
         return _get_sentence_from_bank(seed_word, amount)
 
-    return _get_sentence_from_model(MARKOV_MODEL, seed_word, amount)
+    return _get_sentence_from_model(MARKOV_MODEL, seed_word, amount, deadline)
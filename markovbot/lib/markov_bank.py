@@ -0,0 +1,681 @@
+"""A bank of pre-generated Markov sentences, by seed word.
+
+The bank is stored in the array format from `markovbot.lib.array_store`, so
+it is memory-mapped rather than read into memory:
+
+    seed_*            the seed words, as a `Vocabulary` table
+    sentence_starts   the first sentence of each seed, plus the final end
+    sentence_offsets  the start of each sentence in the blob, plus the end
+    sentence_blob     every sentence, packed as UTF-8
+
+The sentences of seed `i` are `sentence_starts[i]` to `sentence_starts[i + 1]`,
+so picking a random sentence for a seed is a hash lookup of the seed and a
+couple of array lookups, and only the pages holding that sentence are read.
+
+Sentences added to a bank are appended to a log next to it,
+
+    magic (4 bytes) | payload length (uint32) | crc32 (uint32)
+    payload: {"seed": seed word, "sentences": [sentence, ...]} as JSON
+
+so adding sentences does not rewrite the bank. The log is read into memory
+when the bank is loaded, and folded into the bank file once it is larger
+than MARKOV_LOG_COMPACT_BYTES. A record which was only partially written is
+ignored, and overwritten by the next append.
+
+The JSON banks written by earlier versions of the bot are converted into the
+array format the first time they are loaded.
+
+Banks are built with `build_markov_bank`, which generates sentences for each
+seed word in a `MarkovWorkerPool`, either with `markovbot bank` or in the
+background after the bot updates its chain. Random sentences are stored
+under the seed BANK_RANDOM_SEED.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import struct
+import time
+import zlib
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+import numpy as np
+
+from markovbot.lib.array_store import read_arrays, write_arrays
+from markovbot.lib.config import BotConfig
+from markovbot.lib.markov import BANK_RANDOM_SEED, BEGIN_ID, END_ID, CompactText, Vocabulary
+
+LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
+
+BANK_FILE_SUFFIX = ".bank"
+BANK_RECORD_MAGIC = b"MKVB"
+
+BANK_BUILD_CHUNK = 100
+BANK_BUILD_ATTEMPTS = 3
+MIN_SEED_WORD_LENGTH = 4
+
+_RECORD_HEADER = struct.Struct("<4sII")
+
+
+def _read_records(log_location: Path) -> tuple[dict[str, list[str]], int]:
+    """Read the sentences appended to a bank.
+
+    Parameters
+    ----------
+    log_location : Path
+        The bank's log.
+
+    Returns
+    -------
+    tuple[dict[str, list[str]], int]
+        The appended sentences by seed word, and the offset just after the
+        last complete record.
+
+    """
+    appended = {}
+    end = 0
+    if not log_location.exists():
+        return appended, end
+
+    with log_location.open("rb") as file_in:
+        while True:
+            header = file_in.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                break
+            magic, length, checksum = _RECORD_HEADER.unpack(header)
+            payload = file_in.read(length) if magic == BANK_RECORD_MAGIC else b""
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                LOGGER.warning("Stopped reading %s at a corrupt or incomplete record", log_location)
+                break
+            record = json.loads(payload)
+            appended.setdefault(record["seed"], []).extend(record["sentences"])
+            end = file_in.tell()
+
+    return appended, end
+
+
+def _scan_records(file: object) -> int:
+    """Find the end of the last complete record, by reading only the headers.
+
+    Parameters
+    ----------
+    file : object
+        The log file, opened for binary reading.
+
+    Returns
+    -------
+    int
+        The offset just after the last complete record.
+
+    """
+    file_size = os.fstat(file.fileno()).st_size
+    end = 0
+    while True:
+        file.seek(end)
+        header = file.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size:
+            break
+        magic, length, _ = _RECORD_HEADER.unpack(header)
+        if magic != BANK_RECORD_MAGIC or end + _RECORD_HEADER.size + length > file_size:
+            break
+        end += _RECORD_HEADER.size + length
+
+    return end
+
+
+class MarkovBank:
+    """Memory-mapped Markov sentences, by seed word."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        location: str | Path,
+        seeds: Vocabulary,
+        sentence_starts: np.ndarray,
+        sentence_offsets: np.ndarray,
+        sentence_blob: np.ndarray,
+        appended: dict[str, list[str]] | None = None,
+    ) -> None:
+        """Initialise the bank from its arrays.
+
+        Parameters
+        ----------
+        location : str | Path
+            The location of the bank file.
+        seeds : Vocabulary
+            The seed words.
+        sentence_starts : np.ndarray
+            The first sentence of each seed, plus the final end.
+        sentence_offsets : np.ndarray
+            The start of each sentence in the blob, plus the final end.
+        sentence_blob : np.ndarray
+            The UTF-8 sentences.
+        appended : dict[str, list[str]] | None
+            Sentences in the log which are not in the bank file yet.
+
+        """
+        self.location = Path(location)
+        self.seeds = seeds
+        self.sentence_starts = sentence_starts
+        self.sentence_offsets = sentence_offsets
+        self.sentence_blob = sentence_blob
+        self.appended = appended or {}
+        # The end of the last complete record in the log, found on the first append if not loaded
+        self.log_end = None
+
+    @property
+    def log_location(self) -> Path:
+        """The location of the log of appended sentences."""
+        return self.location.with_name(self.location.name + ".log")
+
+    @property
+    def seed_words(self) -> list[str]:
+        """Every seed word in the bank."""
+        return list(dict.fromkeys(self.seeds.words(range(len(self.seeds))) + list(self.appended)))
+
+    @classmethod
+    def from_dict(cls, sentences: dict[str, list[str]], location: str | Path) -> "MarkovBank":
+        """Create a bank in memory from sentences by seed word.
+
+        Parameters
+        ----------
+        sentences : dict[str, list[str]]
+            The sentences of each seed word.
+        location : str | Path
+            The location the bank will be saved to.
+
+        Returns
+        -------
+        MarkovBank
+            The bank, which has not been saved.
+
+        """
+        encoded = [sentence.encode("utf-8", "surrogatepass") for seed in sentences for sentence in sentences[seed]]
+        sentence_starts = np.zeros(len(sentences) + 1, dtype=np.int64)
+        sentence_starts[1:] = np.cumsum([len(seed_sentences) for seed_sentences in sentences.values()])
+        sentence_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        sentence_offsets[1:] = np.cumsum([len(sentence) for sentence in encoded], dtype=np.int64)
+
+        return cls(
+            location,
+            Vocabulary.from_words(sentences),
+            sentence_starts,
+            sentence_offsets,
+            np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        )
+
+    @classmethod
+    def load(cls, location: str | Path) -> "MarkovBank":
+        """Load a bank, with any sentences appended to its log.
+
+        Parameters
+        ----------
+        location : str | Path
+            The location of the bank file.
+
+        Returns
+        -------
+        MarkovBank
+            The bank, or an empty bank if the file does not exist.
+
+        """
+        location = Path(location)
+        if not location.exists():
+            bank = cls.from_dict({}, location)
+        else:
+            arrays, _ = read_arrays(location)
+            bank = cls(
+                location,
+                Vocabulary(arrays["seed_blob"], arrays["seed_offsets"], arrays["seed_hashes"], arrays["seed_order"]),
+                arrays["sentence_starts"],
+                arrays["sentence_offsets"],
+                arrays["sentence_blob"],
+            )
+        bank.appended, bank.log_end = _read_records(bank.log_location)
+
+        return bank
+
+    def to_dict(self) -> dict[str, list[str]]:
+        """Get every sentence in the bank, by seed word.
+
+        Returns
+        -------
+        dict[str, list[str]]
+            The sentences of each seed word.
+
+        """
+        return {seed: self.sentences(seed) for seed in self.seed_words}
+
+    def save(self) -> None:
+        """Write every sentence into the bank file, and remove the log."""
+        bank = MarkovBank.from_dict(self.to_dict(), self.location) if self.appended else self
+        self.location.parent.mkdir(parents=True, exist_ok=True)
+        write_arrays(
+            self.location,
+            {
+                "seed_blob": bank.seeds.blob,
+                "seed_offsets": bank.seeds.offsets,
+                "seed_hashes": bank.seeds.hashes,
+                "seed_order": bank.seeds.order,
+                "sentence_starts": bank.sentence_starts,
+                "sentence_offsets": bank.sentence_offsets,
+                "sentence_blob": bank.sentence_blob,
+            },
+            {"kind": "markov_bank", "num_seeds": len(bank.seeds), "num_sentences": len(bank.sentence_offsets) - 1},
+        )
+        self.log_location.unlink(missing_ok=True)
+        self.log_end = 0
+        self.seeds = bank.seeds
+        self.sentence_starts = bank.sentence_starts
+        self.sentence_offsets = bank.sentence_offsets
+        self.sentence_blob = bank.sentence_blob
+        self.appended = {}
+
+    def append(self, seed: str, sentences: list[str]) -> None:
+        """Add sentences for a seed word.
+
+        The sentences are appended to the log and flushed to disk before
+        returning. The log is folded into the bank file once it is larger
+        than MARKOV_LOG_COMPACT_BYTES.
+
+        Parameters
+        ----------
+        seed : str
+            The seed word.
+        sentences : list[str]
+            The sentences to add.
+
+        """
+        if not sentences:
+            return
+        payload = json.dumps({"seed": seed, "sentences": sentences}).encode("utf-8")
+        record = _RECORD_HEADER.pack(BANK_RECORD_MAGIC, len(payload), zlib.crc32(payload)) + payload
+        self.log_location.parent.mkdir(parents=True, exist_ok=True)
+        with self.log_location.open("r+b" if self.log_location.exists() else "wb") as file_out:
+            if self.log_end is None:
+                self.log_end = _scan_records(file_out)
+            file_out.seek(self.log_end)
+            file_out.truncate()
+            file_out.write(record)
+            file_out.flush()
+            os.fsync(file_out.fileno())
+        self.log_end += len(record)
+        self.appended.setdefault(seed, []).extend(sentences)
+
+        if self.log_location.stat().st_size > BotConfig.get_config("MARKOV_LOG_COMPACT_BYTES"):
+            self.save()
+
+    def _seed_range(self, seed: str) -> tuple[int, int]:
+        """Get the range of a seed's sentences in the bank file.
+
+        Parameters
+        ----------
+        seed : str
+            The seed word.
+
+        Returns
+        -------
+        tuple[int, int]
+            The first sentence and the end of the range, which is empty if
+            the seed is not in the bank file.
+
+        """
+        seed_id = self.seeds.id(seed)
+        if seed_id is None:
+            return 0, 0
+        return int(self.sentence_starts[seed_id]), int(self.sentence_starts[seed_id + 1])
+
+    def _sentence(self, index: int) -> str:
+        """Decode a sentence in the bank file.
+
+        Parameters
+        ----------
+        index : int
+            The index of the sentence.
+
+        Returns
+        -------
+        str
+            The sentence.
+
+        """
+        start, end = self.sentence_offsets[index], self.sentence_offsets[index + 1]
+        return bytes(self.sentence_blob[start:end]).decode("utf-8", "surrogatepass")
+
+    def num_sentences(self, seed: str) -> int:
+        """Get the number of sentences for a seed word.
+
+        Parameters
+        ----------
+        seed : str
+            The seed word.
+
+        Returns
+        -------
+        int
+            The number of sentences.
+
+        """
+        start, end = self._seed_range(seed)
+        return end - start + len(self.appended.get(seed, []))
+
+    def sentences(self, seed: str) -> list[str]:
+        """Get every sentence for a seed word.
+
+        Parameters
+        ----------
+        seed : str
+            The seed word.
+
+        Returns
+        -------
+        list[str]
+            The sentences.
+
+        """
+        start, end = self._seed_range(seed)
+        return [self._sentence(index) for index in range(start, end)] + self.appended.get(seed, [])
+
+    def random_sentence(self, seed: str) -> str | None:
+        """Choose a random sentence for a seed word.
+
+        Parameters
+        ----------
+        seed : str
+            The seed word.
+
+        Returns
+        -------
+        str | None
+            The sentence, or None if the bank has no sentences for the seed.
+
+        """
+        start, end = self._seed_range(seed)
+        appended = self.appended.get(seed, [])
+        num_sentences = end - start + len(appended)
+        if num_sentences == 0:
+            return None
+        choice = random.randrange(num_sentences)
+        if choice >= end - start:
+            return appended[choice - (end - start)]
+        return self._sentence(start + choice)
+
+    def __contains__(self, seed: str) -> bool:
+        """Check if the bank has any sentences for a seed word."""
+        return self.num_sentences(seed) > 0
+
+
+def load_markov_bank(bank_location: str | Path) -> MarkovBank:
+    """Load a pre-generated bank of Markov sentences.
+
+    A JSON bank, in the format
+
+        {
+            "seed_word": [sentence1, sentence2, ...]
+        }
+
+    is converted into a bank file next to it, which is loaded instead.
+
+    Parameters
+    ----------
+    bank_location : str | Path
+        The file path to the bank file.
+
+    Returns
+    -------
+    MarkovBank
+        The bank of Markov sentences.
+
+    """
+    path = Path(bank_location)
+    if not path.exists():
+        msg = f"No bank at {bank_location}"
+        raise OSError(msg)
+
+    if path.suffix == ".json":
+        with path.open("r") as file_in:
+            sentences = json.load(file_in)
+        path = path.with_suffix(BANK_FILE_SUFFIX)
+        MarkovBank.from_dict(sentences, path).save()
+        LOGGER.info("Converted Markov bank %s into %s", bank_location, path)
+
+    bank = MarkovBank.load(path)
+    LOGGER.info("Markov bank %s has been loaded", path)
+
+    return bank
+
+
+def seed_words_from_file(location: str | Path) -> list[str]:
+    """Read seed words from a file, one per line.
+
+    Blank lines and lines starting with # are skipped.
+
+    Parameters
+    ----------
+    location : str | Path
+        The location of the file.
+
+    Returns
+    -------
+    list[str]
+        The seed words, in the order they are in the file.
+
+    """
+    with Path(location).open("r", encoding="utf-8") as file_in:
+        words = [line.strip() for line in file_in]
+
+    return list(dict.fromkeys(word for word in words if word and not word.startswith("#")))
+
+
+def seed_words_from_chain(model: CompactText, num_words: int) -> list[str]:
+    """Choose the most frequent words in a chain as seed words.
+
+    Only words made of letters and at least MIN_SEED_WORD_LENGTH long are
+    used, which skips most stop words, punctuation, links and mentions.
+
+    Parameters
+    ----------
+    model : CompactText
+        The model to take words from.
+    num_words : int
+        The number of seed words.
+
+    Returns
+    -------
+    list[str]
+        The seed words, from the most frequent.
+
+    """
+    chain = model.chain
+    _, successors, counts = chain.transitions()
+    frequencies = np.bincount(successors, weights=counts, minlength=len(chain.vocabulary))
+    frequencies[[BEGIN_ID, END_ID]] = 0
+
+    words = []
+    for word_id in np.argsort(-frequencies, kind="stable").tolist():
+        if len(words) >= num_words or frequencies[word_id] <= 0:
+            break
+        word = chain.vocabulary.word(word_id)
+        if len(word) >= MIN_SEED_WORD_LENGTH and word.isalpha():
+            words.append(word)
+
+    return words
+
+
+def bank_targets(
+    model: CompactText,
+    seed_file: str | Path | None,
+    num_top_seeds: int,
+    sentences_per_seed: int,
+    random_sentences: int,
+) -> dict[str | None, int]:
+    """Choose the seed words for a bank, and how many sentences each needs.
+
+    Parameters
+    ----------
+    model : CompactText
+        The model the bank is generated from.
+    seed_file : str | Path | None
+        A file of seed words, or None. It is skipped if it does not exist.
+    num_top_seeds : int
+        The number of the most frequent words in the chain to use as seeds.
+    sentences_per_seed : int
+        The number of sentences for each seed word.
+    random_sentences : int
+        The number of random sentences.
+
+    Returns
+    -------
+    dict[str | None, int]
+        The number of sentences for each seed word, with None for random
+        sentences.
+
+    """
+    seed_words = []
+    if seed_file and Path(seed_file).exists():
+        seed_words += seed_words_from_file(seed_file)
+    if num_top_seeds > 0:
+        seed_words += seed_words_from_chain(model, num_top_seeds)
+    targets = dict.fromkeys(seed_words, sentences_per_seed)
+    if random_sentences > 0:
+        targets[None] = random_sentences
+
+    return targets
+
+
+async def _generate_unique_sentences(
+    generate: Callable[[str | None, int], Awaitable[str | list[str]]],
+    seed_word: str | None,
+    amount: int,
+    existing: set[str],
+    limit: asyncio.Semaphore,
+) -> list[str]:
+    """Generate sentences for a seed word which are not already known.
+
+    The sentences are generated in chunks of BANK_BUILD_CHUNK, which run in
+    parallel. Duplicate sentences are thrown away, and replaced for up to
+    BANK_BUILD_ATTEMPTS rounds.
+
+    Parameters
+    ----------
+    generate : Callable[[str | None, int], Awaitable[str | list[str]]]
+        The function to generate sentences with, such as
+        `MarkovWorkerPool.generate`.
+    seed_word : str | None
+        The seed word, or None for random sentences.
+    amount : int
+        The number of sentences to generate.
+    existing : set[str]
+        The sentences already in the bank.
+    limit : asyncio.Semaphore
+        Limits the number of chunks being generated at once.
+
+    Returns
+    -------
+    list[str]
+        The new sentences, which may be fewer than requested.
+
+    """
+
+    async def generate_chunk(size: int) -> list[str]:
+        async with limit:
+            try:
+                sentences = await generate(seed_word, size)
+            except TimeoutError:
+                return []
+        return [sentences] if isinstance(sentences, str) else sentences
+
+    new_sentences = {}
+    for _ in range(BANK_BUILD_ATTEMPTS):
+        remaining = amount - len(new_sentences)
+        if remaining <= 0:
+            break
+        chunks = await asyncio.gather(
+            *(
+                generate_chunk(min(BANK_BUILD_CHUNK, remaining - start))
+                for start in range(0, remaining, BANK_BUILD_CHUNK)
+            )
+        )
+        for sentences in chunks:
+            new_sentences.update(dict.fromkeys(sentence for sentence in sentences if sentence not in existing))
+
+    return list(new_sentences)[:amount]
+
+
+async def build_markov_bank(
+    bank: MarkovBank,
+    targets: dict[str | None, int],
+    generate: Callable[[str | None, int], Awaitable[str | list[str]]],
+    concurrency: int,
+    *,
+    refresh: bool = False,
+) -> MarkovBank:
+    """Generate sentences for seed words and save them to a bank.
+
+    Unless the bank is being refreshed, each seed word only has sentences
+    generated until it has its target number, so an interrupted build is
+    resumed from the sentences already in the bank and its log. New
+    sentences are appended to the bank as each seed word is finished.
+
+    A refreshed bank has new sentences generated for every seed word in
+    `targets`, for example after the chain has changed, and replaces the old
+    bank only once every seed word has been generated. Seed words which are
+    in the bank but not in `targets`, such as hand written ones, and seed
+    words which no new sentences could be generated for keep their old
+    sentences. Either way, the bank file is written atomically.
+
+    Parameters
+    ----------
+    bank : MarkovBank
+        The existing bank, which may be empty.
+    targets : dict[str | None, int]
+        The number of sentences wanted for each seed word, with None for
+        random sentences.
+    generate : Callable[[str | None, int], Awaitable[str | list[str]]]
+        The function to generate sentences with, such as
+        `MarkovWorkerPool.generate`.
+    concurrency : int
+        The number of chunks to generate at once, usually the number of
+        workers generating sentences.
+    refresh : bool
+        If True, replace the sentences of the seed words in `targets`.
+
+    Returns
+    -------
+    MarkovBank
+        The saved bank.
+
+    """
+    limit = asyncio.Semaphore(max(concurrency, 1))
+    refreshed = {}
+
+    async def build_seed(seed_word: str | None, amount: int) -> None:
+        seed = seed_word or BANK_RANDOM_SEED
+        existing = set() if refresh else set(bank.sentences(seed))
+        if len(existing) >= amount:
+            return
+        start = time.perf_counter()
+        sentences = await _generate_unique_sentences(generate, seed_word, amount - len(existing), existing, limit)
+        if refresh:
+            refreshed[seed] = sentences
+        else:
+            bank.append(seed, sentences)
+        LOGGER.debug("Generated %d sentences for '%s' in %.1f s", len(sentences), seed, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(build_seed(seed_word, amount) for seed_word, amount in targets.items()))
+    if refresh:
+        kept = {seed: bank.sentences(seed) for seed in bank.seed_words if not refreshed.get(seed)}
+        refreshed = {seed: sentences for seed, sentences in refreshed.items() if sentences}
+        bank = MarkovBank.from_dict(kept | refreshed, bank.location)
+    await asyncio.to_thread(bank.save)
+    LOGGER.info(
+        "Built Markov bank %s with %d seed words in %.1f s",
+        bank.location,
+        len(bank.seeds),
+        time.perf_counter() - start,
+    )
+
+    return bank
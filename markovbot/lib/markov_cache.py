@@ -0,0 +1,198 @@
+"""Cache of pre-generated Markov sentences.
+
+Sentences are kept in a small ring buffer per seed word, so answering a
+`?word` trigger is a dict lookup and a pop. Seeds are kept in least recently
+used order and the least recently used seeds are evicted when the cache uses
+more than its memory cap. Buffers are refilled in the background by
+`refill`, which awaits an asynchronous generation function, e.g.
+`MarkovWorkerPool.generate`, so the event loop is not blocked.
+"""
+
+import logging
+import sys
+from collections import OrderedDict, deque
+from collections.abc import Awaitable, Callable
+
+from markovbot.lib.config import BotConfig
+
+LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
+
+# Rough overhead of a seed's dict entry, key and deque, in bytes
+SEED_OVERHEAD_BYTES = 700
+
+
+class MarkovSentenceCache:
+    """Bounded, LRU evicted ring buffers of sentences for each seed word."""
+
+    def __init__(
+        self,
+        generate: Callable[[str | None, int], Awaitable[str | list[str]]],
+        sentences_per_seed: int,
+        max_bytes: int,
+    ) -> None:
+        """Initialise the cache.
+
+        Parameters
+        ----------
+        generate : Callable[[str | None, int], Awaitable[str | list[str]]]
+            A coroutine function which generates an amount of sentences for a
+            seed word, or random sentences when the seed is None. It returns a
+            str for a single sentence and a list of str otherwise.
+        sentences_per_seed : int
+            The size of each seed's ring buffer.
+        max_bytes : int
+            The approximate maximum memory used by the cached sentences.
+
+        """
+        self.generate = generate
+        self.sentences_per_seed = sentences_per_seed
+        self.max_bytes = max_bytes
+        self.buffers: OrderedDict[str | None, deque[str]] = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+
+    def __len__(self) -> int:
+        """Get the number of seed words in the cache."""
+        return len(self.buffers)
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of requests which were answered from the cache."""
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def get(self, seed_word: str | None) -> str | None:
+        """Take a sentence for a seed word from the cache.
+
+        A miss adds the seed word to the cache, so its buffer is filled on the
+        next refill.
+
+        Parameters
+        ----------
+        seed_word : str | None
+            The seed word, or None for a random sentence.
+
+        Returns
+        -------
+        str | None
+            A sentence, or None if there is none cached for the seed word.
+
+        """
+        buffer = self.buffers.get(seed_word)
+        if buffer is None:
+            self.buffers[seed_word] = deque(maxlen=self.sentences_per_seed)
+            self.nbytes += SEED_OVERHEAD_BYTES
+            self._evict()
+            self.misses += 1
+            return None
+
+        self.buffers.move_to_end(seed_word)
+        if not buffer:
+            self.misses += 1
+            return None
+
+        sentence = buffer.popleft()
+        self.nbytes -= sys.getsizeof(sentence)
+        self.hits += 1
+
+        return sentence
+
+    def put(self, seed_word: str | None, sentences: list[str], version: int | None = None) -> None:
+        """Add sentences to the buffer of a seed word already in the cache.
+
+        Parameters
+        ----------
+        seed_word : str | None
+            The seed word, or None for random sentences.
+        sentences : list[str]
+            The sentences to add. When the buffer is full, the oldest
+            sentences are dropped.
+        version : int | None
+            The cache version the sentences were generated for. Sentences
+            generated before the last invalidation are discarded.
+
+        """
+        if version is not None and version != self.version:
+            return
+        buffer = self.buffers.get(seed_word)
+        if buffer is None:  # the seed was evicted while the sentences were generated
+            return
+
+        for sentence in sentences:
+            if len(buffer) == buffer.maxlen:
+                self.nbytes -= sys.getsizeof(buffer[0])
+            buffer.append(sentence)
+            self.nbytes += sys.getsizeof(sentence)
+        self._evict()
+
+    def invalidate(self) -> None:
+        """Drop every cached sentence, e.g. after the chain has been updated.
+
+        The seed words are kept, so their buffers are refilled from the new
+        chain.
+        """
+        LOGGER.info(
+            "Invalidating Markov cache: %d seeds, %d bytes, %d hits, %d misses (%.1f%% hit rate)",
+            len(self.buffers),
+            self.nbytes,
+            self.hits,
+            self.misses,
+            100 * self.hit_rate,
+        )
+        for buffer in self.buffers.values():
+            buffer.clear()
+        self.nbytes = SEED_OVERHEAD_BYTES * len(self.buffers)
+        self.version += 1
+
+    def seeds_to_refill(self) -> list[str | None]:
+        """Get the seed words which have space in their buffer.
+
+        Returns
+        -------
+        list[str | None]
+            The seed words, most recently used first.
+
+        """
+        return [seed_word for seed_word, buffer in reversed(self.buffers.items()) if len(buffer) < buffer.maxlen]
+
+    async def refill(self, max_sentences: int) -> int:
+        """Generate sentences for the seed words which need them.
+
+        The most recently used seed words are refilled first. Seed words
+        whose generation fails are skipped until the next refill.
+
+        Parameters
+        ----------
+        max_sentences : int
+            The maximum number of sentences to generate.
+
+        Returns
+        -------
+        int
+            The number of sentences generated.
+
+        """
+        generated = 0
+        for seed_word in self.seeds_to_refill():
+            buffer = self.buffers.get(seed_word)
+            if buffer is None:
+                continue
+            amount = min(buffer.maxlen - len(buffer), max_sentences - generated)
+            if amount <= 0:
+                break
+            version = self.version
+            try:
+                sentences = await self.generate(seed_word, amount)
+            except TimeoutError:
+                continue
+            self.put(seed_word, [sentences] if isinstance(sentences, str) else sentences, version)
+            generated += amount
+
+        return generated
+
+    def _evict(self) -> None:
+        """Evict the least recently used seed words until under the memory cap."""
+        while self.nbytes > self.max_bytes and len(self.buffers) > 1:
+            _, buffer = self.buffers.popitem(last=False)
+            self.nbytes -= SEED_OVERHEAD_BYTES + sum(sys.getsizeof(sentence) for sentence in buffer)
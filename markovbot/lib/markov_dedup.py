@@ -0,0 +1,304 @@
+"""Reject repeated and near-duplicate messages before they are learnt.
+
+Copypasta, bot spam and repeated memes would otherwise be learnt every time
+they are posted, and inflate the counts of their transitions until they
+dominate the chain. `MessageDeduplicator` remembers the most recent messages
+it has let through, and rejects a message which is the same as one of them:
+
+* exactly, after case folding and collapsing whitespace, which is found with
+  a hash of the text,
+* or nearly, when the Jaccard similarity of the sets of 5 character shingles
+  of the two messages is at least `threshold`.
+
+Near-duplicates are found with MinHash and locality sensitive hashing. Each
+message is given a signature of `num_permutations` minimum hashes of its
+shingles, computed for a whole batch of messages at once with NumPy. The
+fraction of the hashes two signatures share estimates the similarity of the
+messages. The signature is cut into `num_bands` bands, and a message is only
+compared with the messages which share a band with it, so a message is
+checked against the whole window in constant time. With the default 16 bands
+of 4 hashes, a message with a similarity of 0.8 to one in the window is found
+99.98% of the time.
+
+At most `max_messages` messages are remembered, using about 1.5 kB each, and
+the oldest message is forgotten first. A duplicate counts as a new sighting
+of the message it duplicates, so spam which keeps being posted is not
+forgotten. Messages with fewer than `min_words` words are never rejected, as
+short replies are repeated naturally.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+DEFAULT_MAX_MESSAGES = 20_000
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_MIN_WORDS = 4
+SHINGLE_SIZE = 5
+
+_HASH_SEED = 1_853_020_188
+
+
+def _normalise(message: str) -> str:
+    """Case fold a message and collapse its whitespace.
+
+    Parameters
+    ----------
+    message : str
+        The message.
+
+    Returns
+    -------
+    str
+        The normalised message.
+
+    """
+    return " ".join(message.casefold().split())
+
+
+def minhash_signatures(texts: list[str], num_permutations: int) -> np.ndarray:
+    """Compute the MinHash signature of the shingles of each text.
+
+    Each text is encoded as UTF-8 and cut into overlapping shingles of
+    `SHINGLE_SIZE` bytes, with texts shorter than that padded with spaces.
+    Each shingle is hashed with `num_permutations` multiply-shift hashes,
+    and the signature of a text is the minimum of each hash over its
+    shingles.
+
+    Parameters
+    ----------
+    texts : list[str]
+        The texts.
+    num_permutations : int
+        The number of hashes in each signature.
+
+    Returns
+    -------
+    np.ndarray
+        The signature of each text, with shape (len(texts), num_permutations).
+
+    """
+    if not texts:
+        return np.empty((0, num_permutations), dtype=np.uint32)
+
+    encoded = [text.encode("utf-8").ljust(SHINGLE_SIZE) for text in texts]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+    windows = sliding_window_view(data, SHINGLE_SIZE)
+    shingles = np.zeros(len(windows), dtype=np.uint64)
+    for i in range(SHINGLE_SIZE):
+        shingles = (shingles << np.uint64(8)) | windows[:, i]
+
+    # Only the windows which start and end inside one text are shingles of it
+    num_shingles = lengths - SHINGLE_SIZE + 1
+    segment_starts = np.concatenate(([0], np.cumsum(num_shingles)[:-1]))
+    text_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    shingles = shingles[np.arange(num_shingles.sum()) + np.repeat(text_starts - segment_starts, num_shingles)]
+
+    rng = np.random.default_rng(_HASH_SEED)
+    multipliers = rng.integers(0, 2**63, size=num_permutations, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    increments = rng.integers(0, 2**63, size=num_permutations, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_permutations), dtype=np.uint32)
+    hashes = np.empty_like(shingles)
+    for i in range(num_permutations):
+        np.multiply(shingles, multipliers[i], out=hashes)
+        np.add(hashes, increments[i], out=hashes)
+        # The high half of the smallest hash is the smallest of the high halves
+        signatures[:, i] = np.minimum.reduceat(hashes, segment_starts) >> np.uint64(32)
+
+    return signatures
+
+
+class MessageDeduplicator:
+    """Reject messages which repeat, or nearly repeat, a recent message."""
+
+    def __init__(
+        self,
+        max_messages: int = DEFAULT_MAX_MESSAGES,
+        *,
+        threshold: float = DEFAULT_THRESHOLD,
+        min_words: int = DEFAULT_MIN_WORDS,
+        num_permutations: int = 64,
+        num_bands: int = 16,
+    ) -> None:
+        """Initialise the deduplicator.
+
+        Parameters
+        ----------
+        max_messages : int
+            The number of recent messages to remember.
+        threshold : float
+            The similarity at which a message is a near-duplicate.
+        min_words : int
+            The number of words a message needs to be checked.
+        num_permutations : int
+            The number of hashes in each MinHash signature.
+        num_bands : int
+            The number of bands each signature is cut into, which must divide
+            `num_permutations`.
+
+        """
+        if num_permutations % num_bands:
+            msg = f"The number of bands ({num_bands}) must divide the number of permutations ({num_permutations})"
+            raise ValueError(msg)
+
+        self.max_messages = max_messages
+        self.threshold = threshold
+        self.min_words = min_words
+        self.num_permutations = num_permutations
+        self.num_bands = num_bands
+        self.num_seen = 0
+        self.num_exact = 0
+        self.num_near = 0
+        self._messages = OrderedDict()
+        self._bands = [{} for _ in range(num_bands)]
+
+    def __len__(self) -> int:
+        """Get the number of messages remembered."""
+        return len(self._messages)
+
+    @property
+    def num_rejected(self) -> int:
+        """The number of messages rejected as exact or near-duplicates."""
+        return self.num_exact + self.num_near
+
+    def _band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """Hash each band of the signatures.
+
+        Parameters
+        ----------
+        signatures : np.ndarray
+            The signatures, with shape (n, num_permutations).
+
+        Returns
+        -------
+        np.ndarray
+            The key of each band, with shape (n, num_bands).
+
+        """
+        bands = signatures.reshape(len(signatures), self.num_bands, -1).astype(np.uint64)
+        keys = np.zeros(bands.shape[:2], dtype=np.uint64)
+        for i in range(bands.shape[2]):
+            keys = keys * np.uint64(0x100000001B3) ^ bands[:, :, i]
+
+        return keys
+
+    def _check(self, text: str, signature: np.ndarray, band_keys: list[int]) -> bool:
+        """Check if a message is a duplicate, and remember it if it is not.
+
+        Parameters
+        ----------
+        text : str
+            The normalised message.
+        signature : np.ndarray
+            The signature of the message.
+        band_keys : list[int]
+            The keys of the bands of its signature.
+
+        Returns
+        -------
+        bool
+            True if the message is a duplicate.
+
+        """
+        key = hash(text)
+        if key in self._messages:
+            self._messages.move_to_end(key)
+            self.num_exact += 1
+            return True
+
+        min_matches = self.threshold * self.num_permutations
+        for band, band_key in zip(self._bands, band_keys, strict=True):
+            match = band.get(band_key)
+            if match is not None and np.count_nonzero(self._messages[match] == signature) >= min_matches:
+                self._messages.move_to_end(match)
+                self.num_near += 1
+                return True
+
+        self._messages[key] = signature.copy()
+        for band, band_key in zip(self._bands, band_keys, strict=True):
+            band[band_key] = key
+        if len(self._messages) > self.max_messages:
+            oldest, oldest_signature = self._messages.popitem(last=False)
+            for band, band_key in zip(self._bands, self._band_keys(oldest_signature[None, :])[0].tolist(), strict=True):
+                if band.get(band_key) == oldest:
+                    del band[band_key]
+
+        return False
+
+    def filter(self, messages: list[str]) -> list[str]:
+        """Remove the duplicates from a batch of messages.
+
+        Messages are checked in order, so a message which repeats an earlier
+        message in the batch is removed too.
+
+        Parameters
+        ----------
+        messages : list[str]
+            The messages.
+
+        Returns
+        -------
+        list[str]
+            The messages which are not duplicates, in order.
+
+        """
+        self.num_seen += len(messages)
+        texts = [_normalise(message) for message in messages]
+        checked = [i for i, text in enumerate(texts) if text.count(" ") + 1 >= self.min_words]
+        if not checked or not self.max_messages:
+            return list(messages)
+
+        signatures = minhash_signatures([texts[i] for i in checked], self.num_permutations)
+        band_keys = self._band_keys(signatures).tolist()
+        rejected = {
+            i
+            for i, signature, keys in zip(checked, signatures, band_keys, strict=True)
+            if self._check(texts[i], signature, keys)
+        }
+
+        return [message for i, message in enumerate(messages) if i not in rejected]
+
+    def is_duplicate(self, message: str) -> bool:
+        """Check if a message is a duplicate, and remember it if it is not.
+
+        Parameters
+        ----------
+        message : str
+            The message.
+
+        Returns
+        -------
+        bool
+            True if the message is a duplicate.
+
+        """
+        return not self.filter([message])
+
+    def forget(self, message: str) -> bool:
+        """Forget a message, e.g. the old text of an edited message.
+
+        Without this, an edit which changes only a few characters would be a
+        near duplicate of the message's own old text.
+
+        Parameters
+        ----------
+        message : str
+            The message.
+
+        Returns
+        -------
+        bool
+            True if the message was remembered.
+
+        """
+        key = hash(_normalise(message))
+        signature = self._messages.pop(key, None)
+        if signature is None:
+            return False
+        for band, band_key in zip(self._bands, self._band_keys(signature[None, :])[0].tolist(), strict=True):
+            if band.get(band_key) == key:
+                del band[band_key]
+
+        return True
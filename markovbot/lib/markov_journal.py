@@ -0,0 +1,176 @@
+"""A journal of the messages the Markov chain has learnt.
+
+Once a message has been merged into the chain, the chain no longer knows
+which transitions it came from, so a deleted message could only be forgotten
+by retraining. The journal records the text of every message the bot learns,
+keyed by its message id, in a small SQLite database next to the chain:
+
+    trained_messages(message_id INTEGER PRIMARY KEY, message TEXT, forgotten INTEGER)
+
+The n-grams a message contributed are found again by splitting its text the
+same way it was trained, which costs as much as the message is long. When a
+message is deleted or edited, its row is marked as forgotten, which is cheap
+enough for an event handler and is not lost if the bot restarts. The next
+chain update subtracts the n-grams of every forgotten message, in the same
+delta as the counts of the new messages, and transitions whose count drops
+to zero are pruned by the merge. The forgotten rows are then removed.
+
+Messages are recorded before they are trained, so a message deleted while
+the chain is training is still forgotten by the next update. If the update
+fails, the messages are removed from the journal again and the forgotten
+messages are put back. An edited message is forgotten and learnt again with
+its new text, which replaces the old text in the journal once the old text
+has been taken for the update.
+"""
+
+import sqlite3
+from collections.abc import Iterable
+from pathlib import Path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trained_messages (
+    message_id INTEGER PRIMARY KEY,
+    message TEXT NOT NULL,
+    forgotten INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS forgotten_messages ON trained_messages (message_id) WHERE forgotten = 1;
+"""
+
+
+class MarkovJournal:
+    """The text of each message the Markov chain has learnt."""
+
+    def __init__(self, location: str | Path) -> None:
+        """Open the journal, creating it if it does not exist.
+
+        Parameters
+        ----------
+        location : str | Path
+            The location of the journal database.
+
+        """
+        self.location = Path(location)
+        self.location.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.location)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+
+    def __len__(self) -> int:
+        """Get the number of messages in the journal."""
+        return self.connection.execute("SELECT COUNT(*) FROM trained_messages").fetchone()[0]
+
+    def __contains__(self, message_id: int) -> bool:
+        """Check if a message is in the journal."""
+        return (
+            self.connection.execute("SELECT 1 FROM trained_messages WHERE message_id = ?", (message_id,)).fetchone()
+            is not None
+        )
+
+    def get(self, message_id: int) -> str | None:
+        """Get the text of a message which has been learnt.
+
+        Parameters
+        ----------
+        message_id : int
+            The id of the message.
+
+        Returns
+        -------
+        str | None
+            The text of the message, or None if it is not in the journal.
+
+        """
+        row = self.connection.execute(
+            "SELECT message FROM trained_messages WHERE message_id = ?", (message_id,)
+        ).fetchone()
+
+        return row[0] if row else None
+
+    def record(self, messages: dict[int, str], *, forgotten: bool = False) -> None:
+        """Record the text of messages which are being learnt.
+
+        Parameters
+        ----------
+        messages : dict[int, str]
+            The text of each message, keyed by message id. A message already
+            in the journal is replaced.
+        forgotten : bool
+            Whether the messages are marked to be forgotten.
+
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO trained_messages (message_id, message, forgotten) VALUES (?, ?, ?)",
+                ((message_id, message, int(forgotten)) for message_id, message in messages.items()),
+            )
+
+    def forget(self, message_id: int) -> bool:
+        """Mark a message to be forgotten by the next chain update.
+
+        Parameters
+        ----------
+        message_id : int
+            The id of the message.
+
+        Returns
+        -------
+        bool
+            True if the message is in the journal.
+
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                "UPDATE trained_messages SET forgotten = 1 WHERE message_id = ?", (message_id,)
+            )
+
+        return cursor.rowcount > 0
+
+    def forgotten(self) -> dict[int, str]:
+        """Get the messages which are marked to be forgotten.
+
+        Returns
+        -------
+        dict[int, str]
+            The text of each message, keyed by message id.
+
+        """
+        return dict(self.connection.execute("SELECT message_id, message FROM trained_messages WHERE forgotten = 1"))
+
+    def remove(self, message_ids: Iterable[int]) -> None:
+        """Remove messages from the journal.
+
+        Parameters
+        ----------
+        message_ids : Iterable[int]
+            The ids of the messages.
+
+        """
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM trained_messages WHERE message_id = ?", ((message_id,) for message_id in message_ids)
+            )
+
+    def remove_forgotten(self, messages: dict[int, str]) -> None:
+        """Remove messages which have been forgotten by the chain.
+
+        A message is only removed if it is still marked as forgotten with the
+        same text, so a message which was learnt again after an edit is kept.
+
+        Parameters
+        ----------
+        messages : dict[int, str]
+            The text of each forgotten message, keyed by message id, e.g.
+            from `forgotten`.
+
+        """
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM trained_messages WHERE message_id = ? AND message = ? AND forgotten = 1",
+                messages.items(),
+            )
+
+    async def shutdown(self) -> None:
+        """Close the journal before the bot closes."""
+        self.connection.close()
@@ -0,0 +1,173 @@
+"""Latency budgets for Markov sentence generation.
+
+A sentence for a user is generated with `generate_within_budget`, which gives
+the generation a latency budget. If no sentence has been generated when the
+budget runs out, the request is answered with a fallback sentence instead,
+such as one from the Markov bank or the sentence cache.
+
+The outcome of each request is recorded by a `MarkovLatencyRecorder`:
+
+    in_budget   a sentence was generated within the budget
+    fallback    the budget ran out, and a fallback sentence was used
+    fail        the budget ran out and there was no fallback sentence
+
+Outcomes are appended to a CSV file, with the time, outcome, latency and
+budget of each request, so the budget can be tuned from real requests, and
+a summary of the outcomes is logged each time the file is written to.
+"""
+
+import csv
+import datetime
+import logging
+import time
+from collections import Counter, deque
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+import numpy as np
+
+from markovbot.lib.config import BotConfig
+
+LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
+
+OUTCOME_IN_BUDGET = "in_budget"
+OUTCOME_FALLBACK = "fallback"
+OUTCOME_FAIL = "fail"
+OUTCOMES = (OUTCOME_IN_BUDGET, OUTCOME_FALLBACK, OUTCOME_FAIL)
+
+# The number of outcomes kept in memory for the logged summary
+SUMMARY_SAMPLES = 1000
+
+
+class MarkovLatencyRecorder:
+    """A record of the outcome and latency of budgeted generation requests."""
+
+    def __init__(self, budget: float, log_location: str | Path | None = None, flush_every: int = 100) -> None:
+        """Initialise the recorder.
+
+        Parameters
+        ----------
+        budget : float
+            The latency budget of each request, in seconds.
+        log_location : str | Path | None
+            The CSV file to append outcomes to, or None to only keep the
+            summary in memory.
+        flush_every : int
+            The number of outcomes to buffer before writing them to the file.
+
+        """
+        self.budget = budget
+        self.log_location = Path(log_location) if log_location else None
+        self.flush_every = flush_every
+        self.counts = Counter()
+        self.recent = deque(maxlen=SUMMARY_SAMPLES)
+        self.pending = []
+
+    def record(self, outcome: str, latency: float, seed_word: str | None = None) -> None:
+        """Record the outcome of a request.
+
+        Parameters
+        ----------
+        outcome : str
+            One of OUTCOMES.
+        latency : float
+            The time taken to answer the request, in seconds.
+        seed_word : str | None
+            The seed word of the request, or None for a random sentence.
+
+        """
+        if outcome not in OUTCOMES:
+            msg = f"Unknown generation outcome {outcome}"
+            raise ValueError(msg)
+        self.counts[outcome] += 1
+        self.recent.append((outcome, latency))
+        self.pending.append(
+            (
+                datetime.datetime.now(tz=datetime.UTC).isoformat(timespec="seconds"),
+                outcome,
+                f"{latency:.4f}",
+                f"{self.budget:g}",
+                int(seed_word is not None),
+            )
+        )
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def summary(self) -> str:
+        """Summarise the recent outcomes.
+
+        Returns
+        -------
+        str
+            The fraction of each outcome, and the latency percentiles of the
+            requests which were answered within budget.
+
+        """
+        if not self.recent:
+            return "no Markov generation requests"
+        outcomes = Counter(outcome for outcome, _ in self.recent)
+        fractions = ", ".join(f"{100 * outcomes[outcome] / len(self.recent):.1f}% {outcome}" for outcome in OUTCOMES)
+        latencies = [latency for outcome, latency in self.recent if outcome == OUTCOME_IN_BUDGET]
+        if latencies:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            fractions += f", in budget latency p50 {p50:.3f} s p95 {p95:.3f} s p99 {p99:.3f} s"
+
+        return f"last {len(self.recent)} Markov generation requests: {fractions} (budget {self.budget:g} s)"
+
+    def flush(self) -> None:
+        """Append the buffered outcomes to the file, and log a summary."""
+        if self.pending and self.log_location:
+            new_file = not self.log_location.exists()
+            self.log_location.parent.mkdir(parents=True, exist_ok=True)
+            with self.log_location.open("a", newline="", encoding="utf-8") as file_out:
+                writer = csv.writer(file_out)
+                if new_file:
+                    writer.writerow(["time", "outcome", "latency", "budget", "seeded"])
+                writer.writerows(self.pending)
+        if self.pending:
+            LOGGER.info("%s", self.summary())
+        self.pending.clear()
+
+    async def shutdown(self) -> None:
+        """Write any buffered outcomes before the bot closes."""
+        self.flush()
+
+
+async def generate_within_budget(
+    generate: Callable[[float], Awaitable[str]],
+    fallback: Callable[[], str | None],
+    recorder: MarkovLatencyRecorder,
+    seed_word: str | None = None,
+) -> str | None:
+    """Generate a sentence, or use a fallback if it takes too long.
+
+    Parameters
+    ----------
+    generate : Callable[[float], Awaitable[str]]
+        A coroutine function which generates a sentence with a timeout, in
+        seconds, and raises TimeoutError if it runs out of time. For example,
+        `MarkovWorkerPool.generate` with its `timeout` argument.
+    fallback : Callable[[], str | None]
+        A function which returns a sentence from somewhere cheaper, or None.
+    recorder : MarkovLatencyRecorder
+        The recorder of outcomes, which holds the budget.
+    seed_word : str | None
+        The seed word, which is only used for the record.
+
+    Returns
+    -------
+    str | None
+        The generated or fallback sentence, or None if there was neither.
+
+    """
+    start = time.monotonic()
+    try:
+        sentence = await generate(recorder.budget)
+    except TimeoutError:
+        sentence = fallback()
+        recorder.record(OUTCOME_FALLBACK if sentence else OUTCOME_FAIL, time.monotonic() - start, seed_word)
+        return sentence
+
+    recorder.record(OUTCOME_IN_BUDGET, time.monotonic() - start, seed_word)
+
+    return sentence
@@ -0,0 +1,370 @@
+"""Markov chains partitioned by guild, channel or user.
+
+Each partition has its own chain, stored in the partition directory as
+
+    <directory>/<scope>/<partition id>/chain-<state size>.markov
+
+with a delta log next to it, in the same format as the global chain. Chains
+are trained from the scrape database by
+`scripts/train_partitioned_markov_chains.py`, and from the live training
+sample by `MarkovPartitionStore.update`. The messages for a partition which
+does not have enough of them for a chain yet are kept in a `pending.json`
+file in the partition's directory, so they survive restarts.
+
+Partition chains are loaded on first use, in a thread so the event loop is
+not blocked while the delta log is merged, and the least recently used ones
+are dropped when the loaded chains use more than the memory budget. As the
+chains are memory-mapped, every process which loads a partition shares its
+pages. A partition is only used when its chain exists and knows the seed
+word, otherwise generation falls back to the global MARKOV_MODEL.
+"""
+
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+import markovify
+
+from markovbot.lib import markov
+from markovbot.lib.config import BotConfig
+from markovbot.lib.text_normalisation import clean_messages_for_learning
+
+LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
+
+PARTITION_SCOPES = ("guild", "channel", "user")
+
+PartitionKey = tuple[str, int]
+
+
+def partition_location(directory: str | Path, key: PartitionKey, state_size: int) -> Path:
+    """Get the location of a partition's chain.
+
+    Parameters
+    ----------
+    directory : str | Path
+        The partition directory.
+    key : PartitionKey
+        The scope and ID of the partition.
+    state_size : int
+        The state size of the chain.
+
+    Returns
+    -------
+    Path
+        The location of the chain.
+
+    """
+    scope, partition_id = key
+    return Path(directory) / scope / str(partition_id) / f"chain-{state_size}{markov.CHAIN_FILE_SUFFIX}"
+
+
+def train_partition_model(messages: list[str], state_size: int, save_location: str | Path) -> markov.CompactText:
+    """Train a new chain for a partition and save it.
+
+    Parameters
+    ----------
+    messages : list[str]
+        The cleaned messages to train with.
+    state_size : int
+        The state size of the chain.
+    save_location : str | Path
+        The location to save the chain.
+
+    Returns
+    -------
+    markov.CompactText
+        The new model.
+
+    """
+    text = markovify.NewlineText("\n".join(messages), state_size=state_size)
+    model = markov.CompactText(markov.CompactChain.from_markovify_chain(text.chain))
+    save_location = Path(save_location)
+    save_location.parent.mkdir(parents=True, exist_ok=True)
+    markov.save_markov_model(model, save_location)
+
+    return model
+
+
+class MarkovPartitionStore:
+    """Lazily loaded, memory-bounded partition chains for one scope."""
+
+    def __init__(
+        self,
+        directory: str | Path,
+        scope: str,
+        state_size: int,
+        max_bytes: int,
+        min_messages: int,
+    ) -> None:
+        """Initialise the store.
+
+        Parameters
+        ----------
+        directory : str | Path
+            The partition directory.
+        scope : str
+            What chains are partitioned by: "guild", "channel" or "user".
+        state_size : int
+            The state size of the chains.
+        max_bytes : int
+            The memory budget for loaded chains.
+        min_messages : int
+            The number of messages needed to create a new partition. Until
+            then, its messages are kept in its pending file.
+
+        """
+        if scope not in PARTITION_SCOPES:
+            msg = f"Unknown partition scope {scope}, expected one of {', '.join(PARTITION_SCOPES)}"
+            raise ValueError(msg)
+        self.directory = Path(directory)
+        self.scope = scope
+        self.state_size = state_size
+        self.max_bytes = max_bytes
+        self.min_messages = min_messages
+        self.models: OrderedDict[PartitionKey, markov.CompactText] = OrderedDict()
+        self.nbytes = 0
+
+    def key_for(self, guild_id: int | None, channel_id: int | None, user_id: int | None) -> PartitionKey | None:
+        """Get the partition a message belongs to.
+
+        Parameters
+        ----------
+        guild_id : int | None
+            The guild the message was sent in, or None for a DM.
+        channel_id : int | None
+            The channel the message was sent in.
+        user_id : int | None
+            The author of the message.
+
+        Returns
+        -------
+        PartitionKey | None
+            The partition, or None if the message has no ID for the scope.
+
+        """
+        partition_id = {"guild": guild_id, "channel": channel_id, "user": user_id}[self.scope]
+        if partition_id is None:
+            return None
+        return (self.scope, int(partition_id))
+
+    def location(self, key: PartitionKey) -> Path:
+        """Get the location of a partition's chain.
+
+        Parameters
+        ----------
+        key : PartitionKey
+            The partition.
+
+        Returns
+        -------
+        Path
+            The location of the chain.
+
+        """
+        return partition_location(self.directory, key, self.state_size)
+
+    def pending_location(self, key: PartitionKey) -> Path:
+        """Get the location of the messages waiting for a partition's chain.
+
+        Parameters
+        ----------
+        key : PartitionKey
+            The partition.
+
+        Returns
+        -------
+        Path
+            The location of the pending messages.
+
+        """
+        return self.location(key).with_name("pending.json")
+
+    def read_pending(self, key: PartitionKey) -> list[str]:
+        """Read the messages waiting for a partition's chain.
+
+        Parameters
+        ----------
+        key : PartitionKey
+            The partition.
+
+        Returns
+        -------
+        list[str]
+            The cleaned messages, or an empty list if there are none.
+
+        """
+        location = self.pending_location(key)
+        if not location.exists():
+            return []
+        with location.open("r", encoding="utf-8") as file_in:
+            return json.load(file_in)
+
+    def write_pending(self, key: PartitionKey, messages: list[str]) -> None:
+        """Replace the messages waiting for a partition's chain.
+
+        Parameters
+        ----------
+        key : PartitionKey
+            The partition.
+        messages : list[str]
+            The cleaned messages. The pending file is removed if this is
+            empty.
+
+        """
+        location = self.pending_location(key)
+        if not messages:
+            location.unlink(missing_ok=True)
+            return
+        location.parent.mkdir(parents=True, exist_ok=True)
+        temporary_location = location.with_name(location.name + ".tmp")
+        with temporary_location.open("w", encoding="utf-8") as file_out:
+            json.dump(messages, file_out)
+        temporary_location.replace(location)
+
+    def get(self, key: PartitionKey) -> markov.CompactText | None:
+        """Get a partition's model, loading it if needed.
+
+        Parameters
+        ----------
+        key : PartitionKey
+            The partition.
+
+        Returns
+        -------
+        markov.CompactText | None
+            The model, or None if the partition has no chain.
+
+        """
+        model = self.models.get(key)
+        if model is not None:
+            self.models.move_to_end(key)
+            return model
+
+        location = self.location(key)
+        if not location.exists():
+            return None
+        model = markov.load_markov_model(location, self.state_size)
+        self.put(key, model)
+
+        return model
+
+    async def load(self, key: PartitionKey) -> markov.CompactText | None:
+        """Get a partition's model, loading it in a thread if needed.
+
+        Parameters
+        ----------
+        key : PartitionKey
+            The partition.
+
+        Returns
+        -------
+        markov.CompactText | None
+            The model, or None if the partition has no chain.
+
+        """
+        model = self.models.get(key)
+        if model is not None:
+            self.models.move_to_end(key)
+            return model
+
+        return await asyncio.to_thread(self.get, key)
+
+    def put(self, key: PartitionKey, model: markov.CompactText) -> None:
+        """Add a partition's model, replacing any loaded model.
+
+        Parameters
+        ----------
+        key : PartitionKey
+            The partition.
+        model : markov.CompactText
+            The model.
+
+        """
+        old_model = self.models.pop(key, None)
+        if old_model is not None:
+            self.nbytes -= old_model.nbytes
+        self.models[key] = model
+        self.nbytes += model.nbytes
+        while self.nbytes > self.max_bytes and len(self.models) > 1:
+            dropped_key, dropped_model = self.models.popitem(last=False)
+            self.nbytes -= dropped_model.nbytes
+            LOGGER.debug("Dropped Markov partition %s to stay under the memory budget", dropped_key)
+
+    async def resolve(self, key: PartitionKey | None, seed_word: str | None) -> PartitionKey | None:
+        """Choose whether to generate from a partition or the global chain.
+
+        Parameters
+        ----------
+        key : PartitionKey | None
+            The partition the request came from.
+        seed_word : str | None
+            The seed word, or None for a random sentence.
+
+        Returns
+        -------
+        PartitionKey | None
+            The partition, or None to use the global chain because the
+            partition has no chain or does not know the seed word.
+
+        """
+        if key is None:
+            return None
+        model = await self.load(key)
+        if model is None:
+            return None
+        if seed_word and any(model.chain.vocabulary.id(word) is None for word in seed_word.split()):
+            return None
+        return key
+
+    async def update(self, messages: dict[PartitionKey, list[str]], *, normalised: bool = False) -> int:
+        """Train the partitions with new messages.
+
+        Existing partitions are updated through their delta log. Messages for
+        a partition without a chain are kept in its pending file until there
+        are `min_messages` of them, and a new chain is then trained from them.
+
+        Parameters
+        ----------
+        messages : dict[PartitionKey, list[str]]
+            The new messages for each partition.
+        normalised : bool
+            Whether the messages have already been cleaned for learning.
+
+        Returns
+        -------
+        int
+            The number of partitions which were updated or created.
+
+        """
+        num_updated = 0
+        for key, new_messages in messages.items():
+            model = await self.load(key)
+            if model is not None:
+                updated_model = await markov.update_markov_chain_for_model(
+                    None, model, new_messages, self.location(key), normalised=normalised
+                )
+                if updated_model is not None and updated_model is not markov.MARKOV_CHAIN_UNCHANGED:
+                    self.put(key, updated_model)
+                    num_updated += 1
+                continue
+
+            pending = self.read_pending(key) + (
+                list(new_messages) if normalised else clean_messages_for_learning(new_messages)
+            )
+            if len(pending) < self.min_messages:
+                self.write_pending(key, pending)
+                continue
+            try:
+                model = await asyncio.to_thread(train_partition_model, pending, self.state_size, self.location(key))
+            except KeyError:  # markovify rejected every message
+                LOGGER.warning("Unable to train a new chain for Markov partition %s", key)
+                continue
+            finally:
+                self.write_pending(key, [])
+            LOGGER.info("Created Markov partition %s from %d messages", key, len(pending))
+            self.put(key, model)
+            num_updated += 1
+
+        return num_updated
@@ -0,0 +1,225 @@
+"""Markov sentence generation in a pool of forked worker processes.
+
+Generating a sentence is pure Python and CPU bound, so doing it inside the
+event loop stalls every other cog and the gateway heartbeat. The workers in
+this pool are forked after the Markov model has been loaded, so each worker
+shares the model with the bot through copy-on-write pages (or the page cache,
+for a memory-mapped chain) instead of loading its own copy.
+
+Because the workers hold the model as it was when they were forked, the pool
+must be restarted with `restart` when the model, or a partition chain, is
+replaced.
+
+Each request is given a deadline from its timeout, which the worker checks
+while generating, so a request which has timed out stops using its worker
+soon after instead of running to completion in the background.
+
+Requests for a specific state size or partition are served from the model
+registry or partition store the pool was created with. A model which the bot
+has not loaded yet is loaded by the worker which needs it, which is cheap for
+memory-mapped chains. Each worker keeps its own copy of the models it loads,
+so the memory budgets of the registry and partition store are divided
+between the workers, and the workers together use at most the budget on top
+of what the bot itself uses.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from markovbot.lib import markov
+from markovbot.lib.config import BotConfig
+from markovbot.lib.markov_partitions import MarkovPartitionStore, PartitionKey
+from markovbot.lib.markov_registry import MarkovModelRegistry
+
+LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
+
+# The registry and partitions used by the workers, which they inherit when forked
+_REGISTRY: MarkovModelRegistry | None = None
+_PARTITIONS: MarkovPartitionStore | None = None
+
+
+def _generate_in_worker(
+    seed_word: str | None,
+    amount: int,
+    state_size: int | None,
+    partition: PartitionKey | None,
+    deadline: float | None = None,
+) -> str | list[str]:
+    """Generate sentences in a worker, using the model inherited from the bot.
+
+    Parameters
+    ----------
+    seed_word : str | None
+        The seed word, or None for random sentences.
+    amount : int
+        The number of sentences to generate.
+    state_size : int | None
+        The state size of the model to use, or None for MARKOV_MODEL.
+    partition : PartitionKey | None
+        The partition to use, which takes precedence over the state size.
+    deadline : float | None
+        The `time.monotonic` time to stop generating at, or None for no
+        deadline.
+
+    Returns
+    -------
+    str | list[str]
+        The generated sentence(s).
+
+    """
+    model = markov.MARKOV_MODEL
+    if partition is not None and _PARTITIONS is not None:
+        model = _PARTITIONS.get(partition) or model
+    elif state_size is not None and _REGISTRY is not None:
+        model = _REGISTRY.get(state_size)
+    return markov.generate_text_from_markov_chain(model, seed_word, amount, deadline)
+
+
+def _initialise_worker(num_workers: int) -> None:
+    """Divide the memory budgets of the inherited models between the workers.
+
+    Parameters
+    ----------
+    num_workers : int
+        The number of worker processes.
+
+    """
+    for models in (_REGISTRY, _PARTITIONS):
+        if models is not None:
+            models.max_bytes //= num_workers
+
+
+def _warm_up_worker() -> None:
+    """Do nothing, so a worker process is forked."""
+
+
+class MarkovWorkerPool:
+    """An asynchronous interface to Markov generation in worker processes.
+
+    With zero workers, generation is run in a thread instead, which keeps
+    the event loop responsive but still competes with it for the GIL.
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        timeout: float | None = None,
+        registry: MarkovModelRegistry | None = None,
+        partitions: MarkovPartitionStore | None = None,
+    ) -> None:
+        """Initialise the pool.
+
+        The workers are forked immediately, so the Markov model should be
+        loaded before the pool is created.
+
+        Parameters
+        ----------
+        num_workers : int
+            The number of worker processes.
+        timeout : float | None
+            The default time limit in seconds for each request, or None for no
+            limit.
+        registry : MarkovModelRegistry | None
+            The registry to take models from, for requests which ask for a
+            state size.
+        partitions : MarkovPartitionStore | None
+            The partitions to take models from, for requests which ask for a
+            partition.
+
+        """
+        global _REGISTRY, _PARTITIONS  # noqa: PLW0603
+
+        _REGISTRY = registry
+        _PARTITIONS = partitions
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self.timeouts = 0
+        self.executor = None
+        self._start()
+
+    def _start(self) -> None:
+        """Create the executor and fork its workers."""
+        if self.num_workers <= 0:
+            return
+        self.executor = ProcessPoolExecutor(
+            self.num_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_initialise_worker,
+            initargs=(self.num_workers,),
+        )
+        for _ in range(self.num_workers):
+            self.executor.submit(_warm_up_worker)
+        LOGGER.info("Started %d Markov worker processes", self.num_workers)
+
+    def restart(self) -> None:
+        """Replace the workers with new ones forked from the current model.
+
+        Requests already running on the old workers are allowed to finish.
+        """
+        old_executor = self.executor
+        self._start()
+        if old_executor:
+            old_executor.shutdown(wait=False)
+
+    async def shutdown(self) -> None:
+        """Stop the workers, cancelling any queued requests."""
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def generate(
+        self,
+        seed_word: str | None,
+        amount: int = 1,
+        timeout: float | None = None,
+        state_size: int | None = None,
+        partition: PartitionKey | None = None,
+    ) -> str | list[str]:
+        """Generate sentences without blocking the event loop.
+
+        If the request is cancelled or times out before a worker picks it
+        up, it is removed from the queue. A request which is already running
+        cannot be interrupted, but the worker stops generating once the
+        deadline has passed and its result is discarded.
+
+        Parameters
+        ----------
+        seed_word : str | None
+            The seed word, or None for random sentences.
+        amount : int
+            The number of sentences to generate.
+        timeout : float | None
+            The time limit in seconds, by default the pool's timeout.
+        state_size : int | None
+            The state size of the model to use, by default MARKOV_MODEL.
+        partition : PartitionKey | None
+            The partition to use, by default MARKOV_MODEL.
+
+        Returns
+        -------
+        str | list[str]
+            The generated sentence(s), as a str or a list of str.
+
+        Raises
+        ------
+        TimeoutError
+            Raised when the sentences are not generated in time.
+        KeyError
+            Raised when there is no model with the state size.
+
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self.executor, _generate_in_worker, seed_word, amount, state_size, partition, deadline
+        )
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except TimeoutError:
+            self.timeouts += 1
+            LOGGER.warning("Markov generation for seed word '%s' timed out", seed_word)
+            raise
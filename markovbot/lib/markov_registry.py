@@ -0,0 +1,177 @@
+"""Registry of the Markov chains available to the bot.
+
+`scripts/train_markov_chain.py` trains a chain for each state size, named
+`chain-N`. The registry finds every chain in the chain directory and records
+its metadata, but only loads a model the first time it is asked for. Loaded
+models are kept in least recently used order, and the least recently used
+models are dropped when they use more than the memory budget. The published
+MARKOV_MODEL is never dropped, as the bot holds a reference to it anyway.
+
+Memory-mapped chains cost little to load and only use memory for the pages
+which are touched, so the budget is mostly spent on chains loaded from
+pickles or compressed snapshots, and on chains updated since they were
+loaded.
+"""
+
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from markovbot.lib import markov
+from markovbot.lib.array_store import is_array_file, read_header
+from markovbot.lib.config import BotConfig
+
+LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
+
+CHAIN_NAME_PATTERN = re.compile(r"^chain-(\d+)$")
+
+
+@dataclass
+class ChainInfo:
+    """Metadata for a chain in the registry.
+
+    The vocabulary size is unknown (None) for pickled chains until they have
+    been loaded, and the bytes are the size of the file until then.
+    """
+
+    location: Path
+    state_size: int
+    num_words: int | None
+    nbytes: int
+
+
+class MarkovModelRegistry:
+    """Lazily loaded Markov models, by state size."""
+
+    def __init__(self, chain_directory: str | Path, max_bytes: int) -> None:
+        """Initialise the registry and find the available chains.
+
+        Parameters
+        ----------
+        chain_directory : str | Path
+            The directory containing the chains.
+        max_bytes : int
+            The memory budget for loaded models.
+
+        """
+        self.chain_directory = Path(chain_directory)
+        self.max_bytes = max_bytes
+        self.chains: dict[int, ChainInfo] = {}
+        self.models: OrderedDict[int, markov.CompactText] = OrderedDict()
+        self.discover()
+
+    @property
+    def state_sizes(self) -> list[int]:
+        """The state sizes of the available chains."""
+        return sorted(self.chains)
+
+    @property
+    def nbytes(self) -> int:
+        """The number of bytes used by the loaded models."""
+        return sum(self.chains[state_size].nbytes for state_size in self.models)
+
+    def discover(self) -> None:
+        """Find the chains in the chain directory.
+
+        A `.markov` chain is preferred over a pickle with the same name. The
+        state size of a `.markov` chain is read from its header, and the
+        state size of a pickle is taken from its name until it is loaded.
+        """
+        self.chains.clear()
+        locations = sorted(self.chain_directory.glob("chain-*.pickle")) + sorted(
+            self.chain_directory.glob("chain-*" + markov.CHAIN_FILE_SUFFIX)
+        )
+        for location in locations:
+            match = CHAIN_NAME_PATTERN.match(location.stem)
+            if not match:
+                continue
+            if is_array_file(location):
+                metadata = read_header(location)["metadata"]
+                info = ChainInfo(location, metadata["state_size"], metadata["num_words"], location.stat().st_size)
+            else:
+                info = ChainInfo(location, int(match.group(1)), None, location.stat().st_size)
+            self.chains[info.state_size] = info
+
+        LOGGER.info(
+            "Found Markov chains with state sizes %s in %s",
+            ", ".join(str(state_size) for state_size in self.state_sizes),
+            self.chain_directory,
+        )
+
+    def get(self, state_size: int) -> markov.CompactText:
+        """Get the model for a state size, loading it if needed.
+
+        Parameters
+        ----------
+        state_size : int
+            The state size of the model.
+
+        Returns
+        -------
+        markov.CompactText
+            The model.
+
+        Raises
+        ------
+        KeyError
+            Raised when there is no chain with the state size.
+
+        """
+        model = self.models.get(state_size)
+        if model is not None:
+            self.models.move_to_end(state_size)
+            return model
+
+        info = self.chains.get(state_size)
+        if info is None:
+            msg = f"No Markov chain with state size {state_size} in {self.chain_directory}"
+            raise KeyError(msg)
+
+        model = markov.load_markov_model(info.location, state_size)
+        if model.state_size != state_size:  # a pickle which was not named after its state size
+            del self.chains[state_size]
+            info.state_size = model.state_size
+            self.chains[model.state_size] = info
+        self.put(model)
+
+        return model
+
+    def put(self, model: markov.CompactText, location: str | Path | None = None) -> None:
+        """Add a model to the registry, replacing the model for its state size.
+
+        This is used to keep the registry up to date after a model has been
+        updated.
+
+        Parameters
+        ----------
+        model : markov.CompactText
+            The model to add. It must have been loaded from a chain in the
+            registry, unless `location` is given.
+        location : str | Path | None
+            The location the model is now saved at, if it has moved, e.g.
+            after a pickle has been converted into a `.markov` chain or when
+            the model is a sliding window chain.
+
+        """
+        info = self.chains.get(model.state_size)
+        if info is None:
+            info = self.chains[model.state_size] = ChainInfo(Path(location), model.state_size, None, 0)
+        elif location:
+            info.location = Path(location)
+        info.num_words = len(model.chain.vocabulary)
+        info.nbytes = model.nbytes
+        self.models[model.state_size] = model
+        self.models.move_to_end(model.state_size)
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop the least recently used models until under the memory budget."""
+        for state_size in list(self.models):
+            if self.nbytes <= self.max_bytes:
+                break
+            if self.models[state_size] is markov.MARKOV_MODEL or len(self.models) == 1:
+                continue
+            del self.models[state_size]
+            LOGGER.info("Dropped the Markov model with state size %d to stay under the memory budget", state_size)
@@ -0,0 +1,324 @@
+"""A durable, bounded sample of the messages waiting to be learnt.
+
+Messages the bot sees are kept in memory until the next chain update, and
+each one is also appended to a log on disk, so they are not lost when the
+bot restarts:
+
+    magic (4 bytes) | payload length (uint32) | crc32 (uint32) | payload
+
+where the payload is a JSON object, either adding a message (with its id,
+text and partition key) or removing one (when it is deleted, edited or
+evicted). A record which was only partially written is discarded when the
+log is read.
+
+The sample holds at most MARKOV_SAMPLE_MAX_BYTES of text. Once it is full,
+it is kept as a reservoir sample of every message seen since the last
+update: the n-th message replaces a random message in the sample with
+probability k / n, where k is the number of messages in the sample, so the
+sample stays an unbiased sample of the messages however long the update
+takes.
+
+When an update takes the sample, the log is moved aside until the update
+has finished, and new messages go to a new log. If the bot stops before the
+update finishes, the messages in both logs are loaded again on start up.
+"""
+
+import json
+import logging
+import os
+import random
+import struct
+import time
+import zlib
+from pathlib import Path
+
+from markovbot.lib.config import BotConfig
+from markovbot.lib.markov_partitions import PartitionKey
+
+LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
+
+SAMPLE_RECORD_MAGIC = b"MKVT"
+
+_RECORD_HEADER = struct.Struct("<4sII")
+
+
+def _read_records(location: Path) -> list[dict]:
+    """Read the records in a sample log.
+
+    Parameters
+    ----------
+    location : Path
+        The sample log.
+
+    Returns
+    -------
+    list[dict]
+        The complete records in the log.
+
+    """
+    records = []
+    if not location.exists():
+        return records
+
+    with location.open("rb") as file_in:
+        while True:
+            header = file_in.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                break
+            magic, length, checksum = _RECORD_HEADER.unpack(header)
+            payload = file_in.read(length) if magic == SAMPLE_RECORD_MAGIC else b""
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                LOGGER.warning("Stopped reading %s at a corrupt or incomplete record", location)
+                break
+            records.append(json.loads(payload))
+
+    return records
+
+
+def _encode_record(record: dict) -> bytes:
+    """Encode a record for the sample log.
+
+    Parameters
+    ----------
+    record : dict
+        The record.
+
+    Returns
+    -------
+    bytes
+        The framed record.
+
+    """
+    payload = json.dumps(record).encode("utf-8")
+    return _RECORD_HEADER.pack(SAMPLE_RECORD_MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+
+class MarkovTrainingSample:
+    """The messages waiting to be learnt, backed by an append-only log."""
+
+    def __init__(self, location: str | Path, max_bytes: int) -> None:
+        """Open the sample, loading any messages left in its logs.
+
+        Parameters
+        ----------
+        location : str | Path
+            The location of the sample log.
+        max_bytes : int
+            The most UTF-8 bytes of text to hold. Once full, the sample is
+            kept as a reservoir sample.
+
+        """
+        self.location = Path(location)
+        self.max_bytes = max_bytes
+        self.messages = {}
+        self.partitions = {}
+        self.num_bytes = 0
+        self.num_seen = 0
+        self.first_added = None
+        # The message ids in a list, so a random message can be evicted in O(1)
+        self._ids = []
+        self._slots = {}
+        self._file = None
+        self._load()
+
+    @property
+    def training_location(self) -> Path:
+        """The location of the log of the sample being trained."""
+        return self.location.with_name(self.location.name + ".training")
+
+    def __len__(self) -> int:
+        """Get the number of messages in the sample."""
+        return len(self.messages)
+
+    def __contains__(self, message_id: int) -> bool:
+        """Check if a message is in the sample."""
+        return message_id in self.messages
+
+    @property
+    def age(self) -> float:
+        """The number of seconds since the oldest message was added, or 0."""
+        return time.time() - self.first_added if self.first_added else 0.0
+
+    def _load(self) -> None:
+        """Load the messages in the logs, and write them into a new log."""
+        # Messages which were being learnt when the bot stopped are learnt again
+        for location in (self.training_location, self.location):
+            for record in _read_records(location):
+                if record["op"] == "add":
+                    partition = tuple(record["partition"]) if record["partition"] else None
+                    self._insert(record["id"], record["message"], partition)
+                else:
+                    self._delete(record["id"])
+        self.num_seen = len(self.messages)
+
+        self.location.parent.mkdir(parents=True, exist_ok=True)
+        temporary_location = self.location.with_name(self.location.name + ".tmp")
+        with temporary_location.open("wb") as file_out:
+            for message_id, message in self.messages.items():
+                file_out.write(self._add_record(message_id, message, self.partitions.get(message_id)))
+            file_out.flush()
+            os.fsync(file_out.fileno())
+        temporary_location.replace(self.location)
+        self.training_location.unlink(missing_ok=True)
+        if self.messages:
+            LOGGER.info("Loaded %d messages waiting to be learnt from %s", len(self.messages), self.location)
+
+    @staticmethod
+    def _add_record(message_id: int, message: str, partition: PartitionKey | None) -> bytes:
+        """Encode a record which adds a message."""
+        return _encode_record({"op": "add", "id": message_id, "message": message, "partition": partition})
+
+    def _append(self, record: bytes) -> None:
+        """Append a record to the log, and flush it."""
+        if self._file is None:
+            self._file = self.location.open("ab")
+        self._file.write(record)
+        self._file.flush()
+
+    def _insert(self, message_id: int, message: str, partition: PartitionKey | None) -> None:
+        """Add a message in memory."""
+        self._delete(message_id)
+        self.messages[message_id] = message
+        if partition:
+            self.partitions[message_id] = partition
+        self._slots[message_id] = len(self._ids)
+        self._ids.append(message_id)
+        self.num_bytes += len(message.encode("utf-8"))
+        self.first_added = self.first_added or time.time()
+
+    def _delete(self, message_id: int) -> bool:
+        """Remove a message in memory."""
+        message = self.messages.pop(message_id, None)
+        if message is None:
+            return False
+        self.partitions.pop(message_id, None)
+        slot = self._slots.pop(message_id)
+        last_id = self._ids.pop()
+        if last_id != message_id:
+            self._ids[slot] = last_id
+            self._slots[last_id] = slot
+        self.num_bytes -= len(message.encode("utf-8"))
+
+        return True
+
+    def add(self, message_id: int, message: str, partition: PartitionKey | None = None) -> bool:
+        """Add a message to the sample.
+
+        A message already in the sample is replaced, e.g. after an edit. If
+        the sample is full, the message is kept with the probability of a
+        reservoir sample and replaces a random message.
+
+        Parameters
+        ----------
+        message_id : int
+            The id of the message.
+        message : str
+            The text of the message.
+        partition : PartitionKey | None
+            The partition the message belongs to, if any.
+
+        Returns
+        -------
+        bool
+            True if the message was added to the sample.
+
+        """
+        if message_id not in self.messages:
+            self.num_seen += 1
+            if self.num_bytes + len(message.encode("utf-8")) > self.max_bytes and self.messages:
+                if random.random() >= len(self.messages) / self.num_seen:
+                    return False
+                self.remove(random.choice(self._ids))
+        self._insert(message_id, message, partition)
+        self._append(self._add_record(message_id, message, partition))
+        while self.num_bytes > self.max_bytes and len(self.messages) > 1:
+            self.remove(random.choice(self._ids))
+
+        return True
+
+    def remove(self, message_id: int) -> bool:
+        """Remove a message from the sample.
+
+        Parameters
+        ----------
+        message_id : int
+            The id of the message.
+
+        Returns
+        -------
+        bool
+            True if the message was in the sample.
+
+        """
+        if not self._delete(message_id):
+            return False
+        self._append(_encode_record({"op": "remove", "id": message_id}))
+
+        return True
+
+    def take(self) -> tuple[dict[int, str], dict[int, PartitionKey]]:
+        """Take every message in the sample for an update, and empty it.
+
+        The log is kept until `finish_training` is called, so the messages
+        are loaded again if the bot stops before then.
+
+        Returns
+        -------
+        tuple[dict[int, str], dict[int, PartitionKey]]
+            The text of each message, and the partition of the messages which
+            belong to one, keyed by message id.
+
+        """
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        if self.location.exists():
+            self.location.replace(self.training_location)
+        messages, partitions = self.messages, self.partitions
+        self.messages = {}
+        self.partitions = {}
+        self.num_bytes = 0
+        self.num_seen = 0
+        self.first_added = None
+        self._ids = []
+        self._slots = {}
+
+        return messages, partitions
+
+    def finish_training(self) -> None:
+        """Remove the log of the messages taken by `take`."""
+        self.training_location.unlink(missing_ok=True)
+
+    def restore(self, messages: dict[int, str], partitions: dict[int, PartitionKey]) -> None:
+        """Put the messages taken by `take` back, after an update failed.
+
+        The messages are written to the log before the log of the taken
+        messages is removed. A message which was added again while the update
+        was running, e.g. after an edit, keeps its new text.
+
+        Parameters
+        ----------
+        messages : dict[int, str]
+            The text of each message, keyed by message id.
+        partitions : dict[int, PartitionKey]
+            The partition of the messages which belong to one.
+
+        """
+        for message_id, message in messages.items():
+            if message_id in self.messages:
+                continue
+            self.num_seen += 1
+            self._insert(message_id, message, partitions.get(message_id))
+            self._append(self._add_record(message_id, message, partitions.get(message_id)))
+        while self.num_bytes > self.max_bytes and len(self.messages) > 1:
+            self.remove(random.choice(self._ids))
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+        self.finish_training()
+
+    async def shutdown(self) -> None:
+        """Close the log before the bot closes."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,854 @@
+"""Streaming training of Markov chains from the scrape database.
+
+`markovify.NewlineText` needs the whole corpus joined into one string and
+builds a dict of dicts holding every state as a tuple of strings, so training
+on the full scrape database uses several times the size of the corpus in
+memory. `StreamingChainTrainer` trains the same chain without either:
+
+* messages are read from the `channel_messages` table a chunk at a time by
+  `iter_message_chunks`, which steps a SQLite cursor rather than fetching
+  every row,
+* each chunk is split into sentences and words in the same way as
+  `markovify.NewlineText` by `split_into_runs`,
+* words are interned as 32-bit ids as they are seen, and the transitions of
+  each sentence are buffered as flat arrays of word ids,
+* once `max_pending` transitions are buffered, they are folded into a
+  `CompactChain`, which sums duplicate transitions.
+
+Peak memory is therefore the size of the chain, plus a buffer of a fixed
+size, however large the corpus is.
+
+`VectorizedChainTrainer` counts the same transitions without a Python loop
+over every transition. The words of a whole chunk of sentences are mapped to
+ids, the (state, next word) n-grams of every sentence are cut from the padded
+id array with a NumPy sliding window, and they are counted with `np.unique`
+on keys with the word ids of an n-gram packed into one 64-bit integer. It
+is the trainer used by `train_from_database` and `train_sharded`, and gives
+exactly the same counts as `markovify.NewlineText`, see
+`scripts/benchmark_markov_training.py`. The finished model is a `CompactText`,
+which is saved with `save_markov_model` and loaded with `load_markov_model`
+like any other chain.
+
+Training can also be spread over several processes with `train_sharded`.
+The rows of the table are split into shards of contiguous ids with about the
+same number of rows, and each shard is trained by a worker into its own
+`TransitionCounts`, whose word ids are local to the shard. The counts are
+then merged in pairs, as a tree, with each level of the tree merged in
+parallel. Merging two shards maps the words of one onto the ids of the other
+and sums the counts, so the result is the same as training in one process.
+
+Retraining can be incremental. A chain saved by `scripts/train_markov_chain.py`
+records a watermark in its header, the id and date of the last row it was
+trained on, which `database_watermark` takes before training starts. The next
+run only counts the rows after the watermark, with `train_from_database` and
+`first_id`, and merges their counts into the chain with
+`TransitionCounts.merge_into`. If the row at the watermark has changed or
+gone, e.g. because the database was rebuilt, the chain must be retrained in
+full instead, which `watermark_is_valid` checks for.
+
+Copypasta and spam can be left out of training by passing a
+`MessageDeduplicator`, which rejects messages repeating a recent message
+before they are counted. When training in shards, each shard is deduplicated
+on its own.
+"""
+
+import functools
+import itertools
+import logging
+import multiprocessing
+import re
+import sqlite3
+import time
+from array import array
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import markovify
+import numpy as np
+from unidecode import unidecode
+
+from markovbot.lib.config import BotConfig
+from markovbot.lib.markov import (
+    BEGIN,
+    BEGIN_ID,
+    END,
+    END_ID,
+    CompactChain,
+    CompactText,
+    Vocabulary,
+    _unique_id_rows,
+)
+from markovbot.lib.markov_dedup import MessageDeduplicator
+from markovbot.lib.text_normalisation import clean_messages_for_learning
+
+LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
+
+# The key of the watermark in the header metadata of a chain
+WATERMARK_METADATA_KEY = "watermark"
+
+DEFAULT_CHUNK_SIZE = 10000
+MAX_PENDING_TRANSITIONS = 2_000_000
+
+_SENTENCE_SPLIT_PATTERN = re.compile(r"\s*\n\s*")
+
+
+def _connect(database: str | Path) -> sqlite3.Connection:
+    """Open the scrape database read-only.
+
+    Parameters
+    ----------
+    database : str | Path
+        The location of the scrape database.
+
+    Returns
+    -------
+    sqlite3.Connection
+        The connection.
+
+    """
+    return sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+
+
+def iter_message_chunks(
+    database: str | Path,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    *,
+    first_id: int | None = None,
+    last_id: int | None = None,
+) -> Iterator[list[tuple[int, str]]]:
+    """Read the messages in the scrape database a chunk at a time.
+
+    Parameters
+    ----------
+    database : str | Path
+        The location of the scrape database, which is opened read-only.
+    chunk_size : int
+        The number of messages in each chunk.
+    first_id : int | None
+        The first row id to read, by default the first row.
+    last_id : int | None
+        The last row id to read, by default the last row.
+
+    Yields
+    ------
+    list[tuple[int, str]]
+        The id and message of each row in the chunk, in id order.
+
+    """
+    connection = _connect(database)
+    try:
+        cursor = connection.execute(
+            "SELECT id, message FROM channel_messages WHERE message IS NOT NULL AND id >= ? AND id <= ? ORDER BY id",
+            (first_id if first_id is not None else -(2**63), last_id if last_id is not None else 2**63 - 1),
+        )
+        while rows := cursor.fetchmany(chunk_size):
+            yield rows
+    finally:
+        connection.close()
+
+
+def database_watermark(database: str | Path) -> dict | None:
+    """Get the watermark of the last row in the scrape database.
+
+    Parameters
+    ----------
+    database : str | Path
+        The location of the scrape database.
+
+    Returns
+    -------
+    dict | None
+        The `id` and `date` of the last row, or None if there are no rows.
+
+    """
+    connection = _connect(database)
+    try:
+        row = connection.execute("SELECT id, date FROM channel_messages ORDER BY id DESC LIMIT 1").fetchone()
+    finally:
+        connection.close()
+
+    return {"id": row[0], "date": row[1]} if row else None
+
+
+def watermark_is_valid(database: str | Path, watermark: dict) -> bool:
+    """Check that the row a watermark refers to is unchanged.
+
+    Parameters
+    ----------
+    database : str | Path
+        The location of the scrape database.
+    watermark : dict
+        The watermark, with the `id` and `date` of a row.
+
+    Returns
+    -------
+    bool
+        True if the row still exists with the same date.
+
+    """
+    connection = _connect(database)
+    try:
+        row = connection.execute("SELECT date FROM channel_messages WHERE id = ?", (watermark["id"],)).fetchone()
+    finally:
+        connection.close()
+
+    return row is not None and row[0] == watermark["date"]
+
+
+def shard_id_ranges(database: str | Path, num_shards: int, last_id: int | None = None) -> list[tuple[int, int]]:
+    """Split the rows of the scrape database into shards of contiguous ids.
+
+    Each shard has about the same number of rows, whatever gaps there are in
+    the ids.
+
+    Parameters
+    ----------
+    database : str | Path
+        The location of the scrape database.
+    num_shards : int
+        The number of shards.
+    last_id : int | None
+        The last row id to include, by default the last row.
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        The first and last id of each shard, which may be fewer than
+        `num_shards` when there are few rows.
+
+    """
+    last_id = last_id if last_id is not None else 2**63 - 1
+    connection = _connect(database)
+    try:
+        (num_rows,) = connection.execute("SELECT COUNT(*) FROM channel_messages WHERE id <= ?", (last_id,)).fetchone()
+        boundaries = []
+        for shard in range(num_shards):
+            row = connection.execute(
+                "SELECT id FROM channel_messages WHERE id <= ? ORDER BY id LIMIT 1 OFFSET ?",
+                (last_id, shard * num_rows // num_shards),
+            ).fetchone()
+            if row is not None and (not boundaries or row[0] > boundaries[-1]):
+                boundaries.append(row[0])
+        (last_id,) = connection.execute("SELECT MAX(id) FROM channel_messages WHERE id <= ?", (last_id,)).fetchone()
+    finally:
+        connection.close()
+
+    return [(start, end - 1) for start, end in itertools.pairwise([*boundaries, last_id + 1])] if boundaries else []
+
+
+def train_from_database(  # noqa: PLR0913
+    database: str | Path,
+    state_sizes: Iterable[int],
+    *,
+    first_id: int | None = None,
+    last_id: int | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_pending: int = MAX_PENDING_TRANSITIONS,
+    trainer_class: type["StreamingChainTrainer"] | None = None,
+    deduplicator: MessageDeduplicator | None = None,
+) -> list["StreamingChainTrainer"]:
+    """Train chains on the messages in the scrape database, in one pass.
+
+    Messages are cleaned with `clean_messages_for_learning`, as they are for
+    the bot's own updates, and duplicates are removed if a deduplicator is
+    given.
+
+    Parameters
+    ----------
+    database : str | Path
+        The location of the scrape database.
+    state_sizes : Iterable[int]
+        The state size of each chain to train.
+    first_id : int | None
+        The first row id to train on, by default the first row.
+    last_id : int | None
+        The last row id to train on, by default the last row.
+    chunk_size : int
+        The number of messages to read at a time.
+    max_pending : int
+        The number of transitions each trainer buffers.
+    trainer_class : type[StreamingChainTrainer] | None
+        The trainer to use, by default `VectorizedChainTrainer`.
+    deduplicator : MessageDeduplicator | None
+        The deduplicator to remove repeated messages with, or None to learn
+        every message.
+
+    Returns
+    -------
+    list[StreamingChainTrainer]
+        A trainer for each state size.
+
+    """
+    trainer_class = trainer_class or VectorizedChainTrainer
+    trainers = [trainer_class(state_size, max_pending) for state_size in state_sizes]
+    for rows in iter_message_chunks(database, chunk_size, first_id=first_id, last_id=last_id):
+        messages = clean_messages_for_learning([message for _, message in rows])
+        if deduplicator is not None:
+            messages = deduplicator.filter(messages)
+        for trainer in trainers:
+            trainer.add_messages(messages)
+
+    return trainers
+
+
+def split_into_runs(messages: Iterable[str], *, well_formed: bool = True) -> Iterator[list[str]]:
+    """Split messages into sentences of words, like `markovify.NewlineText`.
+
+    Each line of a message is a sentence, and sentences with quotes or
+    brackets which would look odd on their own are rejected when
+    `well_formed` is True. The result is the same as training
+    `markovify.NewlineText` on the messages joined by newlines, except that
+    whitespace at the start of the first message and the end of the last is
+    stripped.
+
+    Parameters
+    ----------
+    messages : Iterable[str]
+        The messages to split.
+    well_formed : bool
+        Whether to reject sentences which are not well-formed.
+
+    Yields
+    ------
+    list[str]
+        The words of each sentence.
+
+    """
+    for message in messages:
+        for sentence in _SENTENCE_SPLIT_PATTERN.split(message.strip()):
+            if not sentence.strip():
+                continue
+            if well_formed and markovify.Text.reject_pat.search(unidecode(sentence)):
+                continue
+            yield markovify.Text.word_split_pattern.split(sentence)
+
+
+@dataclass
+class TransitionCounts:
+    """The transition counts of a chain, and the words their ids refer to.
+
+    The chain uses a placeholder vocabulary, so counts trained separately can
+    be merged before the final vocabulary is known.
+    """
+
+    words: list[str]
+    chain: CompactChain
+
+    def merge(self, other: "TransitionCounts") -> "TransitionCounts":
+        """Sum these counts with counts whose word ids may be different.
+
+        Parameters
+        ----------
+        other : TransitionCounts
+            The counts to merge in.
+
+        Returns
+        -------
+        TransitionCounts
+            The summed counts, with the word ids of this one, and any words
+            only in `other` after them.
+
+        """
+        word_ids = {word: word_id for word_id, word in enumerate(self.words)}
+        words = list(self.words)
+        for word in other.words:
+            if word not in word_ids:
+                word_ids[word] = len(words)
+                words.append(word)
+        new_ids = np.fromiter((word_ids[word] for word in other.words), dtype=np.uint32, count=len(other.words))
+        states, successors, counts = other.chain.transitions()
+
+        return TransitionCounts(
+            words, self.chain.add_transitions(self.chain.vocabulary, new_ids[states], new_ids[successors], counts)
+        )
+
+    def model(self) -> CompactText:
+        """Build the model from the counts.
+
+        Returns
+        -------
+        CompactText
+            The model.
+
+        """
+        chain = self.chain
+
+        return CompactText(
+            CompactChain(
+                chain.state_size,
+                Vocabulary.from_words(self.words),
+                chain.states,
+                chain.state_hashes,
+                chain.offsets,
+                chain.successors,
+                chain.cumulative_counts,
+            )
+        )
+
+    def merge_into(self, model: CompactText) -> CompactText:
+        """Add these counts to a trained model.
+
+        Parameters
+        ----------
+        model : CompactText
+            The model, which is left untouched.
+
+        Returns
+        -------
+        CompactText
+            A new model with the counts added, whose vocabulary extends the
+            model's.
+
+        """
+        vocabulary, word_ids = model.chain.vocabulary.extend(self.words)
+        new_ids = np.fromiter((word_ids[word] for word in self.words), dtype=np.uint32, count=len(self.words))
+        states, successors, counts = self.chain.transitions()
+
+        return model.add_transitions(vocabulary, new_ids[states], new_ids[successors], counts)
+
+
+class StreamingChainTrainer:
+    """Accumulates the transition counts of a chain from streamed sentences."""
+
+    def __init__(self, state_size: int, max_pending: int = MAX_PENDING_TRANSITIONS) -> None:
+        """Initialise an empty trainer.
+
+        Parameters
+        ----------
+        state_size : int
+            The state size of the chain.
+        max_pending : int
+            The number of transitions to buffer before folding them into the
+            chain.
+
+        """
+        self.state_size = state_size
+        self.max_pending = max_pending
+        self.word_ids = {BEGIN: BEGIN_ID, END: END_ID}
+        self.pending_states = array("I")
+        self.pending_successors = array("I")
+        self.num_sentences = 0
+        # The chain is built with a placeholder vocabulary, since the words
+        # are only known once training has finished
+        self._placeholder_vocabulary = Vocabulary.from_words([BEGIN, END])
+        self.chain = CompactChain.from_transitions(state_size, self._placeholder_vocabulary, [], [], [])
+
+    @property
+    def num_pending(self) -> int:
+        """The number of buffered transitions."""
+        return len(self.pending_successors)
+
+    def add_sentence(self, words: list[str]) -> None:
+        """Count the transitions of a sentence.
+
+        Parameters
+        ----------
+        words : list[str]
+            The words of the sentence.
+
+        """
+        word_ids = self.word_ids
+        ids = [BEGIN_ID] * self.state_size
+        ids += [word_ids.setdefault(word, len(word_ids)) for word in words]
+        ids.append(END_ID)
+        for start in range(len(words) + 1):
+            self.pending_states.extend(ids[start : start + self.state_size])
+            self.pending_successors.append(ids[start + self.state_size])
+        self.num_sentences += 1
+        if self.num_pending >= self.max_pending:
+            self.flush()
+
+    def add_messages(self, messages: Iterable[str], *, well_formed: bool = True) -> None:
+        """Count the transitions of every sentence in some messages.
+
+        Parameters
+        ----------
+        messages : Iterable[str]
+            The messages.
+        well_formed : bool
+            Whether to reject sentences which are not well-formed.
+
+        """
+        for words in split_into_runs(messages, well_formed=well_formed):
+            self.add_sentence(words)
+
+    def flush(self) -> None:
+        """Fold the buffered transitions into the chain."""
+        if not self.num_pending:
+            return
+        self.chain = self.chain.add_transitions(
+            self._placeholder_vocabulary,
+            np.frombuffer(self.pending_states, dtype=np.uint32).reshape(-1, self.state_size),
+            np.frombuffer(self.pending_successors, dtype=np.uint32),
+            np.ones(self.num_pending, dtype=np.int64),
+        )
+        self.pending_states = array("I")
+        self.pending_successors = array("I")
+
+    def counts(self) -> TransitionCounts:
+        """Get the counts so far.
+
+        Returns
+        -------
+        TransitionCounts
+            The counts, with the ids the words were given.
+
+        """
+        self.flush()
+        return TransitionCounts(list(self.word_ids), self.chain)
+
+    def model(self) -> CompactText:
+        """Build the model from the counts so far.
+
+        Returns
+        -------
+        CompactText
+            The model.
+
+        """
+        return self.counts().model()
+
+
+def sentence_ngrams(word_ids: np.ndarray, lengths: np.ndarray, state_size: int) -> np.ndarray:
+    """Build the (state, next word) n-grams of sentences with a sliding window.
+
+    Each sentence is padded with `state_size` BEGIN ids at the start and an
+    END id at the end, as markovify does, and the n-grams are the windows of
+    `state_size + 1` ids which start within a sentence.
+
+    Parameters
+    ----------
+    word_ids : np.ndarray
+        The word ids of every sentence, one sentence after another.
+    lengths : np.ndarray
+        The number of words in each sentence.
+    state_size : int
+        The state size of the chain.
+
+    Returns
+    -------
+    np.ndarray
+        A (num_ngrams, state_size + 1) array of word ids, with the state in
+        the first columns and the next word in the last.
+
+    """
+    if len(lengths) == 0:
+        return np.zeros((0, state_size + 1), dtype=np.uint32)
+
+    padded_lengths = lengths + state_size + 1
+    sentence_starts = np.cumsum(padded_lengths) - padded_lengths
+    word_starts = np.cumsum(lengths) - lengths
+    sequence = np.full(int(padded_lengths.sum()), BEGIN_ID, dtype=np.uint32)
+    sequence[np.repeat(sentence_starts + state_size - word_starts, lengths) + np.arange(len(word_ids))] = word_ids
+    sequence[sentence_starts + state_size + lengths] = END_ID
+
+    num_windows = lengths + 1
+    window_starts = np.repeat(sentence_starts - (np.cumsum(num_windows) - num_windows), num_windows) + np.arange(
+        int(num_windows.sum())
+    )
+
+    return np.lib.stride_tricks.sliding_window_view(sequence, state_size + 1)[window_starts]
+
+
+class VectorizedChainTrainer(StreamingChainTrainer):
+    """Accumulates transition counts a chunk of sentences at a time, with NumPy."""
+
+    def __init__(self, state_size: int, max_pending: int = MAX_PENDING_TRANSITIONS) -> None:
+        """Initialise an empty trainer.
+
+        Parameters
+        ----------
+        state_size : int
+            The state size of the chain.
+        max_pending : int
+            The number of distinct transitions, counted per chunk, to buffer
+            before folding them into the chain.
+
+        """
+        super().__init__(state_size, max_pending)
+        self.pending_ngrams = []
+        self.pending_counts = []
+        self._num_pending = 0
+
+    @property
+    def num_pending(self) -> int:
+        """The number of buffered transitions."""
+        return self._num_pending
+
+    def add_sentences(self, sentences: list[list[str]]) -> None:
+        """Count the transitions of some sentences.
+
+        Parameters
+        ----------
+        sentences : list[list[str]]
+            The words of each sentence.
+
+        """
+        if not sentences:
+            return
+        word_ids = self.word_ids
+        words = list(itertools.chain.from_iterable(sentences))
+        for word in dict.fromkeys(words):
+            if word not in word_ids:
+                word_ids[word] = len(word_ids)
+        ids = np.fromiter(map(word_ids.__getitem__, words), dtype=np.uint32, count=len(words))
+        lengths = np.fromiter((len(words) for words in sentences), dtype=np.int64, count=len(sentences))
+        ngrams, counts = _unique_id_rows(sentence_ngrams(ids, lengths, self.state_size), return_counts=True)
+        self.pending_ngrams.append(ngrams)
+        self.pending_counts.append(counts)
+        self._num_pending += len(counts)
+        self.num_sentences += len(sentences)
+        if self.num_pending >= self.max_pending:
+            self.flush()
+
+    def add_sentence(self, words: list[str]) -> None:
+        """Count the transitions of a sentence.
+
+        Parameters
+        ----------
+        words : list[str]
+            The words of the sentence.
+
+        """
+        self.add_sentences([words])
+
+    def add_messages(self, messages: Iterable[str], *, well_formed: bool = True) -> None:
+        """Count the transitions of every sentence in some messages.
+
+        Parameters
+        ----------
+        messages : Iterable[str]
+            The messages.
+        well_formed : bool
+            Whether to reject sentences which are not well-formed.
+
+        """
+        self.add_sentences(list(split_into_runs(messages, well_formed=well_formed)))
+
+    def flush(self) -> None:
+        """Fold the buffered transitions into the chain."""
+        if not self.pending_counts:
+            return
+        ngrams = np.concatenate(self.pending_ngrams)
+        self.chain = self.chain.add_transitions(
+            self._placeholder_vocabulary, ngrams[:, :-1], ngrams[:, -1], np.concatenate(self.pending_counts)
+        )
+        self.pending_ngrams = []
+        self.pending_counts = []
+        self._num_pending = 0
+
+
+def _train_shard(  # noqa: PLR0913
+    database: str | Path,
+    state_size: int,
+    id_range: tuple[int, int],
+    *,
+    chunk_size: int,
+    max_pending: int,
+    trainer_class: type[StreamingChainTrainer] | None = None,
+    deduplicator: MessageDeduplicator | None = None,
+) -> TransitionCounts:
+    """Train the counts of one shard, in a worker process.
+
+    Parameters
+    ----------
+    database : str | Path
+        The location of the scrape database.
+    state_size : int
+        The state size of the chain.
+    id_range : tuple[int, int]
+        The first and last row id of the shard.
+    chunk_size : int
+        The number of messages to read at a time.
+    max_pending : int
+        The number of transitions to buffer.
+    trainer_class : type[StreamingChainTrainer] | None
+        The trainer to use, by default `VectorizedChainTrainer`.
+    deduplicator : MessageDeduplicator | None
+        The deduplicator for the shard, which is copied into the worker.
+
+    Returns
+    -------
+    TransitionCounts
+        The counts of the shard.
+
+    """
+    (trainer,) = train_from_database(
+        database,
+        [state_size],
+        first_id=id_range[0],
+        last_id=id_range[1],
+        chunk_size=chunk_size,
+        max_pending=max_pending,
+        trainer_class=trainer_class,
+        deduplicator=deduplicator,
+    )
+    if deduplicator is not None:
+        LOGGER.info("Rejected %d duplicate messages in rows %d to %d", deduplicator.num_rejected, *id_range)
+
+    return trainer.counts()
+
+
+def train_shards(  # noqa: PLR0913
+    database: str | Path,
+    state_size: int,
+    id_ranges: list[tuple[int, int]],
+    executor: Executor,
+    *,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_pending: int = MAX_PENDING_TRANSITIONS,
+    trainer_class: type[StreamingChainTrainer] | None = None,
+    deduplicator: MessageDeduplicator | None = None,
+) -> list[TransitionCounts]:
+    """Train the counts of each shard of the scrape database in parallel.
+
+    Parameters
+    ----------
+    database : str | Path
+        The location of the scrape database.
+    state_size : int
+        The state size of the chain.
+    id_ranges : list[tuple[int, int]]
+        The first and last row id of each shard, e.g. from `shard_id_ranges`.
+    executor : Executor
+        The executor to train the shards in.
+    chunk_size : int
+        The number of messages each shard reads at a time.
+    max_pending : int
+        The number of transitions each shard buffers.
+    trainer_class : type[StreamingChainTrainer] | None
+        The trainer to use, by default `VectorizedChainTrainer`.
+    deduplicator : MessageDeduplicator | None
+        The deduplicator for each shard, which is copied into each worker.
+
+    Returns
+    -------
+    list[TransitionCounts]
+        The counts of each shard, in the order of `id_ranges`.
+
+    """
+    train_shard = functools.partial(
+        _train_shard,
+        database,
+        state_size,
+        chunk_size=chunk_size,
+        max_pending=max_pending,
+        trainer_class=trainer_class,
+        deduplicator=deduplicator,
+    )
+    return list(executor.map(train_shard, id_ranges))
+
+
+def _merge_counts(left: TransitionCounts, right: TransitionCounts) -> TransitionCounts:
+    """Merge two counts, in a worker process.
+
+    Parameters
+    ----------
+    left : TransitionCounts
+        The counts whose word ids are kept.
+    right : TransitionCounts
+        The counts to merge in.
+
+    Returns
+    -------
+    TransitionCounts
+        The merged counts.
+
+    """
+    return left.merge(right)
+
+
+def tree_merge(counts: list[TransitionCounts], executor: Executor | None = None) -> TransitionCounts:
+    """Merge counts in pairs, as a binary tree.
+
+    Parameters
+    ----------
+    counts : list[TransitionCounts]
+        The counts to merge, of which there must be at least one.
+    executor : Executor | None
+        The executor to merge each level of the tree in, or None to merge in
+        this process.
+
+    Returns
+    -------
+    TransitionCounts
+        The merged counts.
+
+    """
+    while len(counts) > 1:
+        left, right = counts[0:-1:2], counts[1::2]
+        if executor is None:
+            merged = [_merge_counts(*pair) for pair in zip(left, right, strict=True)]
+        else:
+            merged = list(executor.map(_merge_counts, left, right))
+        counts = merged + counts[len(left) + len(right) :]
+
+    return counts[0]
+
+
+def train_sharded(  # noqa: PLR0913
+    database: str | Path,
+    state_size: int,
+    num_workers: int,
+    *,
+    num_shards: int | None = None,
+    last_id: int | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_pending: int = MAX_PENDING_TRANSITIONS,
+    trainer_class: type[StreamingChainTrainer] | None = None,
+    deduplicator: MessageDeduplicator | None = None,
+) -> CompactText:
+    """Train a chain on the scrape database with several processes.
+
+    Parameters
+    ----------
+    database : str | Path
+        The location of the scrape database.
+    state_size : int
+        The state size of the chain.
+    num_workers : int
+        The number of worker processes.
+    num_shards : int | None
+        The number of shards to split the rows into, by default one for each
+        worker.
+    last_id : int | None
+        The last row id to train on, by default the last row.
+    chunk_size : int
+        The number of messages each worker reads at a time.
+    max_pending : int
+        The number of transitions each worker buffers.
+    trainer_class : type[StreamingChainTrainer] | None
+        The trainer to use, by default `VectorizedChainTrainer`.
+    deduplicator : MessageDeduplicator | None
+        The deduplicator for each shard, which is copied into each worker.
+
+    Returns
+    -------
+    CompactText
+        The trained model.
+
+    """
+    id_ranges = shard_id_ranges(database, num_shards or num_workers, last_id)
+    if not id_ranges:
+        return StreamingChainTrainer(state_size).model()
+
+    with ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        start = time.perf_counter()
+        counts = train_shards(
+            database,
+            state_size,
+            id_ranges,
+            executor,
+            chunk_size=chunk_size,
+            max_pending=max_pending,
+            trainer_class=trainer_class,
+            deduplicator=deduplicator,
+        )
+        LOGGER.info("Trained %d shards in %.1f s", len(counts), time.perf_counter() - start)
+        start = time.perf_counter()
+        merged = tree_merge(counts, executor)
+        LOGGER.info("Merged %d shards in %.1f s", len(counts), time.perf_counter() - start)
+
+    return merged.model()
@@ -0,0 +1,379 @@
+"""Markov chain trained on a sliding window of recent messages.
+
+Rather than one chain which remembers every message forever, the window is
+stored as one segment per ISO week, each holding the training updates made
+that week as a delta log:
+
+    <directory>/segments/<year>-W<week>.log
+
+The chain used for generation is a merged view of the segments in the
+window, which is kept in memory and saved next to them as
+
+    <directory>/window-<state size>.markov
+
+along with the sequence of the last record of each segment it contains. An
+update appends a record to the current week's segment and merges it into the
+view. When a week falls out of the window, its counts are subtracted from the
+view and its segment file is deleted, so old messages are forgotten without
+retraining on the rest. Expired weeks are also dropped once a day by
+`drop_expired`, so an idle bot does not keep using them. As the view is an
+ordinary chain, generation is just as fast as with a single chain.
+
+The view is saved after a week expires, before the segment is deleted, and
+otherwise once MARKOV_LOG_COMPACT_BYTES of updates have been made since it
+was last saved. Records which are not in the saved view are replayed from
+the segments on load.
+"""
+
+import asyncio
+import datetime
+import logging
+import time
+from pathlib import Path
+
+import markovify
+
+from markovbot.lib import markov
+from markovbot.lib.array_store import read_header
+from markovbot.lib.config import BotConfig
+from markovbot.lib.delta_log import append_delta, read_deltas
+from markovbot.lib.markov import _add_counts
+from markovbot.lib.text_normalisation import clean_messages_for_learning
+
+LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
+
+SEGMENT_SUFFIX = ".log"
+
+
+def segment_name(day: datetime.date) -> str:
+    """Get the name of the segment a day belongs to.
+
+    Parameters
+    ----------
+    day : datetime.date
+        The day.
+
+    Returns
+    -------
+    str
+        The ISO week of the day, e.g. "2024-W07".
+
+    """
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def segment_start(name: str) -> datetime.date:
+    """Get the first day of a segment.
+
+    Parameters
+    ----------
+    name : str
+        The name of the segment, as returned by `segment_name`.
+
+    Returns
+    -------
+    datetime.date
+        The Monday the segment starts on.
+
+    """
+    year, week = name.split("-W")
+    return datetime.date.fromisocalendar(int(year), int(week), 1)
+
+
+class MarkovWindow:
+    """A Markov chain made of weekly segments, which forgets old weeks."""
+
+    def __init__(self, directory: str | Path, state_size: int, num_segments: int) -> None:
+        """Initialise the window.
+
+        Parameters
+        ----------
+        directory : str | Path
+            The directory containing the segments and the merged view.
+        state_size : int
+            The state size of the chain.
+        num_segments : int
+            The number of weeks in the window, including the current week.
+
+        """
+        if num_segments < 1:
+            msg = f"A Markov window needs at least one segment, not {num_segments}"
+            raise ValueError(msg)
+        self.directory = Path(directory)
+        self.state_size = state_size
+        self.num_segments = num_segments
+        self.model = markov.CompactText(markov.CompactChain.from_counts({}, state_size))
+        self.sequences: dict[str, int] = {}
+        self.unsaved_bytes = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def segment_directory(self) -> Path:
+        """The directory containing the segments."""
+        return self.directory / "segments"
+
+    @property
+    def view_location(self) -> Path:
+        """The location of the saved merged view."""
+        return self.directory / f"window-{self.state_size}{markov.CHAIN_FILE_SUFFIX}"
+
+    def segment_location(self, name: str) -> Path:
+        """Get the location of a segment.
+
+        Parameters
+        ----------
+        name : str
+            The name of the segment.
+
+        Returns
+        -------
+        Path
+            The location of the segment's delta log.
+
+        """
+        return self.segment_directory / f"{name}{SEGMENT_SUFFIX}"
+
+    def segment_names(self) -> list[str]:
+        """Get the names of the segments on disk, oldest first."""
+        return sorted(location.stem for location in self.segment_directory.glob(f"*{SEGMENT_SUFFIX}"))
+
+    def is_expired(self, name: str, today: datetime.date) -> bool:
+        """Check if a segment has fallen out of the window.
+
+        Parameters
+        ----------
+        name : str
+            The name of the segment.
+        today : datetime.date
+            The current day.
+
+        Returns
+        -------
+        bool
+            True if the segment is older than the window.
+
+        """
+        this_week = today - datetime.timedelta(days=today.weekday())
+        return (this_week - segment_start(name)).days >= 7 * self.num_segments
+
+    def load(self, today: datetime.date | None = None) -> markov.CompactText:
+        """Load the merged view, and bring it up to date with the segments.
+
+        Records which are not in the saved view are merged in, and segments
+        which have expired since the view was saved are subtracted and
+        deleted. If a segment in the saved view is missing, the view is
+        rebuilt from the segments which are left.
+
+        Parameters
+        ----------
+        today : datetime.date | None
+            The current day, by default today in UTC.
+
+        Returns
+        -------
+        markov.CompactText
+            The merged view.
+
+        """
+        today = today or datetime.datetime.now(tz=datetime.UTC).date()
+        self.unsaved_bytes = 0
+        names = self.segment_names()
+        model = markov.CompactText(markov.CompactChain.from_counts({}, self.state_size))
+        saved_sequences = {}
+        rebuild = not self.view_location.exists()
+        if not rebuild:
+            saved_sequences = dict(read_header(self.view_location)["metadata"].get("segments", {}))
+            missing = [name for name in saved_sequences if name not in names]
+            if missing:
+                LOGGER.warning("Markov window segments %s are missing, rebuilding the window", ", ".join(missing))
+                saved_sequences = {}
+                rebuild = True
+            else:
+                model = markov.load_markov_model(self.view_location, self.state_size)
+
+        sequences = dict(saved_sequences)
+        counts = {}
+        expired = []
+        for name in names:
+            location = self.segment_location(name)
+            if self.is_expired(name, today):
+                expired.append(name)
+                if name in sequences:
+                    delta, _ = read_deltas(location, 0, sequences.pop(name))
+                    _add_counts(counts, delta, -1)
+                continue
+            delta, sequences[name] = read_deltas(location, sequences.get(name, 0))
+            if delta:
+                _add_counts(counts, delta)
+                self.unsaved_bytes += location.stat().st_size
+
+        self.model = model.merge(counts) if counts else model
+        self.sequences = sequences
+        if sequences != saved_sequences:
+            LOGGER.info("Merged %d Markov window segments into the view", len(sequences))
+        if expired or (rebuild and (sequences or self.view_location.exists())):
+            self.save()
+        self._delete_segments(expired)
+
+        return self.model
+
+    def add(
+        self, counts: dict[tuple[str, ...], dict[str, int]], today: datetime.date | None = None
+    ) -> markov.CompactText:
+        """Add the counts of an update to the current week's segment.
+
+        The update is appended to the segment before the view is merged, and
+        any segments which have expired are dropped in the same merge.
+
+        Parameters
+        ----------
+        counts : dict[tuple[str, ...], dict[str, int]]
+            The transition counts of the update, e.g. `markovify.Chain.model`.
+        today : datetime.date | None
+            The current day, by default today in UTC.
+
+        Returns
+        -------
+        markov.CompactText
+            The updated view.
+
+        """
+        today = today or datetime.datetime.now(tz=datetime.UTC).date()
+        if counts:
+            name = segment_name(today)
+            location = self.segment_location(name)
+            location.parent.mkdir(parents=True, exist_ok=True)
+            size_before = location.stat().st_size if location.exists() else 0
+            self.sequences[name] = append_delta(location, counts, self.sequences.get(name, 0))
+            self.unsaved_bytes += location.stat().st_size - size_before
+
+        expired = [other for other in self.segment_names() if self.is_expired(other, today)]
+        if expired:
+            counts = {state: dict(next_words) for state, next_words in counts.items()}
+            for other in expired:
+                if other in self.sequences:
+                    delta, _ = read_deltas(self.segment_location(other), 0, self.sequences.pop(other))
+                    _add_counts(counts, delta, -1)
+        if counts:
+            self.model = self.model.merge(counts)
+
+        if expired or self.unsaved_bytes > BotConfig.get_config("MARKOV_LOG_COMPACT_BYTES"):
+            self.save()
+        self._delete_segments(expired)
+
+        return self.model
+
+    def expire(self, today: datetime.date | None = None) -> markov.CompactText:
+        """Drop the segments which have fallen out of the window.
+
+        Parameters
+        ----------
+        today : datetime.date | None
+            The current day, by default today in UTC.
+
+        Returns
+        -------
+        markov.CompactText
+            The updated view, which is the current view if nothing expired.
+
+        """
+        return self.add({}, today)
+
+    async def drop_expired(self, today: datetime.date | None = None) -> markov.CompactText | None:
+        """Drop the segments which have fallen out of the window, in a worker thread.
+
+        Parameters
+        ----------
+        today : datetime.date | None
+            The current day, by default today in UTC.
+
+        Returns
+        -------
+        markov.CompactText | None
+            The updated view, or None if no segment has expired.
+
+        """
+        today = today or datetime.datetime.now(tz=datetime.UTC).date()
+        async with self._lock:
+            if not any(self.is_expired(name, today) for name in self.segment_names()):
+                return None
+            return await asyncio.to_thread(self.expire, today)
+
+    def save(self) -> None:
+        """Save the merged view and the segment records it contains."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        markov.save_markov_model(self.model, self.view_location, metadata={"segments": self.sequences})
+        self.unsaved_bytes = 0
+
+    def _delete_segments(self, names: list[str]) -> None:
+        """Delete expired segments, once the view without them is saved.
+
+        Parameters
+        ----------
+        names : list[str]
+            The names of the segments to delete.
+
+        """
+        for name in names:
+            self.segment_location(name).unlink(missing_ok=True)
+            LOGGER.info("Dropped Markov window segment %s", name)
+
+    def _train_and_add(self, messages: list[str], today: datetime.date | None) -> markov.CompactText:
+        """Train on new messages and add them to the window.
+
+        Parameters
+        ----------
+        messages : list[str]
+            The cleaned messages to train with.
+        today : datetime.date | None
+            The current day, by default today in UTC.
+
+        Returns
+        -------
+        markov.CompactText
+            The updated view.
+
+        """
+        text = markovify.NewlineText("\n".join(messages), state_size=self.state_size)
+        return self.add(text.chain.model, today)
+
+    async def update(
+        self, messages: list[str], today: datetime.date | None = None, *, normalised: bool = False
+    ) -> markov.CompactText | None:
+        """Train the window with new messages.
+
+        Training and merging run in a worker thread, and only one update
+        runs at a time.
+
+        Parameters
+        ----------
+        messages : list[str]
+            The new messages.
+        today : datetime.date | None
+            The current day, by default today in UTC.
+        normalised : bool
+            Whether the messages have already been cleaned for learning.
+
+        Returns
+        -------
+        markov.CompactText | None
+            The updated view, or None if there was nothing to train with.
+
+        """
+        messages = list(messages) if normalised else clean_messages_for_learning(messages)
+        if not messages:
+            LOGGER.info("No sentences to update the Markov window with")
+            return None
+
+        async with self._lock:
+            start = time.perf_counter()
+            try:
+                model = await asyncio.to_thread(self._train_and_add, messages, today)
+            except KeyError:  # markovify rejected every message
+                LOGGER.exception("Unable to train the Markov window")
+                return None
+
+        LOGGER.info("Markov window updated with %d new messages in %.2f s", len(messages), time.perf_counter() - start)
+
+        return model
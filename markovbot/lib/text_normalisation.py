@@ -0,0 +1,328 @@
+"""Clean up message text before it is learnt or used.
+
+Every pattern is compiled once, when the module is imported. A
+`TextNormaliser` applies a list of steps to text, where a step is either the
+name of one of the steps in `STEPS` or any function from a string to a
+string:
+
+    emojis           remove unicode emojis and pictographs
+    custom_emojis    remove Discord custom emojis, e.g. <:name:123>
+    mentions         remove user, role and channel mentions, @everyone and @here
+    urls             remove links
+    unidecode        transliterate text to ASCII
+    whitespace       collapse runs of whitespace, except newlines, to a space
+
+`TextNormaliser.normalise_batch` cleans a whole list of messages with one
+call of each step, rather than one call for each message, by joining the
+messages with `BATCH_SEPARATOR` and splitting them apart again afterwards.
+A step must therefore leave the separator alone, which every built-in step
+does. If a message contains the separator, or a step removes one, the
+messages are cleaned one at a time instead.
+
+`clean_messages_for_learning` is the cleaning every Markov chain is trained
+with. Messages are normalised with the steps in MARKOV_NORMALISATION_STEPS,
+and then messages which are empty, look like a command or still mention
+someone are dropped. Messages the bot sees are cleaned once as they arrive,
+with `normalise_for_learning`, and only the cleaned text is kept, so the
+same text is learnt and later forgotten even if the steps change in between.
+See `scripts/benchmark_text_normalisation.py` for how long this takes.
+"""
+
+import re
+import string
+from collections.abc import Callable, Iterable
+
+from unidecode import unidecode
+
+from markovbot.lib.config import BotConfig
+
+BATCH_SEPARATOR = "\x00"
+
+EMOJI_PATTERN = re.compile(
+    "["
+    "\U0001f600-\U0001f64f"  # emoticons
+    "\U0001f300-\U0001f5ff"  # symbols & pictographs
+    "\U0001f680-\U0001f6ff"  # transport & map symbols
+    "\U0001f1e0-\U0001f1ff"  # flags (iOS)
+    "\U00002500-\U00002bef"  # chinese char
+    "\U00002702-\U000027b0"
+    "\U000024c2-\U0001f251"
+    "\U0001f926-\U0001f937"
+    "\U00010000-\U0010ffff"
+    "\u2640-\u2642"
+    "\u2600-\u2b55"
+    "\u200d"
+    "\u23cf"
+    "\u23e9"
+    "\u231a"
+    "\ufe0f"  # dingbats
+    "\u3030"
+    "]+",
+)
+CUSTOM_EMOJI_PATTERN = re.compile(r"<a?:\w+:\d+>")
+MENTION_PATTERN = re.compile(r"<(?:@[!&]?|#)\d+>|@(?:everyone|here)\b")
+URL_PATTERN = re.compile(r"<?https?://[^\s\x00>]+>?")
+WHITESPACE_PATTERN = re.compile(r"[^\S\n]+")
+
+
+def strip_emojis(text: str) -> str:
+    """Remove unicode emojis from text.
+
+    Parameters
+    ----------
+    text : str
+        The text to clean.
+
+    Returns
+    -------
+    str
+        The text without emojis.
+
+    """
+    return EMOJI_PATTERN.sub("", text)
+
+
+def strip_custom_emojis(text: str) -> str:
+    """Remove Discord custom emojis from text.
+
+    Parameters
+    ----------
+    text : str
+        The text to clean.
+
+    Returns
+    -------
+    str
+        The text without custom emojis.
+
+    """
+    return CUSTOM_EMOJI_PATTERN.sub("", text)
+
+
+def scrub_mentions(text: str) -> str:
+    """Remove mentions of users, roles and channels from text.
+
+    Parameters
+    ----------
+    text : str
+        The text to clean.
+
+    Returns
+    -------
+    str
+        The text without mentions.
+
+    """
+    return MENTION_PATTERN.sub("", text)
+
+
+def remove_urls(text: str) -> str:
+    """Remove links from text.
+
+    Parameters
+    ----------
+    text : str
+        The text to clean.
+
+    Returns
+    -------
+    str
+        The text without links.
+
+    """
+    return URL_PATTERN.sub("", text)
+
+
+def transliterate(text: str) -> str:
+    """Transliterate text to ASCII.
+
+    Each message in a batch is transliterated on its own, so the messages
+    which are already ASCII are skipped.
+
+    Parameters
+    ----------
+    text : str
+        The text, or a batch of messages joined by `BATCH_SEPARATOR`.
+
+    Returns
+    -------
+    str
+        The transliterated text.
+
+    """
+    if text.isascii():
+        return text
+    return BATCH_SEPARATOR.join(part if part.isascii() else unidecode(part) for part in text.split(BATCH_SEPARATOR))
+
+
+def collapse_whitespace(text: str) -> str:
+    """Replace each run of whitespace other than newlines with a space.
+
+    Newlines are kept, as they split messages into sentences.
+
+    Parameters
+    ----------
+    text : str
+        The text to clean.
+
+    Returns
+    -------
+    str
+        The text with its whitespace collapsed.
+
+    """
+    return WHITESPACE_PATTERN.sub(" ", text)
+
+
+STEPS = {
+    "emojis": strip_emojis,
+    "custom_emojis": strip_custom_emojis,
+    "mentions": scrub_mentions,
+    "urls": remove_urls,
+    "unidecode": transliterate,
+    "whitespace": collapse_whitespace,
+}
+
+
+class TextNormaliser:
+    """Apply a list of cleaning steps to messages."""
+
+    def __init__(self, steps: Iterable[str | Callable[[str], str]]) -> None:
+        """Initialise the normaliser.
+
+        Parameters
+        ----------
+        steps : Iterable[str | Callable[[str], str]]
+            The steps to apply, in order, as the names of steps in `STEPS`
+            or functions.
+
+        """
+        self.steps = []
+        for step in steps:
+            if isinstance(step, str):
+                if step not in STEPS:
+                    msg = f"Unknown text normalisation step '{step}', choose from {', '.join(STEPS)}"
+                    raise ValueError(msg)
+                step = STEPS[step]  # noqa: PLW2901
+            self.steps.append(step)
+
+    def __call__(self, text: str) -> str:
+        """Normalise one message.
+
+        Parameters
+        ----------
+        text : str
+            The message.
+
+        Returns
+        -------
+        str
+            The normalised message, with whitespace stripped from its ends.
+
+        """
+        for step in self.steps:
+            text = step(text)
+
+        return text.strip()
+
+    def normalise_batch(self, texts: list[str]) -> list[str]:
+        """Normalise a list of messages, applying each step to all of them at once.
+
+        Parameters
+        ----------
+        texts : list[str]
+            The messages.
+
+        Returns
+        -------
+        list[str]
+            The normalised messages, in order.
+
+        """
+        if not texts:
+            return []
+
+        joined = BATCH_SEPARATOR.join(texts)
+        if joined.count(BATCH_SEPARATOR) == len(texts) - 1:
+            for step in self.steps:
+                joined = step(joined)
+            normalised = joined.split(BATCH_SEPARATOR)
+            if len(normalised) == len(texts):
+                return [text.strip() for text in normalised]
+
+        return [self(text) for text in texts]
+
+
+LEARNING_NORMALISER = TextNormaliser(BotConfig.get_config("MARKOV_NORMALISATION_STEPS"))
+
+
+def has_mention(text: str) -> bool:
+    """Check if text could mention someone when it is sent.
+
+    Parameters
+    ----------
+    text : str
+        The text to check.
+
+    Returns
+    -------
+    bool
+        True if the text contains an @.
+
+    """
+    return "@" in text
+
+
+def is_learnable(text: str) -> bool:
+    """Check if a normalised message should be learnt.
+
+    Empty messages, messages which start with punctuation, which are usually
+    commands, and messages which could mention someone are not learnt.
+
+    Parameters
+    ----------
+    text : str
+        The normalised message.
+
+    Returns
+    -------
+    bool
+        True if the message should be learnt.
+
+    """
+    return bool(text) and text[0] not in string.punctuation and not has_mention(text)
+
+
+def normalise_for_learning(text: str) -> str | None:
+    """Normalise one message as it arrives, for it to be learnt later.
+
+    Parameters
+    ----------
+    text : str
+        The message.
+
+    Returns
+    -------
+    str | None
+        The normalised message, or None if it should not be learnt.
+
+    """
+    text = LEARNING_NORMALISER(text)
+    return text if is_learnable(text) else None
+
+
+def clean_messages_for_learning(messages: list[str]) -> list[str]:
+    """Normalise messages and drop the ones which should not be learnt.
+
+    Parameters
+    ----------
+    messages : list[str]
+        The messages to clean.
+
+    Returns
+    -------
+    list[str]
+        The cleaned messages.
+
+    """
+    return [message for message in LEARNING_NORMALISER.normalise_batch(messages) if is_learnable(message)]
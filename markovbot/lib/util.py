@@ -4,7 +4,6 @@ import datetime
 import json
 import logging
 import pathlib
-import re
 from typing import Any
 
 from markovbot.lib.config import BotConfig
@@ -156,46 +155,6 @@ def ordinal_suffix(n):
     return {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
 
 
-def remove_emojis_from_string(string: str) -> str:
-    """Remove emojis from a string.
-
-    Parameters
-    ----------
-    string : str
-        _description_
-
-    Returns
-    -------
-    str
-        _description_
-
-    """
-    emoj = re.compile(
-        "["
-        "\U0001f600-\U0001f64f"  # emoticons
-        "\U0001f300-\U0001f5ff"  # symbols & pictographs
-        "\U0001f680-\U0001f6ff"  # transport & map symbols
-        "\U0001f1e0-\U0001f1ff"  # flags (iOS)
-        "\U00002500-\U00002bef"  # chinese char
-        "\U00002702-\U000027b0"
-        "\U00002702-\U000027b0"
-        "\U000024c2-\U0001f251"
-        "\U0001f926-\U0001f937"
-        "\U00010000-\U0010ffff"
-        "\u2640-\u2642"
-        "\u2600-\u2b55"
-        "\u200d"
-        "\u23cf"
-        "\u23e9"
-        "\u231a"
-        "\ufe0f"  # dingbats
-        "\u3030"
-        "]+",
-        re.UNICODE,
-    )
-    return re.sub(emoj, "", string)
-
-
 def convert_radial_to_cardinal_direction(degrees: float) -> str:
     """Convert a degrees value to a cardinal direction.
 
@@ -8,10 +8,14 @@ Disnake is used as the API client.
 """
 
 import argparse
+import asyncio
 import datetime
 import logging
+import os
+import sys
 import time
 import traceback
+from pathlib import Path
 
 import disnake
 from disnake.ext import commands
@@ -19,6 +23,11 @@ from disnake.ext import commands
 from markovbot.lib import markov
 from markovbot.lib.config import BotConfig
 from markovbot.lib.custom_bot import CustomInteractionBot
+from markovbot.lib.markov_bank import MarkovBank, bank_targets, build_markov_bank, load_markov_bank
+from markovbot.lib.markov_partitions import MarkovPartitionStore
+from markovbot.lib.markov_pool import MarkovWorkerPool
+from markovbot.lib.markov_registry import MarkovModelRegistry
+from markovbot.lib.markov_window import MarkovWindow
 
 LAUNCH_TIME = time.time()
 LOGGER = logging.getLogger(BotConfig.get_config("LOGGER_NAME"))
@@ -39,6 +48,41 @@ def parse_args() -> argparse.Namespace:
         help="Launch the bot in development mode, which enables debug logging, cog reloading and disables automated markov generation",
         action="store_true",
     )
+    subparsers = parser.add_subparsers(dest="command")
+    bank_parser = subparsers.add_parser(
+        "bank", help="Build or resume the Markov sentence bank, instead of running the bot"
+    )
+    bank_parser.add_argument("--chain", help="The chain to generate sentences from, by default the current chain")
+    bank_parser.add_argument("--output", default=BotConfig.get_config("MARKOV_BANK_FILE"), help="The bank to write")
+    bank_parser.add_argument(
+        "--seed-file", default=BotConfig.get_config("MARKOV_BANK_SEED_FILE"), help="A file of seed words, one per line"
+    )
+    bank_parser.add_argument(
+        "--top-seeds",
+        type=int,
+        default=BotConfig.get_config("MARKOV_BANK_TOP_SEEDS"),
+        help="The number of the most frequent words in the chain to use as seed words",
+    )
+    bank_parser.add_argument(
+        "--sentences",
+        type=int,
+        default=BotConfig.get_config("MARKOV_BANK_SENTENCES_PER_SEED"),
+        help="The number of sentences for each seed word",
+    )
+    bank_parser.add_argument(
+        "--random-sentences",
+        type=int,
+        default=BotConfig.get_config("MARKOV_BANK_RANDOM_SENTENCES"),
+        help="The number of random sentences",
+    )
+    bank_parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="The number of processes to generate sentences with"
+    )
+    bank_parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Replace the sentences of the seed words, instead of resuming the existing bank",
+    )
     return parser.parse_args()
 
 
@@ -126,7 +170,37 @@ def initialise_bot(args: argparse.Namespace) -> CustomInteractionBot:
 
     LOGGER.info("Config file: %s", BotConfig.get_config("CONFIG_FILE"))
 
-    markov.MARKOV_MODEL = markov.load_markov_model("data/markov/chain-2.pickle")
+    markov_registry = MarkovModelRegistry(
+        BotConfig.get_config("MARKOV_CHAIN_DIRECTORY"), BotConfig.get_config("MARKOV_MODEL_MEMORY_BUDGET")
+    )
+    default_model = markov_registry.get(BotConfig.get_config("MARKOV_DEFAULT_STATE_SIZE"))
+    markov.publish_markov_model(default_model)
+    # Partition, window and other chains are loaded later, so the global chain is set here and when it is updated
+    BotConfig.set_config("CURRENT_MARKOV_CHAIN", markov_registry.chains[default_model.state_size].location)
+    if Path(BotConfig.get_config("MARKOV_BANK_FILE")).exists():
+        markov.MARKOV_BANK = load_markov_bank(BotConfig.get_config("MARKOV_BANK_FILE"))
+    markov_window = None
+    if BotConfig.get_config("MARKOV_WINDOW_WEEKS") > 0:
+        markov_window = MarkovWindow(
+            BotConfig.get_config("MARKOV_WINDOW_DIRECTORY"),
+            BotConfig.get_config("MARKOV_DEFAULT_STATE_SIZE"),
+            BotConfig.get_config("MARKOV_WINDOW_WEEKS"),
+        )
+        window_model = markov_window.load()
+        if window_model.chain.num_states > 0:
+            markov.publish_markov_model(window_model)
+            markov_registry.put(window_model, markov_window.view_location)
+        else:
+            LOGGER.info("The Markov window is empty, using the full chain until it has been trained")
+    markov_partitions = None
+    if BotConfig.get_config("MARKOV_PARTITION_SCOPE"):
+        markov_partitions = MarkovPartitionStore(
+            BotConfig.get_config("MARKOV_PARTITION_DIRECTORY"),
+            BotConfig.get_config("MARKOV_PARTITION_SCOPE"),
+            BotConfig.get_config("MARKOV_DEFAULT_STATE_SIZE"),
+            BotConfig.get_config("MARKOV_PARTITION_MEMORY_BUDGET"),
+            BotConfig.get_config("MARKOV_PARTITION_MIN_MESSAGES"),
+        )
 
     intents = disnake.Intents.default()
     intents.message_content = True
@@ -135,6 +209,10 @@ def initialise_bot(args: argparse.Namespace) -> CustomInteractionBot:
     bot = CustomInteractionBot(
         intents=intents,
         reload=bool(args.debug),
+        enable_markov_cache=not args.debug,
+        markov_registry=markov_registry,
+        markov_partitions=markov_partitions,
+        markov_window=markov_window,
     )
 
     bot.load_extensions("markovbot/cogs")
@@ -145,9 +223,49 @@ def initialise_bot(args: argparse.Namespace) -> CustomInteractionBot:
     return bot
 
 
-def main() -> None:
-    """Run Slashbot."""
+async def build_bank(args: argparse.Namespace) -> None:
+    """Build the Markov sentence bank in a pool of worker processes.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+
+    """
+    if args.chain:
+        model = markov.load_markov_model(args.chain, BotConfig.get_config("MARKOV_DEFAULT_STATE_SIZE"))
+    else:
+        model = MarkovModelRegistry(
+            BotConfig.get_config("MARKOV_CHAIN_DIRECTORY"), BotConfig.get_config("MARKOV_MODEL_MEMORY_BUDGET")
+        ).get(BotConfig.get_config("MARKOV_DEFAULT_STATE_SIZE"))
+    markov.publish_markov_model(model)
+    targets = bank_targets(model, args.seed_file, args.top_seeds, args.sentences, args.random_sentences)
+    LOGGER.info("Building Markov bank %s for %d seed words", args.output, len(targets))
+
+    pool = MarkovWorkerPool(args.workers)
+    try:
+        await build_markov_bank(
+            MarkovBank.load(args.output), targets, pool.generate, args.workers, refresh=args.refresh
+        )
+    finally:
+        await pool.shutdown()
+
+
+def main() -> int:
+    """Run Slashbot.
+
+    Returns
+    -------
+    int
+        The exit code.
+
+    """
     args = parse_args()
+    if args.command == "bank":
+        LOGGER.setLevel(logging.DEBUG if args.debug else logging.INFO)
+        asyncio.run(build_bank(args))
+        return 0
+
     bot = initialise_bot(args)
 
     try:
@@ -163,4 +281,4 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
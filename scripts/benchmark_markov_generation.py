@@ -0,0 +1,69 @@
+"""Compare generating Markov sentences one at a time with generating a batch.
+
+For each amount, random sentences and sentences containing the seed word
+are generated with a loop of `make_sentence` / `make_sentence_that_contains`
+and with one call of `make_sentences` / `make_sentences_that_contain`, and
+the sentences per second of each are printed.
+
+    python scripts/benchmark_markov_generation.py data/markov/chain-2.markov --seed-word weather
+"""
+
+import argparse
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from markovbot.lib.markov import load_markov_model
+
+
+def sentences_per_second(generate: Callable[[], list], amount: int) -> float:
+    """Time a generation function.
+
+    Parameters
+    ----------
+    generate : Callable[[], list]
+        The function to time, which generates `amount` sentences.
+    amount : int
+        The number of sentences generated.
+
+    Returns
+    -------
+    float
+        The number of sentences generated per second.
+
+    """
+    start = time.perf_counter()
+    generate()
+    return amount / (time.perf_counter() - start)
+
+
+def main() -> None:
+    """Run the benchmark for the given chain."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("chain", type=Path, help="The chain to generate sentences from")
+    parser.add_argument("--seed-word", default="the", help="The seed word for seeded sentences")
+    parser.add_argument(
+        "--amounts", nargs="+", type=int, default=[10, 100, 1000, 10000], help="The numbers of sentences to generate"
+    )
+    args = parser.parse_args()
+
+    model = load_markov_model(args.chain)
+    model.make_sentences(10)  # warm up the page cache for memory-mapped chains
+
+    for amount in args.amounts:
+        loop = sentences_per_second(lambda n=amount: [model.make_sentence() for _ in range(n)], amount)
+        batch = sentences_per_second(lambda n=amount: model.make_sentences(n), amount)
+        seeded_loop = sentences_per_second(
+            lambda n=amount: [model.make_sentence_that_contains(args.seed_word) for _ in range(n)], amount
+        )
+        seeded_batch = sentences_per_second(
+            lambda n=amount: model.make_sentences_that_contain(args.seed_word, n), amount
+        )
+        print(  # noqa: T201
+            f"{amount:>6} sentences: random {loop:8.0f} -> {batch:8.0f} /s ({batch / loop:4.1f}x), "
+            f"seeded {seeded_loop:8.0f} -> {seeded_batch:8.0f} /s ({seeded_batch / seeded_loop:4.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Compare the size and load time of pickled and snapshot Markov chains.
+
+For each state size, the pickled markovify chain written by
+`scripts/train_markov_chain.py` (`chain-N.pickle`) is converted into a
+memory-mapped snapshot and a compressed snapshot, and the three are timed
+loading into a model. Compressed snapshots are timed with one decoding
+thread and with one per CPU. Timings are the median of several loads with a
+warm page cache.
+
+    python scripts/benchmark_markov_snapshots.py data/markov
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from markovbot.lib.array_store import read_arrays
+from markovbot.lib.markov import CompactText, load_markov_model, save_markov_model
+
+
+def time_load(load: Callable[[], object], repeats: int) -> float:
+    """Time a load function.
+
+    Parameters
+    ----------
+    load : Callable[[], object]
+        The function to time.
+    repeats : int
+        The number of times to run it.
+
+    Returns
+    -------
+    float
+        The median time in seconds.
+
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        load()
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings)
+
+
+def load_snapshot(location: Path, max_workers: int | None) -> CompactText:
+    """Load a snapshot into a model, reading every array.
+
+    Parameters
+    ----------
+    location : Path
+        The snapshot to load.
+    max_workers : int | None
+        The number of decoding threads.
+
+    Returns
+    -------
+    CompactText
+        The model.
+
+    """
+    arrays, metadata = read_arrays(location, verify=True, max_workers=max_workers)
+    return CompactText.from_arrays(arrays, metadata["state_size"])
+
+
+def benchmark_state_size(chain_directory: Path, output_directory: Path, state_size: int, repeats: int) -> None:
+    """Convert and time the chain for a state size, and print the results.
+
+    Parameters
+    ----------
+    chain_directory : Path
+        The directory containing the pickled chains.
+    output_directory : Path
+        The directory to write the snapshots to.
+    state_size : int
+        The state size of the chain.
+    repeats : int
+        The number of loads to time.
+
+    """
+    pickle_location = chain_directory / f"chain-{state_size}.pickle"
+    if not pickle_location.exists():
+        print(f"chain-{state_size}: no pickle at {pickle_location}")  # noqa: T201
+        return
+
+    model = load_markov_model(pickle_location, state_size)
+    mapped_location = output_directory / f"chain-{state_size}.markov"
+    compressed_location = output_directory / f"chain-{state_size}.compressed.markov"
+    save_markov_model(model, mapped_location, compress=False)
+    save_markov_model(model, compressed_location, compress=True)
+
+    results = {
+        "pickle": (pickle_location, time_load(lambda: load_markov_model(pickle_location, state_size), repeats)),
+        "mapped": (mapped_location, time_load(lambda: load_markov_model(mapped_location, state_size), repeats)),
+        "mapped, verified": (mapped_location, time_load(lambda: load_snapshot(mapped_location, None), repeats)),
+        "compressed, 1 thread": (
+            compressed_location,
+            time_load(lambda: load_snapshot(compressed_location, 1), repeats),
+        ),
+        f"compressed, {os.cpu_count()} threads": (
+            compressed_location,
+            time_load(lambda: load_snapshot(compressed_location, None), repeats),
+        ),
+    }
+
+    print(f"chain-{state_size}: {model.chain.num_states} states")  # noqa: T201
+    for name, (location, load_time) in results.items():
+        print(f"  {name:>24}: {location.stat().st_size / 1e6:7.1f} MB, load {load_time * 1e3:8.1f} ms")  # noqa: T201
+
+
+def main() -> None:
+    """Run the benchmark for the chains in the given directory."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("chain_directory", type=Path, help="The directory containing chain-N.pickle files")
+    parser.add_argument("--state-sizes", nargs="+", type=int, default=[1, 2, 3, 4], help="The state sizes to compare")
+    parser.add_argument("--repeats", type=int, default=5, help="The number of loads to time")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as output_directory:
+        for state_size in args.state_sizes:
+            benchmark_state_size(args.chain_directory, Path(output_directory), state_size, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark how long it takes to load a Markov chain and generate a sentence.
+
+Each load is run in a fresh process, so the timings include everything the
+bot pays for at startup. The page cache is not dropped between runs, so the
+memory-mapped timings are for a warm cache.
+
+    python scripts/benchmark_markov_startup.py data/markov/chain-2.pickle data/markov/chain-2.markov
+"""
+
+import argparse
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+def time_load(chain_location: str) -> None:
+    """Load a chain, generate a sentence and print the timings as JSON.
+
+    Parameters
+    ----------
+    chain_location : str
+        The chain to load.
+
+    """
+    from markovbot.lib.markov import load_markov_model  # noqa: PLC0415
+
+    start = time.perf_counter()
+    model = load_markov_model(chain_location, state_size=0)
+    loaded = time.perf_counter()
+    model.make_sentence()
+    generated = time.perf_counter()
+
+    print(  # noqa: T201
+        json.dumps(
+            {
+                "load": loaded - start,
+                "first_sentence": generated - loaded,
+                "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            }
+        )
+    )
+
+
+def benchmark_chain(chain_location: Path, repeats: int) -> None:
+    """Time loading a chain in fresh processes and print a summary.
+
+    Parameters
+    ----------
+    chain_location : Path
+        The chain to load.
+    repeats : int
+        The number of processes to time.
+
+    """
+    results = []
+    for _ in range(repeats):
+        output = subprocess.run(  # noqa: S603
+            [sys.executable, __file__, "--child", str(chain_location)],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    print(  # noqa: T201
+        f"{chain_location} ({chain_location.stat().st_size / 1e6:.1f} MB): "
+        f"load {statistics.median(r['load'] for r in results) * 1e3:.1f} ms, "
+        f"first sentence {statistics.median(r['first_sentence'] for r in results) * 1e3:.1f} ms, "
+        f"max RSS {statistics.median(r['max_rss_mb'] for r in results):.0f} MB"
+    )
+
+
+def main() -> None:
+    """Run the benchmark for the chains given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("chains", nargs="+", type=Path, help="The chains to load")
+    parser.add_argument("--repeats", type=int, default=5, help="The number of fresh processes per chain")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        time_load(str(args.chains[0]))
+        return
+
+    for chain in args.chains:
+        benchmark_chain(chain, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
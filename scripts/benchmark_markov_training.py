@@ -0,0 +1,123 @@
+"""Benchmark the Markov chain training engines against markovify.
+
+Every message in the scrape database is read and cleaned the same way as
+messages the bot learns from, then the transitions of a chain for each state
+size are counted with:
+
+    markovify     markovify.NewlineText, on all of the messages at once
+    streaming     StreamingChainTrainer, one transition at a time
+    vectorized    VectorizedChainTrainer, a chunk of messages at a time
+
+Only counting is timed, from the cleaned messages in memory to the counts of
+the chain, and not reading the database or building the generation index of
+`CompactText`. The counts of each engine are checked to be exactly the same
+as markovify's, and the time of each engine and its speed up over markovify
+are printed. Every engine splits messages into sentences and words the same
+way as markovify, so the time taken to do only that is printed too.
+
+    python scripts/benchmark_markov_training.py data/markov/scrapebot.sqlite.db --state-sizes 1 2 3
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import markovify
+
+from markovbot.lib.markov_training import (
+    DEFAULT_CHUNK_SIZE,
+    StreamingChainTrainer,
+    TransitionCounts,
+    VectorizedChainTrainer,
+    iter_message_chunks,
+    split_into_runs,
+)
+from markovbot.lib.text_normalisation import clean_messages_for_learning
+
+ENGINES = {"streaming": StreamingChainTrainer, "vectorized": VectorizedChainTrainer}
+
+
+def counts_as_dict(counts: TransitionCounts) -> dict[tuple[str, ...], dict[str, int]]:
+    """Convert transition counts to the format of markovify's chain model.
+
+    Parameters
+    ----------
+    counts : TransitionCounts
+        The counts.
+
+    Returns
+    -------
+    dict[tuple[str, ...], dict[str, int]]
+        The count of each next word, for each state.
+
+    """
+    words = counts.words
+    states, successors, transition_counts = counts.chain.transitions()
+    chain = {}
+    for state, successor, count in zip(states.tolist(), successors.tolist(), transition_counts.tolist(), strict=True):
+        chain.setdefault(tuple(words[word_id] for word_id in state), {})[words[successor]] = count
+
+    return chain
+
+
+def count_with_engine(chunks: list[list[str]], state_size: int, engine: str) -> tuple[TransitionCounts, float]:
+    """Count the transitions of a chain with one of the engines.
+
+    Parameters
+    ----------
+    chunks : list[list[str]]
+        The cleaned messages, in chunks.
+    state_size : int
+        The state size of the chain.
+    engine : str
+        The name of the engine.
+
+    Returns
+    -------
+    tuple[TransitionCounts, float]
+        The counts and the time taken to count them, in seconds.
+
+    """
+    start = time.perf_counter()
+    trainer = ENGINES[engine](state_size)
+    for messages in chunks:
+        trainer.add_messages(messages)
+    counts = trainer.counts()
+
+    return counts, time.perf_counter() - start
+
+
+def main() -> None:
+    """Run the benchmark for the given database."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", type=Path, help="The scrape database")
+    parser.add_argument("--state-sizes", nargs="+", type=int, default=[1, 2, 3], help="The state sizes to train")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="The messages to read at a time")
+    args = parser.parse_args()
+
+    chunks = [
+        clean_messages_for_learning([message for _, message in rows])
+        for rows in iter_message_chunks(args.database, args.chunk_size)
+    ]
+    corpus = "\n".join(message.strip() for messages in chunks for message in messages)
+    start = time.perf_counter()
+    for messages in chunks:
+        list(split_into_runs(messages))
+    print(f"{sum(map(len, chunks))} messages, split into words in {time.perf_counter() - start:.2f} s")  # noqa: T201
+
+    for state_size in args.state_sizes:
+        start = time.perf_counter()
+        reference = markovify.NewlineText(corpus, state_size=state_size).chain.model
+        markovify_time = time.perf_counter() - start
+        print(f"state size {state_size}: markovify {markovify_time:6.2f} s, {len(reference)} states")  # noqa: T201
+        for engine in ENGINES:
+            counts, engine_time = count_with_engine(chunks, state_size, engine)
+            same = counts_as_dict(counts) == reference
+            print(  # noqa: T201
+                f"state size {state_size}: {engine:<10} {engine_time:6.2f} s, "
+                f"speed up {markovify_time / engine_time:4.1f}x, counts {'match' if same else 'DIFFER'}"
+            )
+
+
+if __name__ == "__main__":
+    main()
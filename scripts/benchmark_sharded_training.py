@@ -0,0 +1,116 @@
+"""Benchmark sharded Markov chain training and the merge of its shards.
+
+For each number of workers, the scrape database is split into one shard per
+worker and the shards are trained in parallel (the map step), then merged as
+a tree (the reduce step). The time of each step and the speed up of training
+over one worker are printed.
+
+The merge is then benchmarked on its own: the database is split into each
+number of shards, trained once, and the shards are merged in this process
+and in a pool, without the cost of training.
+
+    python scripts/benchmark_sharded_training.py data/markov/scrapebot.sqlite.db --workers 1 2 4 8
+"""
+
+import argparse
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from markovbot.lib.markov_training import shard_id_ranges, train_shards, tree_merge
+
+
+def fork_pool(num_workers: int) -> ProcessPoolExecutor:
+    """Create a pool of forked worker processes.
+
+    Parameters
+    ----------
+    num_workers : int
+        The number of workers.
+
+    Returns
+    -------
+    ProcessPoolExecutor
+        The pool.
+
+    """
+    return ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context("fork"))
+
+
+def benchmark_training(database: Path, state_size: int, worker_counts: list[int]) -> None:
+    """Time the map and reduce steps of sharded training.
+
+    Parameters
+    ----------
+    database : Path
+        The scrape database.
+    state_size : int
+        The state size of the chain.
+    worker_counts : list[int]
+        The numbers of workers to train with.
+
+    """
+    single_worker_time = None
+    for num_workers in worker_counts:
+        id_ranges = shard_id_ranges(database, num_workers)
+        with fork_pool(num_workers) as executor:
+            start = time.perf_counter()
+            counts = train_shards(database, state_size, id_ranges, executor)
+            map_time = time.perf_counter() - start
+            start = time.perf_counter()
+            merged = tree_merge(counts, executor)
+            reduce_time = time.perf_counter() - start
+        single_worker_time = single_worker_time or map_time + reduce_time
+        print(  # noqa: T201
+            f"{num_workers:>3} workers: map {map_time:6.2f} s, reduce {reduce_time:6.2f} s, "
+            f"{merged.chain.num_transitions} transitions, "
+            f"speed up {single_worker_time / (map_time + reduce_time):4.1f}x"
+        )
+
+
+def benchmark_merge(database: Path, state_size: int, shard_counts: list[int], num_workers: int) -> None:
+    """Time merging shards, without training them.
+
+    Parameters
+    ----------
+    database : Path
+        The scrape database.
+    state_size : int
+        The state size of the chain.
+    shard_counts : list[int]
+        The numbers of shards to merge.
+    num_workers : int
+        The number of workers to merge in parallel with.
+
+    """
+    with fork_pool(num_workers) as executor:
+        for num_shards in shard_counts:
+            counts = train_shards(database, state_size, shard_id_ranges(database, num_shards), executor)
+            start = time.perf_counter()
+            tree_merge(counts)
+            serial_time = time.perf_counter() - start
+            start = time.perf_counter()
+            tree_merge(counts, executor)
+            parallel_time = time.perf_counter() - start
+            print(  # noqa: T201
+                f"{num_shards:>3} shards: merge in this process {serial_time:6.2f} s, "
+                f"with {num_workers} workers {parallel_time:6.2f} s"
+            )
+
+
+def main() -> None:
+    """Run the benchmarks for the given database."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", type=Path, help="The scrape database")
+    parser.add_argument("--state-size", type=int, default=2, help="The state size of the chain")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, 8], help="The numbers of workers")
+    parser.add_argument("--shards", nargs="+", type=int, default=[2, 4, 8, 16], help="The numbers of shards to merge")
+    args = parser.parse_args()
+
+    benchmark_training(args.database, args.state_size, args.workers)
+    benchmark_merge(args.database, args.state_size, args.shards, max(args.workers))
+
+
+if __name__ == "__main__":
+    main()
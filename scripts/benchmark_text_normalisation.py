@@ -0,0 +1,102 @@
+"""Benchmark cleaning messages one at a time against cleaning them in batches.
+
+Every message in the scrape database is read, then cleaned with the
+normalisation steps given by `--steps`:
+
+    per message    TextNormaliser, called once for each message
+    batch          TextNormaliser.normalise_batch, on a chunk of messages at once
+
+The results of both are checked to be the same. Stripping emojis by
+building the pattern on every call, as `util.remove_emojis_from_string` used
+to, is timed against the precompiled emoji step as well.
+
+    python scripts/benchmark_text_normalisation.py data/markov/scrapebot.sqlite.db --steps mentions urls whitespace
+"""
+
+import argparse
+import re
+import time
+from pathlib import Path
+
+from markovbot.lib.markov_training import DEFAULT_CHUNK_SIZE, iter_message_chunks
+from markovbot.lib.text_normalisation import EMOJI_PATTERN, STEPS, TextNormaliser, strip_emojis
+
+
+def strip_emojis_uncompiled(text: str) -> str:
+    """Strip emojis, building the pattern on every call.
+
+    Parameters
+    ----------
+    text : str
+        The text to clean.
+
+    Returns
+    -------
+    str
+        The text without emojis.
+
+    """
+    return re.sub(re.compile(EMOJI_PATTERN.pattern, re.UNICODE), "", text)
+
+
+def time_per_message(chunks: list[list[str]], function: callable) -> tuple[list[str], float]:
+    """Time cleaning every message one at a time.
+
+    Parameters
+    ----------
+    chunks : list[list[str]]
+        The messages, in chunks.
+    function : callable
+        The function to clean a message with.
+
+    Returns
+    -------
+    tuple[list[str], float]
+        The cleaned messages and the time taken, in seconds.
+
+    """
+    start = time.perf_counter()
+    cleaned = [function(message) for messages in chunks for message in messages]
+
+    return cleaned, time.perf_counter() - start
+
+
+def main() -> None:
+    """Run the benchmark for the given database."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", type=Path, help="The scrape database")
+    parser.add_argument(
+        "--steps",
+        nargs="+",
+        choices=STEPS,
+        default=["mentions", "custom_emojis", "urls", "whitespace"],
+        help="The normalisation steps to apply",
+    )
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="The messages to read at a time")
+    args = parser.parse_args()
+
+    chunks = [[message for _, message in rows] for rows in iter_message_chunks(args.database, args.chunk_size)]
+    num_messages = sum(map(len, chunks))
+    print(f"{num_messages} messages, steps: {' '.join(args.steps)}")  # noqa: T201
+
+    normaliser = TextNormaliser(args.steps)
+    per_message, per_message_time = time_per_message(chunks, normaliser)
+    start = time.perf_counter()
+    batch = [message for messages in chunks for message in normaliser.normalise_batch(messages)]
+    batch_time = time.perf_counter() - start
+    print(f"per message {per_message_time:6.2f} s, {per_message_time / num_messages * 1e6:5.2f} us/message")  # noqa: T201
+    print(  # noqa: T201
+        f"batch       {batch_time:6.2f} s, {batch_time / num_messages * 1e6:5.2f} us/message, "
+        f"speed up {per_message_time / batch_time:4.1f}x, results {'match' if batch == per_message else 'DIFFER'}"
+    )
+
+    _, uncompiled_time = time_per_message(chunks, strip_emojis_uncompiled)
+    _, compiled_time = time_per_message(chunks, strip_emojis)
+    print(  # noqa: T201
+        f"emojis: pattern built per call {uncompiled_time:6.2f} s, precompiled {compiled_time:6.2f} s, "
+        f"speed up {uncompiled_time / compiled_time:4.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
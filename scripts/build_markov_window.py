@@ -0,0 +1,104 @@
+"""Build the weekly segments of a sliding window Markov chain.
+
+Messages from the last few weeks are read from the `channel_messages` table
+of the scrape database and grouped by ISO week. The messages of each week
+are trained into a delta log segment, in the layout used by
+`markovbot.lib.markov_window`, and the segments are merged into the window's
+view. Any existing segments and view are replaced.
+
+    python scripts/build_markov_window.py data/markov/scrapebot.sqlite.db --weeks 12
+"""
+
+import argparse
+import datetime
+import itertools
+import sqlite3
+import time
+from pathlib import Path
+
+import markovify
+
+from markovbot.lib.delta_log import append_delta
+from markovbot.lib.markov_window import MarkovWindow, segment_name
+from markovbot.lib.text_normalisation import clean_messages_for_learning
+
+
+def build_window(database: Path, window: MarkovWindow, today: datetime.date) -> int:
+    """Train a segment for each week of the window.
+
+    Parameters
+    ----------
+    database : Path
+        The location of the scrape database.
+    window : MarkovWindow
+        The window to build.
+    today : datetime.date
+        The last day of the window.
+
+    Returns
+    -------
+    int
+        The number of segments written.
+
+    """
+    for name in window.segment_names():
+        window.segment_location(name).unlink()
+    window.view_location.unlink(missing_ok=True)
+    window.segment_directory.mkdir(parents=True, exist_ok=True)
+
+    first_day = today - datetime.timedelta(days=today.weekday(), weeks=window.num_segments - 1)
+    connection = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    rows = connection.execute(
+        "SELECT date, message FROM channel_messages WHERE date >= ? AND date < ? ORDER BY date",
+        (first_day.isoformat(), (today + datetime.timedelta(days=1)).isoformat()),
+    )
+
+    num_segments = 0
+    weeks = itertools.groupby(rows, key=lambda row: segment_name(datetime.datetime.fromisoformat(row[0]).date()))
+    for name, week_rows in weeks:
+        messages = clean_messages_for_learning([message for _, message in week_rows])
+        if not messages:
+            continue
+        start = time.perf_counter()
+        try:
+            text = markovify.NewlineText("\n".join(messages), state_size=window.state_size)
+        except KeyError:
+            print(f"{name}: no usable messages")  # noqa: T201
+            continue
+        append_delta(window.segment_location(name), text.chain.model)
+        num_segments += 1
+        print(f"{name}: {len(messages)} messages, {time.perf_counter() - start:.1f} s")  # noqa: T201
+
+    connection.close()
+
+    return num_segments
+
+
+def main() -> None:
+    """Build the window segments and view."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", type=Path, help="The scrape database")
+    parser.add_argument("--weeks", type=int, default=12, help="The number of weeks in the window")
+    parser.add_argument("--state-size", type=int, default=2, help="The state size of the chain")
+    parser.add_argument(
+        "--until",
+        type=datetime.date.fromisoformat,
+        default=datetime.datetime.now(tz=datetime.UTC).date(),
+        help="The last day of the window, as YYYY-MM-DD, by default today",
+    )
+    parser.add_argument(
+        "--output", type=Path, default=Path("data/markov/window"), help="The window directory to write to"
+    )
+    args = parser.parse_args()
+
+    window = MarkovWindow(args.output, args.state_size, args.weeks)
+    num_segments = build_window(args.database, window, args.until)
+    model = window.load(args.until)
+    print(  # noqa: T201
+        f"Built {num_segments} segments, the window has {model.chain.num_states} states "
+        f"({window.view_location.stat().st_size / 1e6:.1f} MB)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Check that sampling from alias tables matches markovify's distribution.
+
+For the states of a chain with the most successors (the ones with alias
+tables), many next words are drawn with the alias tables, one at a time
+(`CompactChain.move_id`) and in a batch (`CompactChain.move_ids`), and with
+a markovify chain holding the same counts. Each set of draws is compared to
+the state's counts with a chi-squared goodness of fit test, and the check
+fails if any p-value is below the significance level, after a Bonferroni
+correction for the number of tests.
+
+    python scripts/check_markov_sampling.py data/markov/chain-2.markov
+"""
+
+import argparse
+import math
+import random
+import sys
+from pathlib import Path
+
+import markovify
+import numpy as np
+
+from markovbot.lib.markov import BEGIN, END, CompactChain, load_markov_model
+
+MIN_EXPECTED_COUNT = 5
+
+
+def chi_squared_p_value(observed: np.ndarray, expected: np.ndarray) -> float:
+    """Get the p-value of a chi-squared goodness of fit test.
+
+    Successors with an expected count below MIN_EXPECTED_COUNT are pooled
+    together, and the upper tail of the chi-squared distribution is
+    approximated with the Wilson-Hilferty transformation.
+
+    Parameters
+    ----------
+    observed : np.ndarray
+        The number of times each successor was drawn.
+    expected : np.ndarray
+        The expected number of draws of each successor.
+
+    Returns
+    -------
+    float
+        The p-value.
+
+    """
+    rare = expected < MIN_EXPECTED_COUNT
+    if rare.any():
+        observed = np.append(observed[~rare], observed[rare].sum())
+        expected = np.append(expected[~rare], expected[rare].sum())
+    degrees = len(expected) - 1
+    if degrees < 1:
+        return 1.0
+    statistic = float(np.sum((observed - expected) ** 2 / expected))
+    z = ((statistic / degrees) ** (1 / 3) - (1 - 2 / (9 * degrees))) / math.sqrt(2 / (9 * degrees))
+
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def check_state(chain: CompactChain, row: int, num_draws: int, rng: np.random.Generator) -> dict[str, float]:
+    """Draw next words for a state with each sampler and test them.
+
+    Parameters
+    ----------
+    chain : CompactChain
+        The chain.
+    row : int
+        The row of the state.
+    num_draws : int
+        The number of next words to draw with each sampler.
+    rng : np.random.Generator
+        The random number generator for batch draws.
+
+    Returns
+    -------
+    dict[str, float]
+        The p-value of each sampler.
+
+    """
+    start, end = int(chain.offsets[row]), int(chain.offsets[row + 1])
+    successors = chain.successors[start:end]
+    counts = np.diff(chain.cumulative_counts[start:end].astype(np.int64), prepend=0)
+    expected = counts / counts.sum() * num_draws
+    slots = {int(word_id): slot for slot, word_id in enumerate(successors.tolist())}
+
+    state = tuple(chain.vocabulary.words(chain.states[row].tolist()))
+    words = chain.vocabulary.words(successors.tolist())
+    model = {(BEGIN,) * chain.state_size: {END: 1}}  # markovify needs a start state
+    model[state] = dict(zip(words, counts.tolist(), strict=True))
+    markovify_chain = markovify.Chain([], chain.state_size, model=model)
+    markovify_slots = {word: slot for slot, word in enumerate(words)}
+
+    draws = {
+        "alias, one at a time": [slots[chain.move_id(row)] for _ in range(num_draws)],
+        "alias, batch": [slots[word_id] for word_id in chain.move_ids(np.full(num_draws, row), rng).tolist()],
+        "markovify": [markovify_slots[markovify_chain.move(state)] for _ in range(num_draws)],
+    }
+
+    return {
+        name: chi_squared_p_value(np.bincount(drawn, minlength=len(successors)), expected)
+        for name, drawn in draws.items()
+    }
+
+
+def main() -> None:
+    """Run the check for the given chain."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("chain", type=Path, help="The chain to check")
+    parser.add_argument("--state-size", type=int, default=2, help="The state size of the chain")
+    parser.add_argument("--states", type=int, default=10, help="The number of states to check")
+    parser.add_argument("--draws", type=int, default=100000, help="The number of draws per state and sampler")
+    parser.add_argument("--alpha", type=float, default=0.01, help="The significance level")
+    parser.add_argument("--seed", type=int, default=0, help="The random seed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    chain = load_markov_model(args.chain, args.state_size).chain
+    if chain.alias_tables is None or len(chain.alias_tables.rows) == 0:
+        print("The chain has no alias tables, check MARKOV_ALIAS_MIN_SUCCESSORS")  # noqa: T201
+        sys.exit(1)
+
+    table_rows = chain.alias_tables.rows.astype(np.int64)
+    rows = table_rows[np.argsort(-np.diff(chain.offsets)[table_rows], kind="stable")][: args.states]
+    threshold = args.alpha / (len(rows) * 3)
+    failures = 0
+    for row in rows.tolist():
+        p_values = check_state(chain, row, args.draws, rng)
+        failures += sum(p_value < threshold for p_value in p_values.values())
+        results = ", ".join(f"{name} p={p_value:.3f}" for name, p_value in p_values.items())
+        print(f"state {row} ({int(chain.offsets[row + 1] - chain.offsets[row])} successors): {results}")  # noqa: T201
+
+    print(f"{failures} tests failed at a corrected significance level of {threshold:.2g}")  # noqa: T201
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
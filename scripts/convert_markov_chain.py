@@ -0,0 +1,59 @@
+"""Convert pickled Markov chains into the memory-mapped chain format.
+
+Each chain is written next to the original with the `.markov` suffix, e.g.
+`data/markov/chain-2.pickle` becomes `data/markov/chain-2.markov`. The
+original pickle is left untouched. With `--compress`, the chain is written
+as compressed, checksummed chunks, which is smaller but cannot be
+memory-mapped.
+
+    python scripts/convert_markov_chain.py data/markov/chain-*.pickle
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from markovbot.lib.markov import CHAIN_FILE_SUFFIX, load_markov_model, save_markov_model
+
+
+def convert_chain(pickle_location: Path, *, compress: bool = False) -> Path:
+    """Convert a pickled chain into the memory-mapped chain format.
+
+    Parameters
+    ----------
+    pickle_location : Path
+        The location of the pickled chain.
+    compress : bool
+        If True, write a compressed chain.
+
+    Returns
+    -------
+    Path
+        The location of the converted chain.
+
+    """
+    start = time.perf_counter()
+    model = load_markov_model(pickle_location, state_size=0)
+    output_location = pickle_location.with_suffix(CHAIN_FILE_SUFFIX)
+    save_markov_model(model, output_location, compress=compress)
+    print(  # noqa: T201
+        f"{pickle_location} -> {output_location}: {model.chain.num_states} states, "
+        f"{output_location.stat().st_size / 1e6:.1f} MB, {time.perf_counter() - start:.1f} s"
+    )
+
+    return output_location
+
+
+def main() -> None:
+    """Convert the chains given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("chains", nargs="+", type=Path, help="The pickled chains to convert")
+    parser.add_argument("--compress", action="store_true", help="Write compressed, checksummed chains")
+    args = parser.parse_args()
+
+    for chain in args.chains:
+        convert_chain(chain, compress=args.compress)
+
+
+if __name__ == "__main__":
+    main()
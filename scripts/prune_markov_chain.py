@@ -0,0 +1,51 @@
+"""Prune rare states and transitions from a Markov chain.
+
+The chain is loaded with any updates in its delta log, pruned, and written
+back as a new snapshot with the log compacted into it. With `--dry-run`,
+only the sizes before and after pruning are printed. The bot should not be
+updating the chain while this runs, as the updates would be lost when the
+bot next compacts its own, unpruned, copy of the chain.
+
+    python scripts/prune_markov_chain.py data/markov/chain-2.markov --min-state-count 2 --top-k 50
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from markovbot.lib.markov import chain_log_sequence, compact_markov_chain, load_markov_model, prune_markov_model
+
+
+def main() -> None:
+    """Prune the chain given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("chain", type=Path, help="The chain to prune")
+    parser.add_argument("--min-transition-count", type=int, default=1, help="The smallest transition count to keep")
+    parser.add_argument("--min-state-count", type=int, default=1, help="The smallest state count to keep")
+    parser.add_argument("--top-k", type=int, default=0, help="The number of successors to keep per state, 0 for all")
+    parser.add_argument("--max-bytes", type=int, default=0, help="The size target for the pruned chain, 0 for none")
+    parser.add_argument("--dry-run", action="store_true", help="Print the sizes without saving the pruned chain")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    log_sequence = chain_log_sequence(args.chain)
+    model = load_markov_model(args.chain, state_size=0)
+    pruned_model, report = prune_markov_model(
+        model,
+        min_transition_count=args.min_transition_count,
+        min_state_count=args.min_state_count,
+        top_k=args.top_k,
+        max_bytes=args.max_bytes,
+    )
+    for name in ("bytes", "states", "transitions", "words"):
+        before, after = report[f"{name}_before"], report[f"{name}_after"]
+        print(f"{name:>12}: {before:>12} -> {after:>12} ({100 * (before - after) / max(before, 1):.1f}% removed)")  # noqa: T201
+    print(f"State count threshold used: {report['min_state_count']}")  # noqa: T201
+
+    if not args.dry_run:
+        compact_markov_chain(pruned_model, args.chain, log_sequence)
+    print(f"Finished in {time.perf_counter() - start:.1f} s")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
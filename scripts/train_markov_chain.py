@@ -1,72 +1,250 @@
-"""Contains functions for modifying the slashbot database."""
-
-import sys
-
-sys.path.append("../lib")
-
-import pickle
-from multiprocessing import Pool
-
-import markovify
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, create_engine
-from sqlalchemy.orm import DeclarativeBase, Session, relationship
-
-# Models -----------------------------------------------------------------------
-
-
-class Base(DeclarativeBase):
-    """Base class for ORM definition."""
-
-
-class ChannelMessage(Base):
-    __tablename__ = "channel_messages"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, index=True)
-    message_id = Column(Integer, index=True)
-    channel_id = Column(Integer, nullable=True)
-    server_id = Column(Integer, nullable=True)
-    date = Column(DateTime, index=True)
-    user_name = Column(String(64))
-    message = Column(String(2048))
-    attachments = relationship("MessageAttachment")
-
-
-class MessageAttachment(Base):
-    __tablename__ = "message_attachments"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    message_id = Column(Integer, ForeignKey("channel_messages.message_id"), index=True)
-    content_type = Column(String(64))
-    url = Column(String(256))
-    message = relationship("ChannelMessage", back_populates="attachments")
-
-
-# Functions --------------------------------------------------------------------
-
-
-def connect_to_database_engine(location):
-    engine = create_engine(f"sqlite:///{location}")
-    Base.metadata.create_all(bind=engine)
-
-    return engine
-
-
-def train_model(state_size, messages):
-    print("Starting state size:", state_size)
-    new_model = markovify.NewlineText(messages, state_size=state_size)
-    with open(f"chain-{state_size}.pickle", "wb") as chain_out:
-        pickle.dump(new_model.chain, chain_out)
-    print("Completed state size:", state_size)
-
-
-num_processes = 4
-state_sizes = range(1, 5, 1)
-
-database = connect_to_database_engine("../data/markov/scrapebot.sqlite.db")
-with Session(database) as session:
-    messages = "\n".join([result.message for result in session.query(ChannelMessage.message).all()])
-
-for size in state_sizes:
-	train_model(size, messages)
-
-# with Pool(num_processes) as pool:
-#     pool.starmap(train_model, [(size, messages) for size in state_sizes])
+"""Train Markov chains from every message in the scrape database.
+
+Messages are streamed from the `channel_messages` table in chunks and
+cleaned the same way as messages the bot learns from. A chain for each state
+size is trained in the same pass, by default with `VectorizedChainTrainer`,
+so memory use is bounded by the size of the chains rather than the corpus. With
+`--workers`, each chain is instead trained in shards by several processes
+and the shards are merged (see `train_sharded`). Each chain is written to
+`chain-N.markov` in the output directory, replacing any existing chain and
+delta log.
+
+Each chain records the id and date of the last row it was trained on as a
+watermark. When a chain already exists with a watermark, only the rows after
+it are counted and merged into the chain, so a regular refresh takes seconds
+rather than a full retrain. Chains are retrained in full with `--full`, or
+when the row at their watermark has changed.
+
+Messages which repeat, or nearly repeat, one of the last `--dedup-messages`
+messages are not learnt, and the number rejected is printed. With
+`--workers`, each shard is deduplicated on its own. Pass `--dedup-messages 0`
+to learn every message.
+
+    python scripts/train_markov_chain.py data/markov/scrapebot.sqlite.db --state-sizes 1 2 3 4 --workers 8
+"""
+
+import argparse
+import resource
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from markovbot.lib.delta_log import log_location_for
+from markovbot.lib.markov import (
+    CHAIN_FILE_SUFFIX,
+    CompactText,
+    load_markov_model,
+    read_chain_metadata,
+    save_markov_model,
+)
+from markovbot.lib.markov_dedup import DEFAULT_MAX_MESSAGES, DEFAULT_THRESHOLD, MessageDeduplicator
+from markovbot.lib.markov_training import (
+    DEFAULT_CHUNK_SIZE,
+    MAX_PENDING_TRANSITIONS,
+    WATERMARK_METADATA_KEY,
+    StreamingChainTrainer,
+    VectorizedChainTrainer,
+    database_watermark,
+    train_from_database,
+    train_sharded,
+    watermark_is_valid,
+)
+
+ENGINES = {"streaming": StreamingChainTrainer, "vectorized": VectorizedChainTrainer}
+
+
+def create_deduplicator(args: argparse.Namespace) -> MessageDeduplicator | None:
+    """Create a deduplicator from the command line arguments.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+
+    Returns
+    -------
+    MessageDeduplicator | None
+        The deduplicator, or None if deduplication is turned off.
+
+    """
+    if not args.dedup_messages:
+        return None
+    return MessageDeduplicator(args.dedup_messages, threshold=args.dedup_threshold)
+
+
+def report_duplicates(deduplicator: MessageDeduplicator | None) -> None:
+    """Print the number of messages a deduplicator rejected.
+
+    Parameters
+    ----------
+    deduplicator : MessageDeduplicator | None
+        The deduplicator, or None.
+
+    """
+    if deduplicator is None:
+        return
+    print(  # noqa: T201
+        f"Rejected {deduplicator.num_rejected} of {deduplicator.num_seen} messages as duplicates "
+        f"({deduplicator.num_exact} exact, {deduplicator.num_near} near)"
+    )
+
+
+def train_chains(args: argparse.Namespace, state_sizes: list[int], last_id: int) -> dict[int, CompactText]:
+    """Train chains from scratch.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+    state_sizes : list[int]
+        The state sizes to train.
+    last_id : int
+        The last row id to train on.
+
+    Returns
+    -------
+    dict[int, CompactText]
+        The model for each state size.
+
+    """
+    if args.workers > 1:
+        return {
+            state_size: train_sharded(
+                args.database,
+                state_size,
+                args.workers,
+                last_id=last_id,
+                chunk_size=args.chunk_size,
+                max_pending=args.max_pending,
+                trainer_class=ENGINES[args.engine],
+                deduplicator=create_deduplicator(args),
+            )
+            for state_size in state_sizes
+        }
+
+    deduplicator = create_deduplicator(args)
+    trainers = train_from_database(
+        args.database,
+        state_sizes,
+        last_id=last_id,
+        chunk_size=args.chunk_size,
+        max_pending=args.max_pending,
+        trainer_class=ENGINES[args.engine],
+        deduplicator=deduplicator,
+    )
+    report_duplicates(deduplicator)
+
+    return {trainer.state_size: trainer.model() for trainer in trainers}
+
+
+def update_chains(
+    args: argparse.Namespace, locations: dict[int, Path], first_id: int, last_id: int
+) -> dict[int, CompactText]:
+    """Merge new rows into existing chains.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+    locations : dict[int, Path]
+        The location of each chain to update, for each state size.
+    first_id : int
+        The first row id the chains have not been trained on.
+    last_id : int
+        The last row id to train on.
+
+    Returns
+    -------
+    dict[int, CompactText]
+        The updated model for each state size.
+
+    """
+    deduplicator = create_deduplicator(args)
+    trainers = train_from_database(
+        args.database,
+        list(locations),
+        first_id=first_id,
+        last_id=last_id,
+        chunk_size=args.chunk_size,
+        max_pending=args.max_pending,
+        trainer_class=ENGINES[args.engine],
+        deduplicator=deduplicator,
+    )
+    report_duplicates(deduplicator)
+    models = {}
+    for trainer in trainers:
+        location = locations[trainer.state_size]
+        # The delta log is left out, as the messages the bot learnt are in the database too
+        model = load_markov_model(location, trainer.state_size, apply_log=False)
+        models[trainer.state_size] = trainer.counts().merge_into(model)
+        print(f"{location}: merged {trainer.num_sentences} sentences from rows {first_id} to {last_id}")  # noqa: T201
+
+    return models
+
+
+def main() -> None:
+    """Train and save the chains."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", type=Path, help="The scrape database")
+    parser.add_argument("--state-sizes", nargs="+", type=int, default=[1, 2, 3, 4], help="The state sizes to train")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="The messages to read at a time")
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=MAX_PENDING_TRANSITIONS,
+        help="The transitions to buffer before folding them into each chain",
+    )
+    parser.add_argument("--engine", choices=ENGINES, default="vectorized", help="The engine to count transitions with")
+    parser.add_argument("--workers", type=int, default=1, help="The number of processes to train each chain with")
+    parser.add_argument(
+        "--dedup-messages",
+        type=int,
+        default=DEFAULT_MAX_MESSAGES,
+        help="The recent messages to reject duplicates of, or 0 to learn every message",
+    )
+    parser.add_argument(
+        "--dedup-threshold", type=float, default=DEFAULT_THRESHOLD, help="The similarity of a near-duplicate"
+    )
+    parser.add_argument("--full", action="store_true", help="Retrain every chain, ignoring their watermarks")
+    parser.add_argument("--output", type=Path, default=Path("data/markov"), help="The directory to write chains to")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    # The watermark is taken before training, so rows added during training are left for the next run
+    watermark = database_watermark(args.database)
+    if watermark is None:
+        print(f"{args.database} has no messages")  # noqa: T201
+        return
+
+    locations = {state_size: args.output / f"chain-{state_size}{CHAIN_FILE_SUFFIX}" for state_size in args.state_sizes}
+    retrain = []
+    outdated = defaultdict(dict)
+    for state_size, location in locations.items():
+        previous = None if args.full else read_chain_metadata(location).get(WATERMARK_METADATA_KEY)
+        if previous is None:
+            retrain.append(state_size)
+        elif not watermark_is_valid(args.database, previous):
+            print(f"{location}: row {previous['id']} has changed since it was trained, retraining")  # noqa: T201
+            retrain.append(state_size)
+        elif previous["id"] < watermark["id"]:
+            outdated[previous["id"] + 1][state_size] = location
+        else:
+            print(f"{location}: up to date at row {previous['id']}")  # noqa: T201
+
+    models = train_chains(args, retrain, watermark["id"]) if retrain else {}
+    for first_id, outdated_locations in outdated.items():
+        models.update(update_chains(args, outdated_locations, first_id, watermark["id"]))
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    for state_size, model in models.items():
+        location = locations[state_size]
+        save_markov_model(model, location, metadata={WATERMARK_METADATA_KEY: watermark})
+        log_location_for(location).unlink(missing_ok=True)
+        print(f"{location}: {model.chain.num_states} states, {location.stat().st_size / 1e6:.1f} MB")  # noqa: T201
+
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Trained in {time.perf_counter() - start:.1f} s, peak memory {peak_memory:.0f} MB")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
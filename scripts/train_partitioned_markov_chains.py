@@ -0,0 +1,94 @@
+"""Train a Markov chain for every guild, channel or user in the scrape database.
+
+Messages are read from the `channel_messages` table of the scrape database,
+grouped by the partition column, and a chain is trained for each partition
+with enough messages. The chains are written to the partition directory in
+the layout used by `markovbot.lib.markov_partitions`, replacing any existing
+chain and delta log.
+
+    python scripts/train_partitioned_markov_chains.py data/markov/scrapebot.sqlite.db --scope guild
+"""
+
+import argparse
+import itertools
+import sqlite3
+import time
+from pathlib import Path
+
+from markovbot.lib.delta_log import log_location_for
+from markovbot.lib.markov_partitions import PARTITION_SCOPES, partition_location, train_partition_model
+from markovbot.lib.text_normalisation import clean_messages_for_learning
+
+PARTITION_COLUMNS = {"guild": "server_id", "channel": "channel_id", "user": "user_id"}
+
+
+def train_partitions(database: Path, scope: str, state_size: int, min_messages: int, output_directory: Path) -> int:
+    """Train a chain for each partition in the scrape database.
+
+    Parameters
+    ----------
+    database : Path
+        The location of the scrape database.
+    scope : str
+        What to partition by: "guild", "channel" or "user".
+    state_size : int
+        The state size of the chains.
+    min_messages : int
+        Partitions with fewer messages than this are skipped.
+    output_directory : Path
+        The partition directory.
+
+    Returns
+    -------
+    int
+        The number of chains trained.
+
+    """
+    column = PARTITION_COLUMNS[scope]
+    connection = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    rows = connection.execute(
+        f"SELECT {column}, message FROM channel_messages WHERE {column} IS NOT NULL ORDER BY {column}"  # noqa: S608
+    )
+
+    num_trained = 0
+    for partition_id, partition_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        messages = clean_messages_for_learning([message for _, message in partition_rows])
+        if len(messages) < min_messages:
+            continue
+        start = time.perf_counter()
+        location = partition_location(output_directory, (scope, partition_id), state_size)
+        try:
+            model = train_partition_model(messages, state_size, location)
+        except KeyError:
+            print(f"{scope} {partition_id}: no usable messages")  # noqa: T201
+            continue
+        log_location_for(location).unlink(missing_ok=True)
+        num_trained += 1
+        print(  # noqa: T201
+            f"{scope} {partition_id}: {len(messages)} messages, {model.chain.num_states} states, "
+            f"{location.stat().st_size / 1e6:.1f} MB, {time.perf_counter() - start:.1f} s"
+        )
+
+    connection.close()
+
+    return num_trained
+
+
+def main() -> None:
+    """Train the partition chains."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", type=Path, help="The scrape database")
+    parser.add_argument("--scope", choices=PARTITION_SCOPES, default="guild", help="What to partition the chains by")
+    parser.add_argument("--state-size", type=int, default=2, help="The state size of the chains")
+    parser.add_argument("--min-messages", type=int, default=500, help="The fewest messages to train a chain with")
+    parser.add_argument(
+        "--output", type=Path, default=Path("data/markov/partitions"), help="The partition directory to write to"
+    )
+    args = parser.parse_args()
+
+    num_trained = train_partitions(args.database, args.scope, args.state_size, args.min_messages, args.output)
+    print(f"Trained {num_trained} {args.scope} chains")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
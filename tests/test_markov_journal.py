@@ -0,0 +1,134 @@
+"""Test that messages learnt through the journal can be forgotten again."""
+
+import asyncio
+from pathlib import Path
+
+import markovify
+import pytest
+
+from markovbot.lib import markov
+from markovbot.lib.markov_journal import MarkovJournal
+
+STATE_SIZE = 2
+
+CORPUS = [
+    "the cat sat on the mat",
+    "the dog sat on the cat",
+    "a bird flew over the mat",
+]
+SAMPLE = {
+    101: "the cat ate the bird",
+    102: "a dog flew over the moon",
+    103: "the cat sat on the mat",
+}
+
+
+def chain_as_dict(model: markov.CompactText) -> dict[tuple[str, ...], dict[str, int]]:
+    """Get the transition counts of a model, in markovify's format."""
+    chain = model.chain
+    states, successors, counts = chain.transitions()
+    transitions = {}
+    for state, successor, count in zip(states.tolist(), successors.tolist(), counts.tolist(), strict=True):
+        transitions.setdefault(tuple(chain.vocabulary.words(state)), {})[chain.vocabulary.word(successor)] = count
+
+    return transitions
+
+
+def reference_model(messages: list[str]) -> dict[tuple[str, ...], dict[str, int]]:
+    """Train markovify on the messages, one per line."""
+    return markovify.NewlineText("\n".join(messages), state_size=STATE_SIZE).chain.model
+
+
+@pytest.fixture
+def chain_location(tmp_path: Path) -> Path:
+    """Save a chain trained on the corpus."""
+    location = tmp_path / f"chain{markov.CHAIN_FILE_SUFFIX}"
+    text = markovify.NewlineText("\n".join(CORPUS), state_size=STATE_SIZE)
+    markov.save_markov_model(markov.CompactText(markov.CompactChain.from_markovify_chain(text.chain)), location)
+    return location
+
+
+@pytest.fixture
+def journal(tmp_path: Path) -> MarkovJournal:
+    """Open an empty journal."""
+    journal = MarkovJournal(tmp_path / "journal.sqlite3")
+    yield journal
+    journal.connection.close()
+
+
+def update(
+    model: markov.CompactText, location: Path, messages: list[str], forget_messages: list[str]
+) -> markov.CompactText:
+    """Learn and forget normalised messages, as the cog does."""
+    return asyncio.run(
+        markov.update_markov_chain_for_model(None, model, messages, location, forget_messages, normalised=True)
+    )
+
+
+def test_learn_then_forget(chain_location: Path, journal: MarkovJournal) -> None:
+    """Forgetting the messages in the journal restores the original chain."""
+    model = markov.load_markov_model(chain_location, STATE_SIZE)
+    original = chain_as_dict(model)
+
+    journal.record(SAMPLE)
+    learnt = update(model, chain_location, list(SAMPLE.values()), [])
+
+    assert chain_as_dict(learnt) == reference_model(CORPUS + list(SAMPLE.values()))
+
+    for message_id in SAMPLE:
+        assert journal.forget(message_id)
+    forgotten = journal.forgotten()
+    reverted = update(learnt, chain_location, [], list(forgotten.values()))
+    journal.remove_forgotten(forgotten)
+
+    assert forgotten == SAMPLE
+    assert chain_as_dict(reverted) == original
+    assert chain_as_dict(markov.load_markov_model(chain_location, STATE_SIZE)) == original
+    assert len(journal) == 0
+
+
+def test_forget_and_relearn_edit(chain_location: Path, journal: MarkovJournal) -> None:
+    """An edited message is forgotten with its old text and learnt with its new text."""
+    model = markov.load_markov_model(chain_location, STATE_SIZE)
+    journal.record(SAMPLE)
+    learnt = update(model, chain_location, list(SAMPLE.values()), [])
+
+    journal.forget(101)
+    forgotten = journal.forgotten()
+    edit = {101: "the cat ate the fish"}
+    journal.record(edit)
+    edited = update(learnt, chain_location, list(edit.values()), list(forgotten.values()))
+    journal.remove_forgotten(forgotten)
+
+    assert chain_as_dict(edited) == reference_model([*CORPUS, SAMPLE[102], SAMPLE[103], edit[101]])
+    assert journal.get(101) == edit[101]
+    assert not journal.forgotten()
+
+
+def test_failed_update_reverts_journal(journal: MarkovJournal) -> None:
+    """A failed update puts the journal back as it was before the update."""
+    journal.record({1: "an old message", 2: "another old message"})
+    journal.forget(1)
+    before = (len(journal), journal.forgotten(), journal.get(2))
+
+    forgotten = journal.forgotten()
+    journal.record(SAMPLE)
+    # The update failed, so the sample was not learnt and nothing was forgotten
+    journal.remove(SAMPLE)
+    journal.record(forgotten, forgotten=True)
+
+    assert (len(journal), journal.forgotten(), journal.get(2)) == before
+    assert all(message_id not in journal for message_id in SAMPLE)
+
+
+def test_remove_forgotten_keeps_relearnt(journal: MarkovJournal) -> None:
+    """A message learnt again while it was being forgotten is kept."""
+    journal.record({1: "the old text"})
+    journal.forget(1)
+    forgotten = journal.forgotten()
+    journal.record({1: "the new text"})
+
+    journal.remove_forgotten(forgotten)
+
+    assert journal.get(1) == "the new text"
+    assert not journal.forgotten()
@@ -0,0 +1,73 @@
+"""Test that sampling from alias tables matches markovify's distribution."""
+
+import random
+
+import markovify
+import numpy as np
+import pytest
+
+from markovbot.lib.markov import BEGIN, END, CompactChain
+from scripts.check_markov_sampling import chi_squared_p_value
+
+NUM_SUCCESSORS = 40
+NUM_DRAWS = 50_000
+ALPHA = 1e-3
+
+
+@pytest.fixture
+def markovify_chain() -> markovify.Chain:
+    """Build a chain with one state which has many successors, with skewed counts."""
+    successors = {f"word{i}": (i + 1) ** 2 for i in range(NUM_SUCCESSORS)}
+    model = {(BEGIN,): {"the": 1}, ("the",): successors}
+    model.update({(word,): {END: 1} for word in successors})
+    return markovify.Chain([], 1, model=model)
+
+
+@pytest.fixture
+def chain(markovify_chain: markovify.Chain) -> CompactChain:
+    """Convert the chain to a compact chain, with alias tables."""
+    chain = CompactChain.from_markovify_chain(markovify_chain)
+    chain.build_alias_tables(NUM_SUCCESSORS // 2)
+    return chain
+
+
+def draw_slots(words: list[str], successors: list[str]) -> np.ndarray:
+    """Count how many times each successor was drawn."""
+    slots = {word: slot for slot, word in enumerate(successors)}
+    return np.bincount([slots[word] for word in words], minlength=len(successors))
+
+
+def test_high_branching_state_has_alias_table(chain: CompactChain) -> None:
+    """The state with many successors is sampled with an alias table."""
+    row = chain.state_index((chain.vocabulary.id("the"),))
+    assert chain.alias_tables.tables_for(np.array([row]))[0] >= 0
+
+
+@pytest.mark.parametrize("sampler", ["move_id", "move_ids", "markovify"])
+def test_sampling_matches_counts(chain: CompactChain, markovify_chain: markovify.Chain, sampler: str) -> None:
+    """Each sampler draws successors in proportion to their counts."""
+    random.seed(0)
+    rng = np.random.default_rng(0)
+    row = chain.state_index((chain.vocabulary.id("the"),))
+    start, end = int(chain.offsets[row]), int(chain.offsets[row + 1])
+    successors = chain.vocabulary.words(chain.successors[start:end].tolist())
+    counts = np.diff(chain.cumulative_counts[start:end].astype(np.int64), prepend=0)
+    expected = counts / counts.sum() * NUM_DRAWS
+
+    if sampler == "move_id":
+        drawn = chain.vocabulary.words([chain.move_id(row) for _ in range(NUM_DRAWS)])
+    elif sampler == "move_ids":
+        drawn = chain.vocabulary.words(chain.move_ids(np.full(NUM_DRAWS, row), rng).tolist())
+    else:
+        drawn = [markovify_chain.move(("the",)) for _ in range(NUM_DRAWS)]
+
+    assert chi_squared_p_value(draw_slots(drawn, successors), expected) > ALPHA
+
+
+def test_chi_squared_rejects_wrong_distribution() -> None:
+    """Uniform draws do not pass as draws from the skewed counts."""
+    counts = np.array([(i + 1) ** 2 for i in range(NUM_SUCCESSORS)])
+    expected = counts / counts.sum() * NUM_DRAWS
+    observed = np.full(NUM_SUCCESSORS, NUM_DRAWS // NUM_SUCCESSORS)
+
+    assert chi_squared_p_value(observed, expected) < ALPHA
@@ -0,0 +1,130 @@
+"""Test round-tripping chains through array files and delta logs."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from markovbot.lib.array_store import read_arrays, read_header, write_arrays
+from markovbot.lib.delta_log import DELTA_RECORD_MAGIC, append_delta, last_sequence, read_deltas
+
+CHUNK_BYTES = 256
+
+FIRST_DELTA = {
+    ("___BEGIN__",): {"the": 2, "a": 1},
+    ("the",): {"cat": 2, "café": 1},
+    ("cat",): {"___END__": 2},
+}
+SECOND_DELTA = {
+    ("the",): {"cat": -1, "dog": 3},
+    ("dog",): {"___END__": 3},
+}
+
+
+@pytest.fixture
+def arrays() -> dict[str, np.ndarray]:
+    """Make arrays of several dtypes and shapes, some spanning many chunks."""
+    rng = np.random.default_rng(0)
+    return {
+        "offsets": np.arange(1000, dtype=np.int64),
+        "ids": rng.integers(0, 2**32, size=(300, 3), dtype=np.uint32),
+        "weights": rng.random(77, dtype=np.float32),
+        "empty": np.empty(0, dtype=np.int32),
+    }
+
+
+def corrupt_byte(location: Path, offset: int) -> None:
+    """Flip the bits of one byte of a file."""
+    data = bytearray(location.read_bytes())
+    data[offset] ^= 0xFF
+    location.write_bytes(bytes(data))
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_arrays_round_trip(tmp_path: Path, arrays: dict[str, np.ndarray], *, compress: bool) -> None:
+    """Arrays and metadata are read back exactly as they were written."""
+    location = tmp_path / "chain.markov"
+    write_arrays(location, arrays, {"state_size": 2}, compress=compress, chunk_bytes=CHUNK_BYTES)
+
+    read, metadata = read_arrays(location, verify=True)
+
+    assert metadata == {"state_size": 2}
+    assert read.keys() == arrays.keys()
+    for name, array in arrays.items():
+        assert read[name].dtype == array.dtype
+        np.testing.assert_array_equal(read[name], array)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_arrays_corrupt_chunk(tmp_path: Path, arrays: dict[str, np.ndarray], *, compress: bool) -> None:
+    """A corrupt chunk is reported with the array it is in."""
+    location = tmp_path / "chain.markov"
+    write_arrays(location, arrays, compress=compress, chunk_bytes=CHUNK_BYTES)
+    header = read_header(location)
+    offset, length, _, _ = header["arrays"]["ids"]["chunks"][2]
+    corrupt_byte(location, header["data_start"] + offset + length // 2)
+
+    with pytest.raises(ValueError, match="chunk 2 of array ids"):
+        read_arrays(location, verify=True)
+
+
+def test_arrays_not_an_array_file(tmp_path: Path) -> None:
+    """A file which is not an array file is rejected."""
+    location = tmp_path / "chain.markov"
+    location.write_bytes(b"not an array file at all")
+
+    with pytest.raises(ValueError, match="not an array file"):
+        read_arrays(location)
+
+
+def test_deltas_round_trip(tmp_path: Path) -> None:
+    """Deltas are summed in order, and can be read from a sequence onwards."""
+    location = tmp_path / "chain.markov.log"
+    first = append_delta(location, FIRST_DELTA, min_sequence=5)
+    second = append_delta(location, SECOND_DELTA)
+
+    assert (first, second) == (6, 7)
+    assert last_sequence(location) == second
+    assert read_deltas(location) == (
+        {
+            ("___BEGIN__",): {"the": 2, "a": 1},
+            ("the",): {"cat": 1, "café": 1, "dog": 3},
+            ("cat",): {"___END__": 2},
+            ("dog",): {"___END__": 3},
+        },
+        second,
+    )
+    assert read_deltas(location, after_sequence=first) == (SECOND_DELTA, second)
+    assert read_deltas(location, until_sequence=first) == (FIRST_DELTA, first)
+    assert read_deltas(location, after_sequence=second) == ({}, second)
+
+
+def test_deltas_corrupt_crc(tmp_path: Path) -> None:
+    """Reading stops at a record which does not match its checksum."""
+    location = tmp_path / "chain.markov.log"
+    first = append_delta(location, FIRST_DELTA)
+    first_size = location.stat().st_size
+    append_delta(location, SECOND_DELTA)
+    corrupt_byte(location, location.stat().st_size - 1)
+
+    assert read_deltas(location) == (FIRST_DELTA, first)
+
+    # The header is intact, so only reading the payload finds the corruption
+    data = location.read_bytes()
+    assert data[first_size : first_size + len(DELTA_RECORD_MAGIC)] == DELTA_RECORD_MAGIC
+
+
+def test_deltas_incomplete_record(tmp_path: Path) -> None:
+    """A partially written record is ignored, and overwritten by the next append."""
+    location = tmp_path / "chain.markov.log"
+    first = append_delta(location, FIRST_DELTA)
+    append_delta(location, SECOND_DELTA)
+    location.write_bytes(location.read_bytes()[:-3])
+
+    assert last_sequence(location) == first
+    assert read_deltas(location) == (FIRST_DELTA, first)
+
+    third = append_delta(location, SECOND_DELTA)
+
+    assert third == first + 1
+    assert read_deltas(location, after_sequence=first) == (SECOND_DELTA, third)
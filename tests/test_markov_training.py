@@ -0,0 +1,72 @@
+"""Test that the training engines count the same transitions as markovify."""
+
+import markovify
+import pytest
+
+from markovbot.lib.markov_training import StreamingChainTrainer, VectorizedChainTrainer, split_into_runs
+from scripts.benchmark_markov_training import counts_as_dict
+
+CORPUS = [
+    "the cat sat on the mat",
+    "the cat ate the rat\nand then the cat sat down",
+    "a dog sat on the cat",
+    'he said "the cat sat" to me',
+    "the dog (who was big) sat down",
+    "the [cat] sat",
+    "'quoted at the start",
+    "it's the cat's mat",
+    "first line\n\n\nsecond line after blank lines",
+    "   spaces  around   the  words   ",
+    "the cat sat on the mat",
+    "one",
+    "",
+]
+
+
+def reference_model(messages: list[str], state_size: int) -> dict:
+    """Train markovify on the messages, one per line."""
+    corpus = "\n".join(message.strip() for message in messages)
+    return markovify.NewlineText(corpus, state_size=state_size).chain.model
+
+
+@pytest.mark.parametrize("trainer_class", [StreamingChainTrainer, VectorizedChainTrainer])
+@pytest.mark.parametrize("state_size", [1, 2, 3])
+def test_counts_match_markovify(trainer_class: type, state_size: int) -> None:
+    """The counts are exactly the same as markovify's."""
+    trainer = trainer_class(state_size)
+    trainer.add_messages(CORPUS)
+
+    assert counts_as_dict(trainer.counts()) == reference_model(CORPUS, state_size)
+
+
+@pytest.mark.parametrize("state_size", [1, 2])
+def test_counts_match_markovify_across_flushes(state_size: int) -> None:
+    """Flushing the pending transitions many times gives the same counts."""
+    trainer = VectorizedChainTrainer(state_size, max_pending=4)
+    for message in CORPUS:
+        trainer.add_messages([message])
+
+    assert counts_as_dict(trainer.counts()) == reference_model(CORPUS, state_size)
+
+
+@pytest.mark.parametrize(
+    "message",
+    ['he said "hi" to me', "the dog (who was big) sat", "the [cat] sat", "'quoted at the start", "the end quoted'"],
+)
+def test_split_into_runs_rejects_quotes_and_brackets(message: str) -> None:
+    """Sentences with quotes or brackets are rejected, like markovify does."""
+    assert markovify.Text.reject_pat.search(message)
+    assert list(split_into_runs([message])) == []
+    assert list(split_into_runs([message], well_formed=False)) == [message.split()]
+
+
+def test_split_into_runs_keeps_apostrophes() -> None:
+    """Apostrophes inside words are not quotes."""
+    assert list(split_into_runs(["it's the cat's mat"])) == [["it's", "the", "cat's", "mat"]]
+
+
+def test_split_into_runs_skips_blank_lines() -> None:
+    """Each line is a sentence, and blank lines are skipped."""
+    runs = list(split_into_runs(["first line\n\n  \nsecond line", "", "   ", "  padded   words  "]))
+
+    assert runs == [["first", "line"], ["second", "line"], ["padded", "words"]]
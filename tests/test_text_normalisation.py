@@ -0,0 +1,58 @@
+"""Test that normalising a batch of messages matches normalising each one."""
+
+import pytest
+
+from markovbot.lib.text_normalisation import BATCH_SEPARATOR, STEPS, TextNormaliser
+
+MESSAGES = [
+    "hello <@123> and <@!456>, see <#789> or <@&42>",
+    "@everyone look at https://example.com/page?q=1 now",
+    "<https://example.com/hidden> is a hidden link",
+    "nice <:pog:1234> and <a:dance:5678> emojis \U0001f600\U0001f389",
+    "café naïve über “quotes”",
+    "   lots   of\t\twhitespace   \n  and a newline  ",
+    "@here",
+    "",
+    "   ",
+    "an email@everyonething.com is not a mention",
+    "ends with a link https://example.com",
+    "\U0001f600",
+]
+
+
+@pytest.mark.parametrize("steps", [list(STEPS), ["mentions", "whitespace"], ["urls"], []])
+def test_batch_matches_each_message(steps: list[str]) -> None:
+    """Each message in a batch is normalised exactly as it is on its own."""
+    normaliser = TextNormaliser(steps)
+
+    assert normaliser.normalise_batch(MESSAGES) == [normaliser(message) for message in MESSAGES]
+
+
+def test_batch_with_separator_in_message() -> None:
+    """A message containing the separator is not split into two."""
+    normaliser = TextNormaliser(list(STEPS))
+    messages = ["first message", f"has a {BATCH_SEPARATOR} in it", "last <@1> message"]
+
+    normalised = normaliser.normalise_batch(messages)
+
+    assert len(normalised) == len(messages)
+    assert normalised == [normaliser(message) for message in messages]
+
+
+def test_batch_with_step_removing_separator() -> None:
+    """A step which removes the separator falls back to one message at a time."""
+    normaliser = TextNormaliser([lambda text: text.replace(BATCH_SEPARATOR, ""), "whitespace"])
+    messages = ["one  message", "two   messages", "three"]
+
+    assert normaliser.normalise_batch(messages) == [normaliser(message) for message in messages]
+
+
+def test_empty_batch() -> None:
+    """An empty batch is normalised to an empty list."""
+    assert TextNormaliser(list(STEPS)).normalise_batch([]) == []
+
+
+def test_unknown_step() -> None:
+    """An unknown step name is rejected."""
+    with pytest.raises(ValueError, match="Unknown text normalisation step"):
+        TextNormaliser(["not_a_step"])